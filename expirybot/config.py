@@ -8,6 +8,8 @@ from os.path import abspath, dirname, join as pjoin
 
 import requests
 
+from .domain_rules import DomainRules
+
 
 class Config():
     CONFIG_JSON = abspath(pjoin(dirname(__file__), '..', 'config.json'))
@@ -26,6 +28,20 @@ class Config():
 
         self.mailgun_api_key = config.get('mailgun_api_key', 'INVALID')
 
+        self.email_transport = config.get('email_transport', 'mailgun')
+
+        self.smtp_host = config.get('smtp_host', 'localhost')
+
+        self.smtp_port = config.get('smtp_port', 25)
+
+        self.smtp_username = config.get('smtp_username', None)
+
+        self.smtp_password = config.get('smtp_password', None)
+
+        self.smtp_starttls = config.get('smtp_starttls', False)
+
+        self.smtp_pool_size = config.get('smtp_pool_size', 2)
+
         self.rollbar_api_key = config.get('rollbar_api_key', None)
 
         self.rollbar_environment = config.get('rollbar_environment', 'dev')
@@ -50,6 +66,33 @@ class Config():
             'user_agent', self._default_user_agent()
         )
 
+        self.negative_cache_backoff_days = config.get(
+            'negative_cache_backoff_days', 7
+        )
+
+        self.negative_cache_max_backoff_days = config.get(
+            'negative_cache_max_backoff_days', 90
+        )
+
+        self.negative_cache_max_unchecked_backoff_days = config.get(
+            'negative_cache_max_unchecked_backoff_days', 3
+        )
+
+        self.check_recipient_dns = config.get('check_recipient_dns', True)
+
+        self.dns_nameservers = config.get('dns_nameservers', None)
+
+    @property
+    def blacklisted_domains(self):
+        return self.domain_rules
+
+    @blacklisted_domains.setter
+    def blacklisted_domains(self, rules):
+        """
+        Compile the rules once, whenever they're set.
+        """
+        self.domain_rules = DomainRules(rules)
+
     @property
     def data_dir(self):
         return abspath(pjoin(dirname(__file__), '..', 'data'))
@@ -63,6 +106,12 @@ class Config():
             'uids',
             'created_date',
             'expiry_date',
+            # derived columns, see pgp_key.DERIVED_COLUMNS_VERSION
+            'derived_version',
+            'recipient_email_line',
+            'is_strong',
+            'exclusion_reason',
+            'domains',
         ]
 
     def _default_user_agent(self):
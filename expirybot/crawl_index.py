@@ -0,0 +1,170 @@
+import array
+import logging
+import sqlite3
+
+from os.path import join as pjoin
+
+from .config import config
+
+LOG = logging.getLogger(__name__)
+
+
+class CrawlIndex():
+    """
+    Track what a night's crawl has already fetched.
+
+    - fingerprints seen so far, as 20-byte digests, so a key reached via
+      several short IDs is only written once
+    - a persistent table of short IDs which, last time we asked, only matched
+      keys through a subkey (or a collision), and the primary fingerprints
+      they returned. Those are deferred to the end of the crawl and skipped
+      if every key they point at has been fetched already.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, filename=None):
+        self.filename = filename or pjoin(config.data_dir, 'crawl_index.db')
+
+        self._conn = sqlite3.connect(self.filename, timeout=60)
+        self._create_tables()
+        self._uncommitted = 0
+
+        self._seen = set()
+
+        self.duplicates = 0
+        self.skipped_short_ids = 0
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def first_sighting(self, key):
+        """
+        Return True the first time a key is seen this crawl.
+        """
+        digest = bytes.fromhex(key.fingerprint.hex_format[2:])
+
+        if digest in self._seen:
+            self.duplicates += 1
+            return False
+
+        self._seen.add(digest)
+        return True
+
+    def has_fetched(self, fingerprint):
+        return bytes.fromhex(fingerprint[2:]) in self._seen
+
+    def is_subkey_only(self, short_id):
+        return self._subkey_only_fingerprints(short_id) is not None
+
+    def can_skip(self, short_id):
+        """
+        True if the short ID is known to only lead to keys we've fetched.
+        """
+        fingerprints = self._subkey_only_fingerprints(short_id)
+
+        if fingerprints is None:
+            return False
+
+        if all(self.has_fetched(fp) for fp in fingerprints):
+            self.skipped_short_ids += 1
+            return True
+
+        return False
+
+    def record_short_id(self, short_id, keys):
+        """
+        Remember whether `short_id` matched any of `keys` on their primary
+        key, or only through a subkey.
+        """
+        short_id = normalize_short_id(short_id)
+
+        if not keys or any(k.long_id.endswith(short_id) for k in keys):
+            self._conn.execute(
+                'DELETE FROM subkey_short_ids WHERE short_id = ?',
+                (short_id,)
+            )
+        else:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO subkey_short_ids '
+                '(short_id, fingerprints) VALUES (?, ?)',
+                (short_id, ' '.join(k.fingerprint.hex_format for k in keys))
+            )
+
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def _subkey_only_fingerprints(self, short_id):
+        row = self._conn.execute(
+            'SELECT fingerprints FROM subkey_short_ids WHERE short_id = ?',
+            (normalize_short_id(short_id),)
+        ).fetchone()
+
+        return row[0].split(' ') if row is not None else None
+
+    def _create_tables(self):
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS subkey_short_ids ('
+            '  short_id TEXT PRIMARY KEY,'
+            '  fingerprints TEXT NOT NULL'
+            ')'
+        )
+        self._conn.commit()
+
+
+class ShortIdQueue():
+    """
+    A compact list of short IDs held as 32-bit integers, with the key count
+    from each one's dump line (0 if the line didn't have one).
+    """
+
+    def __init__(self):
+        self._ids = array.array('L')
+        self._key_counts = array.array('L')
+
+    def append(self, short_id, line=None):
+        fields = line.split() if line else []
+
+        self._ids.append(int(normalize_short_id(short_id), 16))
+        self._key_counts.append(
+            int(fields[1]) if len(fields) > 1 and fields[1].isdigit() else 0
+        )
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        for short_id, _ in self.items():
+            yield short_id
+
+    def items(self):
+        """
+        Yield (short_id, dump line), the line as NegativeCache expects it,
+        or None if the short ID didn't come with a key count.
+        """
+        for value, key_count in zip(self._ids, self._key_counts):
+            short_id = '0x{:08X}'.format(value)
+
+            if key_count:
+                yield short_id, '{} {}'.format(short_id, key_count)
+            else:
+                yield short_id, None
+
+
+def normalize_short_id(short_id):
+    """
+    '0x309f635d' -> '309F635D'
+    """
+    short_id = short_id.strip().upper()
+
+    if short_id.startswith('0X'):
+        short_id = short_id[2:]
+
+    return short_id[-8:]
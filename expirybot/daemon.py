@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+
+"""
+- run the crawl, filter, prepare and send steps as one long-running process
+- each stage is a thread. The crawl, filter and prepare stages are joined by
+  bounded queues, so a slow stage holds up the one before it rather than
+  piling up work
+- the prepare stage writes keys to be emailed to ${DATA}/daemon_state.db,
+  and the send stage emails the most valuable of them from there, so the
+  rate limited sender never holds up the crawl. A restart picks up where
+  it left off
+- crawl nightly, and email expiring keys as soon as they're found (within
+  the send window) instead of waiting for the next cron job
+- stop cleanly on SIGTERM or SIGINT
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import queue
+import signal
+import sqlite3
+import threading
+import time
+
+from os.path import join as pjoin
+
+from .config import config
+from .dns_check import DomainValidator
+from .exceptions import DailyCapReached
+from .key_lookup import CachedKeyLookup
+from .logs import log_sampled_counts
+from .make_fingerprint_csv import run_crawl
+from .make_keys_expiring_csv import (
+    Stats, check_recipient_domains, dead_domain_fingerprints, handle_key,
+    setup_output_csvs
+)
+from .pgp_key import PGPKey
+from .send_emails import (
+    already_emailed, drop_stale_keys, group_keys_by_recipient,
+    make_rate_limiter, make_transport, send_to_recipient,
+    setup_output_csvs as setup_emails_sent_csv
+)
+from .send_queue import SendQueue, load_domain_renewal_rates
+from .sent_ledger import SentLedger
+from .utils import key_to_csv_row, make_today_data_dir, setup_logging
+
+LOG = logging.getLogger(__name__)
+
+CRAWL_AT = datetime.time(0, 30)
+SEND_HOURS = range(9, 15)  # 09:00 - 14:59, as the cron jobs did
+
+QUEUE_SIZE = 1000
+
+
+class ShuttingDown(Exception):
+    pass
+
+
+class StartOfCrawl():
+    def __init__(self, day):
+        self.day = day
+
+
+class EndOfCrawl():
+    pass
+
+
+class DaemonState():
+    """
+    Keys waiting to be emailed, persisted so a restart doesn't lose them.
+    A key stays here until it's been sent or dropped.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or pjoin(config.data_dir, 'daemon_state.db')
+
+        self._conn = sqlite3.connect(self.filename, timeout=60)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pending ('
+            '  fingerprint TEXT PRIMARY KEY,'
+            '  key_row TEXT NOT NULL,'
+            '  queued_at REAL NOT NULL'
+            ')'
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def add(self, key):
+        row = {k: str(v) if v is not None else None for k, v in
+               key_to_csv_row(key).items()}
+
+        self._conn.execute(
+            'INSERT OR IGNORE INTO pending (fingerprint, key_row, queued_at) '
+            'VALUES (?, ?, ?)',
+            (key.fingerprint.hex_format, json.dumps(row), time.time())
+        )
+        self._conn.commit()
+
+    def remove(self, keys):
+        self._conn.executemany(
+            'DELETE FROM pending WHERE fingerprint = ?',
+            [(key.fingerprint.hex_format,) for key in keys]
+        )
+        self._conn.commit()
+
+    def pending_keys(self):
+        for (key_row,) in self._conn.execute(
+                'SELECT key_row FROM pending ORDER BY queued_at'):
+            yield PGPKey(**json.loads(key_row))
+
+    def still_pending(self, keys):
+        """
+        Return those of `keys` which haven't been removed in the meantime.
+        """
+        return [
+            key for key in keys if self._conn.execute(
+                'SELECT 1 FROM pending WHERE fingerprint = ?',
+                (key.fingerprint.hex_format,)
+            ).fetchone() is not None
+        ]
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+
+
+class PipelineDaemon():
+    # How long the prepare stage collects keys before writing them out, and
+    # the send stage uses its queue before reloading it, so someone with
+    # several expiring keys still gets one email.
+    PREPARE_INTERVAL_SECONDS = 60
+
+    POLL_SECONDS = 1
+
+    def __init__(self, short_ids_file=None, keydump=None, workers=None,
+                 queue_size=QUEUE_SIZE, crawl_now=False,
+                 clock=datetime.datetime.now):
+        self.short_ids_file = short_ids_file
+        self.keydump = keydump
+        self.workers = workers
+        self.crawl_now = crawl_now
+        self.clock = clock
+
+        self.stopping = threading.Event()
+
+        # crawl -> filter: every key; filter -> prepare: keys to email.
+        # prepare -> send goes through DaemonState.
+        self.keys_queue = queue.Queue(queue_size)
+        self.expiring_queue = queue.Queue(queue_size)
+
+        self.threads = [
+            threading.Thread(target=self._run_stage, args=(stage,),
+                             name=stage.__name__)
+            for stage in (self.crawl_stage, self.filter_stage,
+                          self.prepare_stage, self.send_stage)
+        ]
+
+    def run(self):
+        for thread in self.threads:
+            thread.start()
+
+        while any(thread.is_alive() for thread in self.threads):
+            for thread in self.threads:
+                thread.join(self.POLL_SECONDS)
+
+        LOG.info('All stages stopped')
+
+    def stop(self, *args):
+        LOG.info('Shutting down')
+        self.stopping.set()
+
+    def _run_stage(self, stage):
+        try:
+            stage()
+        except ShuttingDown:
+            pass
+        except Exception as e:
+            LOG.exception(e)
+            self.stop()  # don't leave the other stages blocked on us
+
+        LOG.info('{} stopped'.format(stage.__name__))
+
+    def crawl_stage(self):
+        next_crawl = self.clock() if self.crawl_now else \
+            next_crawl_time(self.clock())
+
+        while True:
+            self._sleep_until(next_crawl)
+
+            day = self.clock().date()
+            os.makedirs(make_today_data_dir(day), exist_ok=True)
+
+            LOG.info('Starting crawl for {}'.format(day))
+            self._put(self.keys_queue, StartOfCrawl(day))
+
+            run_crawl(
+                self.short_ids_file, self.keydump, self.workers,
+                on_key=lambda key: self._put(self.keys_queue, key)
+            )
+
+            self._put(self.keys_queue, EndOfCrawl())
+            next_crawl = next_crawl_time(self.clock())
+
+    def filter_stage(self):
+        with contextlib.ExitStack() as stack:
+            while True:
+                item = self._get(self.keys_queue)
+
+                if isinstance(item, StartOfCrawl):
+                    stats = Stats()
+                    data_dir = make_today_data_dir(item.day)
+                    expiring_csv, excluded_csv = stack.enter_context(
+                        setup_output_csvs(
+                            pjoin(data_dir, 'keys_expiring.csv'),
+                            pjoin(data_dir, 'keys_excluded.csv')
+                        )
+                    )
+
+                elif isinstance(item, EndOfCrawl):
+                    stack.close()  # renames the CSVs into place
+                    check_recipient_domains(
+                        pjoin(data_dir, 'keys_expiring.csv'),
+                        pjoin(data_dir, 'keys_excluded.csv'),
+                        stats
+                    )
+                    LOG.info('Crawl done: excluded {} ({}), {} expiring'
+                             .format(stats.excluded_count,
+                                     dict(stats.exclusion_reasons),
+                                     stats.expiring_count))
+                    log_sampled_counts(reset=True)  # we never exit
+
+                elif handle_key(item, expiring_csv, excluded_csv, stats):
+                    self._put(self.expiring_queue, item)
+
+    def prepare_stage(self):
+        """
+        Write keys to be emailed to DaemonState, dropping those which are no
+        use. Never waits for the send stage.
+        """
+        with contextlib.ExitStack() as stack:
+            state = stack.enter_context(contextlib.closing(DaemonState()))
+            ledger = stack.enter_context(contextlib.closing(SentLedger()))
+
+            if config.check_recipient_dns:
+                validator = stack.enter_context(
+                    contextlib.closing(DomainValidator())
+                )
+            else:
+                validator = None
+
+            LOG.info('Resuming with {} keys pending'.format(len(state)))
+            self._drop_useless_keys(list(state.pending_keys()), ledger, state,
+                                    validator)
+
+            while True:
+                keys = self._collect(self.expiring_queue,
+                                     self.PREPARE_INTERVAL_SECONDS)
+
+                for key in keys:
+                    state.add(key)
+
+                if keys:
+                    self._drop_useless_keys(keys, ledger, state, validator)
+
+    def send_stage(self):
+        """
+        Email recipients from DaemonState, most valuable first. The queue is
+        reloaded regularly, so keys found since are ranked alongside the
+        rest, however long the backlog.
+        """
+        rate_limiter = make_rate_limiter()
+
+        with contextlib.closing(DaemonState()) as state, \
+                contextlib.closing(SentLedger()) as ledger, \
+                contextlib.closing(make_transport()) as transport, \
+                contextlib.closing(CachedKeyLookup()) as key_lookup:
+
+            send_queue, reload_at = None, None
+
+            while True:
+                self._wait_for_send_window()
+
+                if not send_queue or self.clock() >= reload_at:
+                    send_queue = self._load_send_queue(state, ledger)
+                    reload_at = self.clock() + datetime.timedelta(
+                        seconds=self.PREPARE_INTERVAL_SECONDS)
+
+                if not send_queue:
+                    self._wait(self.POLL_SECONDS)
+                    continue
+
+                email_address, keys = send_queue.pop()
+                keys = state.still_pending(keys)
+
+                if not keys:
+                    continue
+
+                try:
+                    self._send((email_address, keys), ledger, transport,
+                               rate_limiter, key_lookup)
+
+                except DailyCapReached as e:
+                    LOG.info('Waiting for tomorrow: {}'.format(e))
+                    self._sleep_until(next_midnight(self.clock()))
+                    send_queue = None  # and rank everyone again
+                    continue
+
+                state.remove(keys)
+
+    def _send(self, item, ledger, transport, rate_limiter, key_lookup):
+        data_dir = make_today_data_dir(self.clock().date())
+        os.makedirs(data_dir, exist_ok=True)
+
+        with setup_emails_sent_csv(
+                pjoin(data_dir, 'emails_sent.csv')) as emails_sent_csv:
+
+            for recipient_keys in drop_stale_keys([item], key_lookup):
+                send_to_recipient(recipient_keys, emails_sent_csv, ledger,
+                                  transport, rate_limiter)
+
+    def _load_send_queue(self, state, ledger):
+        """
+        Group every pending key by recipient, in one SendQueue.
+        """
+        send_queue = SendQueue(ledger, load_domain_renewal_rates())
+
+        for email_address, recipient_keys in \
+                group_keys_by_recipient(state.pending_keys()).items():
+            send_queue.push(email_address, recipient_keys)
+
+        return send_queue
+
+    def _drop_useless_keys(self, keys, ledger, state, validator=None):
+        """
+        Forget keys which have expired, whose domain can't receive email or
+        which we've already emailed about.
+        """
+        if validator is not None:
+            dead = dead_domain_fingerprints(keys, validator)
+        else:
+            dead = set()
+
+        for key in keys:
+            if key.has_expired or key.fingerprint in dead or \
+                    already_emailed(key, ledger):
+                state.remove([key])
+
+    def _put(self, q, item):
+        while True:
+            self._check_stopping()
+
+            try:
+                q.put(item, timeout=self.POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while True:
+            self._check_stopping()
+
+            try:
+                return q.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def _collect(self, q, seconds):
+        """
+        Gather whatever arrives on the queue over the next `seconds`.
+        """
+        deadline = time.monotonic() + seconds
+        items = []
+
+        while time.monotonic() < deadline:
+            self._check_stopping()
+
+            try:
+                items.append(q.get(timeout=self.POLL_SECONDS))
+            except queue.Empty:
+                continue
+
+        return items
+
+    def _wait_for_send_window(self):
+        while not in_send_window(self.clock()):
+            self._wait(self.POLL_SECONDS * 60)
+
+    def _sleep_until(self, when):
+        while self.clock() < when:
+            self._wait(self.POLL_SECONDS * 10)
+
+    def _wait(self, seconds):
+        self._check_stopping()
+        self.stopping.wait(seconds)
+        self._check_stopping()
+
+    def _check_stopping(self):
+        if self.stopping.is_set():
+            raise ShuttingDown()
+
+
+def next_crawl_time(now, at=CRAWL_AT):
+    crawl_time = datetime.datetime.combine(now.date(), at)
+
+    if crawl_time <= now:
+        crawl_time += datetime.timedelta(days=1)
+
+    return crawl_time
+
+
+def next_midnight(now):
+    return datetime.datetime.combine(
+        now.date() + datetime.timedelta(days=1), datetime.time(0)
+    )
+
+
+def in_send_window(now, hours=SEND_HOURS):
+    return now.hour in hours
+
+
+def main():
+    args = parse_args()
+
+    setup_logging(pjoin(config.data_dir, 'daemon.log'))
+
+    daemon = PipelineDaemon(
+        short_ids_file=args.short_ids_file,
+        keydump=args.keydump,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        crawl_now=args.crawl_now
+    )
+
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+
+    daemon.run()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'short_ids_file', nargs='?',
+        help='File of short key IDs to crawl each night'
+    )
+    parser.add_argument(
+        '--keydump', nargs='+', metavar='PATH',
+        help='Crawl these keydump files instead of the keyserver'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Processes for parsing keydump files (default: one per CPU)'
+    )
+    parser.add_argument(
+        '--queue-size', type=int, default=QUEUE_SIZE,
+        help='Maximum items waiting between stages (default: {})'.format(
+            QUEUE_SIZE)
+    )
+    parser.add_argument(
+        '--crawl-now', action='store_true',
+        help="Start a crawl straight away rather than waiting for {}".format(
+            CRAWL_AT.strftime('%H:%M'))
+    )
+
+    args = parser.parse_args()
+
+    if not args.keydump and not args.short_ids_file:
+        parser.error('Give either a short IDs file or --keydump')
+
+    return args
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import logging
+import sqlite3
+import time
+
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join as pjoin
+
+import dns.exception
+import dns.resolver
+
+from .config import config
+
+LOG = logging.getLogger(__name__)
+
+LIVE = 'live'  # has an MX, or failing that an A/AAAA record
+DEAD = 'dead'  # doesn't exist, has no MX or address, or a null MX
+UNKNOWN = 'unknown'  # lookup failed (timeout, SERVFAIL): give benefit of doubt
+
+# Nightly runs would never hit a cache honouring 5 minute DNS TTLs, so keep
+# live answers for at least a day, and re-check dead domains daily.
+MIN_LIVE_SECONDS = 24 * 60 * 60
+MAX_LIVE_SECONDS = 7 * 24 * 60 * 60
+DEAD_SECONDS = 24 * 60 * 60
+
+Resolution = namedtuple('Resolution', ['status', 'ttl'])
+
+
+class DnsPythonResolver():
+    """
+    Decide whether a domain can receive email. `nameservers` and `port` let
+    tests point it at a local stub server; by default the system's
+    resolv.conf is used.
+    """
+
+    def __init__(self, nameservers=None, port=53, timeout=5):
+        self._resolver = dns.resolver.Resolver(configure=not nameservers)
+
+        if nameservers:
+            self._resolver.nameservers = nameservers
+
+        self._resolver.port = port
+        self._resolver.lifetime = timeout
+
+    def resolve(self, domain):
+        try:
+            answer = self._resolver.resolve(domain, 'MX')
+
+        except dns.resolver.NXDOMAIN:
+            return Resolution(DEAD, None)
+
+        except dns.resolver.NoAnswer:
+            return self._resolve_address(domain)
+
+        except dns.exception.DNSException as e:
+            LOG.info('MX lookup failed for {}: {!r}'.format(domain, e))
+            return Resolution(UNKNOWN, None)
+
+        if all(str(mx.exchange) == '.' for mx in answer):
+            return Resolution(DEAD, answer.rrset.ttl)  # null MX, RFC 7505
+
+        return Resolution(LIVE, answer.rrset.ttl)
+
+    def _resolve_address(self, domain):
+        for rdtype in ('A', 'AAAA'):
+            try:
+                answer = self._resolver.resolve(domain, rdtype)
+
+            except dns.resolver.NoAnswer:
+                continue
+
+            except dns.resolver.NXDOMAIN:
+                return Resolution(DEAD, None)
+
+            except dns.exception.DNSException as e:
+                LOG.info('{} lookup failed for {}: {!r}'.format(
+                    rdtype, domain, e))
+                return Resolution(UNKNOWN, None)
+
+            return Resolution(LIVE, answer.rrset.ttl)
+
+        return Resolution(DEAD, None)
+
+
+class DomainValidator():
+    """
+    Check many recipient domains at once: answers come from a persistent
+    cache (data/dns_cache.db) where possible, and the rest are resolved
+    concurrently. Failed lookups aren't cached.
+    """
+
+    def __init__(self, resolver=None, cache_filename=None, max_workers=16,
+                 clock=time.time):
+        self.resolver = resolver or DnsPythonResolver(
+            nameservers=config.dns_nameservers
+        )
+        self.cache_filename = cache_filename or pjoin(
+            config.data_dir, 'dns_cache.db'
+        )
+
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        self._conn = sqlite3.connect(self.cache_filename, timeout=60)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS domains ('
+            '  domain TEXT PRIMARY KEY,'
+            '  status TEXT NOT NULL,'
+            '  expires_at REAL NOT NULL'
+            ')'
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+    def validate_many(self, domains):
+        """
+        Return an OrderedDict of domain -> LIVE, DEAD or UNKNOWN.
+        """
+        domains = list(OrderedDict.fromkeys(d.lower() for d in domains))
+        now = self._clock()
+
+        results = OrderedDict((domain, None) for domain in domains)
+        futures = {}
+
+        for domain in domains:
+            cached = self._cached_status(domain, now)
+
+            if cached is not None:
+                results[domain] = cached
+            else:
+                futures[domain] = self._executor.submit(
+                    self.resolver.resolve, domain
+                )
+
+        for domain, future in futures.items():
+            try:
+                resolution = future.result()
+            except Exception as e:
+                LOG.warn('Failed to resolve {}: {!r}'.format(domain, e))
+                resolution = Resolution(UNKNOWN, None)
+
+            results[domain] = resolution.status
+            self._store(domain, resolution, now)
+
+        self._conn.commit()
+
+        LOG.info('Checked {} domains: {} from cache, {} resolved'.format(
+            len(domains), len(domains) - len(futures), len(futures)))
+
+        return results
+
+    def _cached_status(self, domain, now):
+        row = self._conn.execute(
+            'SELECT status FROM domains WHERE domain = ? AND expires_at > ?',
+            (domain, now)
+        ).fetchone()
+
+        return row[0] if row is not None else None
+
+    def _store(self, domain, resolution, now):
+        if resolution.status == LIVE:
+            seconds = min(MAX_LIVE_SECONDS,
+                          max(MIN_LIVE_SECONDS, resolution.ttl or 0))
+        elif resolution.status == DEAD:
+            seconds = DEAD_SECONDS
+        else:
+            return
+
+        self._conn.execute(
+            'INSERT OR REPLACE INTO domains (domain, status, expires_at) '
+            'VALUES (?, ?, ?)',
+            (domain, resolution.status, now + seconds)
+        )
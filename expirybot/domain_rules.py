@@ -0,0 +1,119 @@
+import hashlib
+import re
+
+REGEX_PREFIX = 're:'
+
+_RULE = object()  # marks the end of a suffix rule in the trie
+
+
+class DomainRules():
+    """
+    A compiled set of domain rules, e.g. from `blacklisted_domains`:
+
+        example.com       only example.com itself
+        *.example.com     any subdomain of example.com, not example.com
+        .example.com      example.com and any subdomain of it
+        re:^mail\\d+\\.   any domain matching the regular expression
+
+    Exact rules are a frozenset and suffix rules a trie of reversed labels,
+    so matching costs the same however many rules there are. `match`
+    returns the rule responsible, so it can be logged as the reason.
+    `digest` identifies the rules, for caching results worked out with them.
+    """
+
+    def __init__(self, rules=()):
+        exact = {}
+        self._suffixes = {}
+        self._regexes = []
+
+        for rule in rules:
+            rule = rule.strip()
+
+            if rule.startswith(REGEX_PREFIX):
+                self._regexes.append(
+                    (re.compile(rule[len(REGEX_PREFIX):], re.IGNORECASE), rule)
+                )
+
+            elif rule.startswith('*.'):
+                self._add_suffix(rule[2:], rule)
+
+            elif rule.startswith('.'):
+                exact.setdefault(rule[1:].lower(), rule)
+                self._add_suffix(rule[1:], rule)
+
+            elif rule:
+                exact.setdefault(rule.lower(), rule)
+
+        self._exact_domains = frozenset(exact)
+        self._exact_rules = exact
+        self._rules = list(rules)
+        self.digest = hashlib.sha1(
+            '\n'.join(self._rules).encode('utf-8')
+        ).hexdigest()[:12]
+
+    def __iter__(self):
+        return iter(self._rules)
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __contains__(self, domain):
+        return self.match(domain) is not None
+
+    def match(self, domain):
+        """
+        Return the rule which matches `domain`, or None.
+        """
+        domain = domain.lower().rstrip('.')
+
+        if domain in self._exact_domains:
+            return self._exact_rules[domain]
+
+        rule = self._match_suffix(domain)
+
+        if rule is not None:
+            return rule
+
+        for regex, rule in self._regexes:
+            if regex.search(domain):
+                return rule
+
+        return None
+
+    def match_many(self, domains):
+        """
+        Return a dict of domain -> matching rule (or None), looking each
+        distinct domain up once.
+        """
+        results = {}
+
+        for domain in domains:
+            if domain not in results:
+                results[domain] = self.match(domain)
+
+        return results
+
+    def _add_suffix(self, suffix, rule):
+        node = self._suffixes
+
+        for label in reversed(suffix.lower().split('.')):
+            node = node.setdefault(label, {})
+
+        node.setdefault(_RULE, rule)
+
+    def _match_suffix(self, domain):
+        node = self._suffixes
+        labels = domain.split('.')
+
+        # Walk from the TLD inwards; a rule only matches a strict subdomain,
+        # so stop before the domain's own first label.
+        for label in reversed(labels[1:]):
+            node = node.get(label)
+
+            if node is None:
+                return None
+
+            if _RULE in node:
+                return node[_RULE]
+
+        return None
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""
+- look up which keys carry an email address, or any address at a domain
+- the index is kept up to date by make_fingerprint_csv each night
+
+    python -m expirybot.email_index paul@example.com
+    python -m expirybot.email_index --domain example.com
+"""
+
+import argparse
+import contextlib
+import hashlib
+import logging
+import sqlite3
+
+from os.path import join as pjoin
+
+from .config import config
+
+LOG = logging.getLogger(__name__)
+
+
+class EmailIndex():
+    """
+    On-disk inverted index of normalised email address and domain ->
+    fingerprint. Only keys whose UIDs changed since they were last indexed
+    are rewritten, so a nightly rebuild is mostly reads:
+
+        index.start_build()
+        index.update(key)  # for every non-revoked key
+        index.finish_build()  # forgets keys which weren't seen
+    """
+
+    COMMIT_EVERY = 10000
+
+    def __init__(self, filename=None):
+        self.filename = filename or pjoin(config.data_dir, 'email_index.db')
+
+        self._conn = sqlite3.connect(self.filename, timeout=60)
+        self._create_tables()
+
+        self._uncommitted = 0
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def start_build(self):
+        self._conn.execute('DROP TABLE IF EXISTS temp.seen')
+        self._conn.execute(
+            'CREATE TEMP TABLE seen (fingerprint TEXT PRIMARY KEY)'
+        )
+
+    def update(self, key):
+        fingerprint = key.fingerprint.hex_format
+        emails = sorted(set(normalize_email(email) for email in key.emails))
+        digest = _digest(emails)
+
+        self._conn.execute(
+            'INSERT OR IGNORE INTO temp.seen (fingerprint) VALUES (?)',
+            (fingerprint,)
+        )
+
+        row = self._conn.execute(
+            'SELECT digest FROM indexed WHERE fingerprint = ?', (fingerprint,)
+        ).fetchone()
+
+        if row is not None and row[0] == digest:
+            return
+
+        self._remove(fingerprint)
+        self._conn.executemany(
+            'INSERT OR IGNORE INTO addresses (email, domain, fingerprint) '
+            'VALUES (?, ?, ?)',
+            [(email, email.split('@', 1)[1], fingerprint) for email in emails]
+        )
+        self._conn.execute(
+            'INSERT INTO indexed (fingerprint, digest) VALUES (?, ?)',
+            (fingerprint, digest)
+        )
+
+        self._uncommitted += 1
+
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def finish_build(self):
+        gone = self._conn.execute(
+            'SELECT fingerprint FROM indexed '
+            'WHERE fingerprint NOT IN (SELECT fingerprint FROM temp.seen)'
+        ).fetchall()
+
+        for (fingerprint,) in gone:
+            self._remove(fingerprint)
+
+        self._conn.commit()
+        self._uncommitted = 0
+
+        LOG.info('Email index: dropped {} keys'.format(len(gone)))
+
+    def fingerprints_for_email(self, email):
+        return [fingerprint for (fingerprint,) in self._conn.execute(
+            'SELECT fingerprint FROM addresses WHERE email = ? '
+            'ORDER BY fingerprint', (normalize_email(email),)
+        )]
+
+    def fingerprints_for_domain(self, domain):
+        """
+        Return (email, fingerprint) for every address at the domain.
+        """
+        return self._conn.execute(
+            'SELECT email, fingerprint FROM addresses WHERE domain = ? '
+            'ORDER BY email, fingerprint', (domain.strip().lower(),)
+        ).fetchall()
+
+    def _remove(self, fingerprint):
+        self._conn.execute('DELETE FROM addresses WHERE fingerprint = ?',
+                           (fingerprint,))
+        self._conn.execute('DELETE FROM indexed WHERE fingerprint = ?',
+                           (fingerprint,))
+
+    def _create_tables(self):
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS addresses ('
+            '  email TEXT NOT NULL,'
+            '  domain TEXT NOT NULL,'
+            '  fingerprint TEXT NOT NULL,'
+            '  PRIMARY KEY (email, fingerprint)'
+            ')'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS addresses_domain '
+            'ON addresses (domain)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS addresses_fingerprint '
+            'ON addresses (fingerprint)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS indexed ('
+            '  fingerprint TEXT PRIMARY KEY,'
+            '  digest TEXT NOT NULL'
+            ')'
+        )
+        self._conn.commit()
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+def _digest(emails):
+    return hashlib.sha1('\0'.join(emails).encode('utf-8')).hexdigest()[:16]
+
+
+def main():
+    args = parse_args()
+
+    with contextlib.closing(EmailIndex()) as index:
+        if args.domain:
+            for email, fingerprint in index.fingerprints_for_domain(
+                    args.query):
+                print('{} {}'.format(email, fingerprint))
+        else:
+            for fingerprint in index.fingerprints_for_email(args.query):
+                print(fingerprint)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('query', help='Email address (or domain)')
+    parser.add_argument(
+        '--domain', action='store_true',
+        help='Look up every address at a domain'
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@
 - if it expires in 3 days from now, add it to the output CSV
 """
 
+import argparse
+import contextlib
 import datetime
 import logging
 import io
@@ -15,12 +17,20 @@ from collections import OrderedDict
 from os.path import join as pjoin
 
 from .utils import load_keys_from_csv, make_today_data_dir, setup_logging
-from .keyserver_client import KeyserverClient
+from .key_history import KeyHistory
+from .key_lookup import CachedKeyLookup
+from .sampling import (
+    sample_size_for_interval, stratified_sample, wilson_interval,
+    two_proportion_z_test
+)
 from .config import config
 from .requests_wrapper import RequestsWithSessionAndUserAgent
+from .send_emails import make_rate_limiter
 
 
 def main():
+    args = parse_args()
+
     today = datetime.date.today()
     one_week_ago = today - datetime.timedelta(days=7)
 
@@ -30,35 +40,55 @@ def main():
     logging.info("It's {} and I'm evaluating the performance of {}".format(
         today, one_week_ago))
 
-    expiring_fingerprints = set(
-        k.fingerprint for k in load_keys_from_csv(
-            pjoin(one_week_ago_data_dir, 'keys_expiring.csv')
-        )
+    expiring_keys = load_unique_keys(
+        pjoin(one_week_ago_data_dir, 'keys_expiring.csv')
     )
 
-    emailed_fingerprints = set(
-        k.fingerprint for k in load_keys_from_csv(
-            pjoin(one_week_ago_data_dir, 'emails_sent.csv')
-        )
+    emailed_keys = load_unique_keys(
+        pjoin(one_week_ago_data_dir, 'emails_sent.csv')
     )
 
-    not_emailed_fingerprints = expiring_fingerprints - emailed_fingerprints
+    not_emailed_keys = [
+        key for fingerprint, key in expiring_keys.items()
+        if fingerprint not in emailed_keys
+    ]
+
+    if args.offline:
+        key_lookup = KeyHistory()
+    else:
+        key_lookup = CachedKeyLookup(max_workers=16)
+
+    with contextlib.closing(key_lookup):
+        emailed = evaluate_cohort(
+            list(emailed_keys.values()), key_lookup, args.sample_ci_width)
 
-    renewed_count_emailed = count_renewed_keys(emailed_fingerprints)
-    renewed_count_control = count_renewed_keys(not_emailed_fingerprints)
+        control = evaluate_cohort(
+            not_emailed_keys, key_lookup, args.sample_ci_width)
+
+    _, p_value = two_proportion_z_test(
+        emailed['renewed'], emailed['checked'],
+        control['renewed'], control['checked']
+    )
 
     results = OrderedDict([
         ('date_today', today.isoformat()),
         ('date_evaluating', one_week_ago.isoformat()),
-        ('keys_expiring', len(expiring_fingerprints)),
-        ('keys_emailed', len(emailed_fingerprints)),
-        ('keys_emailed_renewed', renewed_count_emailed),
-        ('keys_emailed_renewed_pct',
-            100 * renewed_count_emailed / len(emailed_fingerprints)),
-        ('keys_not_emailed', len(not_emailed_fingerprints)),
-        ('keys_not_emailed_renewed', renewed_count_control),
-        ('keys_not_emailed_renewed_pct',
-            100 * renewed_count_control / len(not_emailed_fingerprints))
+        ('sample_ci_width', args.sample_ci_width),
+        ('offline', args.offline),
+        ('keys_expiring', len(expiring_keys)),
+        ('keys_emailed', len(emailed_keys)),
+        ('keys_emailed_checked', emailed['checked']),
+        ('keys_emailed_unchecked', emailed['unchecked']),
+        ('keys_emailed_renewed', emailed['renewed']),
+        ('keys_emailed_renewed_pct', emailed['renewed_pct']),
+        ('keys_emailed_renewed_pct_ci', emailed['renewed_pct_ci']),
+        ('keys_not_emailed', len(not_emailed_keys)),
+        ('keys_not_emailed_checked', control['checked']),
+        ('keys_not_emailed_unchecked', control['unchecked']),
+        ('keys_not_emailed_renewed', control['renewed']),
+        ('keys_not_emailed_renewed_pct', control['renewed_pct']),
+        ('keys_not_emailed_renewed_pct_ci', control['renewed_pct_ci']),
+        ('difference_p_value', p_value),
     ])
 
     log_results(results)
@@ -67,19 +97,68 @@ def main():
     email_results(results)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--sample-ci-width', type=float, default=None,
+        help='Check a stratified random sample of each cohort, just big '
+             'enough for a 95%% confidence interval this wide, e.g. 0.1 '
+             'for +/- 5 percentage points. Default: check every key.'
+    )
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='Check renewals against the local key history recorded by '
+             'make_fingerprint_csv instead of querying the keyserver.'
+    )
+    return parser.parse_args()
+
+
+def load_unique_keys(csv_file):
+    return OrderedDict(
+        (key.fingerprint, key) for key in load_keys_from_csv(csv_file)
+    )
+
+
+def evaluate_cohort(keys, key_lookup, sample_ci_width=None):
+    if sample_ci_width is not None:
+        sample_size = sample_size_for_interval(len(keys), sample_ci_width)
+        keys = stratified_sample(keys, sample_size, key_stratum)
+
+        logging.info("Sampled {} keys".format(len(keys)))
+
+    renewed, unchecked = count_renewed_keys(
+        [key.fingerprint for key in keys], key_lookup
+    )
+    checked = len(keys) - unchecked
+    low, high = wilson_interval(renewed, checked)
+
+    return {
+        'checked': checked,
+        'unchecked': unchecked,
+        'renewed': renewed,
+        'renewed_pct': percentage(renewed, checked),
+        'renewed_pct_ci': [100 * low, 100 * high],
+    }
+
+
+def key_stratum(key):
+    return (key.algorithm_number, key.size_bits)
+
+
 def log_results(results):
 
     logging.info("There were {} keys expiring of which we emailed {}".format(
         results['keys_expiring'], results['keys_emailed']))
 
-    logging.info("{} / {} ({:.1f}%) of the keys we emailed have renewed vs "
-                 "{} / {} ({:.1f}%) of the remaining keys".format(
+    logging.info("{} / {} ({:.1f}%) of the keys we checked have renewed vs "
+                 "{} / {} ({:.1f}%) of the remaining keys, p={:.3f}".format(
                      results['keys_emailed_renewed'],
-                     results['keys_emailed'],
+                     results['keys_emailed_checked'],
                      results['keys_emailed_renewed_pct'],
                      results['keys_not_emailed_renewed'],
-                     results['keys_not_emailed'],
-                     results['keys_not_emailed_renewed_pct']))
+                     results['keys_not_emailed_checked'],
+                     results['keys_not_emailed_renewed_pct'],
+                     results['difference_p_value']))
 
 
 def dump_results_to_json(results, filename):
@@ -87,8 +166,9 @@ def dump_results_to_json(results, filename):
         json.dump(results, f, indent=4)
 
 
-def email_results(results, http=None):
+def email_results(results, http=None, rate_limiter=None):
     http = http or RequestsWithSessionAndUserAgent()
+    rate_limiter = rate_limiter or make_rate_limiter()
 
     request_url = 'https://api.mailgun.net/v2/{0}/messages'.format(
         config.mailgun_domain
@@ -98,15 +178,17 @@ def email_results(results, http=None):
         "{}/{} ({:.1f}%) renewed vs "
         "{}/{} ({:.1f}%) not emailed").format(
                 results['keys_emailed_renewed'],
-                results['keys_emailed'],
+                results['keys_emailed_checked'],
                 results['keys_emailed_renewed_pct'],
                 results['keys_not_emailed_renewed'],
-                results['keys_not_emailed'],
+                results['keys_not_emailed_checked'],
                 results['keys_not_emailed_renewed_pct']
     )
 
     email_body = json.dumps(results, indent=4)
 
+    rate_limiter.acquire(counts_towards_daily_cap=False)
+
     try:
         response = http.post(
             request_url,
@@ -125,19 +207,30 @@ def email_results(results, http=None):
         raise
 
 
-def count_renewed_keys(fingerprints):
-    keyserver_client = KeyserverClient()
+def count_renewed_keys(fingerprints, key_lookup):
+    """
+    Return (renewed count, unchecked count). Keys we couldn't look up are
+    counted as unchecked rather than aborting the whole evaluation.
+    """
+    renewed_count = 0
+    unchecked_count = 0
 
-    count = 0
+    for fingerprint, key in key_lookup.lookup_many(fingerprints).items():
+        if key is None:
+            unchecked_count += 1
 
-    for fingerprint in fingerprints:
-        key = keyserver_client.get_key_for_fingerprint(fingerprint)
-
-        if not key.has_expired:
+        elif not key.has_expired:
             logging.info("{} has renewed".format(fingerprint))
-            count += 1
+            renewed_count += 1
+
+    return renewed_count, unchecked_count
+
 
-    return count
+def percentage(count, total):
+    if total:
+        return 100 * count / total
+    else:
+        return 0.0
 
 
 if __name__ == '__main__':
@@ -1,2 +1,6 @@
 class SuspiciousKeyError(RuntimeError):
     pass
+
+
+class DailyCapReached(RuntimeError):
+    pass
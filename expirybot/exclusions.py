@@ -2,14 +2,22 @@ import logging
 import re
 
 from .config import config
+from .logs import SampledLogger
 
 LOG = logging.getLogger(__name__)
+SAMPLED_LOG = SampledLogger(LOG)
 
 RSA = 1
 DSA = 17
 ECDSA = 19
 ECC = 18
 
+# Why a key shouldn't be emailed.
+WEAK_KEY = 'weak-key'
+ALL_BLACKLISTED_DOMAINS = 'all-blacklisted-domains'
+NO_VALID_EMAILS = 'no-valid-emails'
+DEAD_DOMAIN = 'dead-domain'  # recipient domain has no MX or address
+
 
 def is_strong_key(key):
     if key.algorithm_number == RSA:
@@ -19,9 +27,9 @@ def is_strong_key(key):
         return key.size_bits >= 2048
 
     elif key.algorithm_number == ECDSA:
-        LOG.warn("Returning 'strong' for ECDSA key size {}".format(
+        SAMPLED_LOG.warning(
+            'ecdsa-key', "Returning 'strong' for ECDSA key size %s",
             key.size_bits
-            )
         )
         return True
 
@@ -29,13 +37,30 @@ def is_strong_key(key):
         return key.size_bits >= 256
 
     else:
-        LOG.warn("Unknown key algorithm / size: {} {}".format(
+        SAMPLED_LOG.warning(
+            'unknown-algorithm', 'Unknown key algorithm / size: %s %s',
             key.algorithm_number, key.size_bits
-            )
         )
         return False
 
 
+def exclusion_reason(key):
+    """
+    Return why the key should be excluded from emailing, or None.
+    """
+    if not is_strong_key(key):
+        return WEAK_KEY
+
+    elif all_blacklisted_domains(key):
+        return ALL_BLACKLISTED_DOMAINS
+
+    elif no_valid_emails(key):
+        return NO_VALID_EMAILS
+
+    else:
+        return None
+
+
 def no_valid_emails(key):
     missing_email = not key.email_lines
     return missing_email
@@ -45,17 +70,31 @@ def all_blacklisted_domains(key):
     if no_valid_emails(key):
         return False
 
-    uids_with_domains = filter(lambda u: u.domain is not None, key.uids)
+    domains = [uid.domain for uid in key.uids if uid.domain is not None]
+    reasons = config.domain_rules.match_many(domains)
+
+    if all(reasons.values()):
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug('All domains blacklisted by %s',
+                      sorted(set(reasons.values())))
+        return True
 
-    return all(is_blacklisted(uid.domain) for uid in uids_with_domains)
+    return False
 
 
 def is_blacklisted(domain):
+    return blacklist_reason(domain) is not None
+
+
+def blacklist_reason(domain):
+    """
+    Return the blacklist rule matching the domain, or None.
+    """
     if not isinstance(domain, str):
         raise TypeError(
             'Invalid domain `{}` type: {}'. format(domain, type(domain))
         )
-    return domain.lower() in config.blacklisted_domains
+    return config.domain_rules.match(domain)
 
 
 def roughly_validate_email(email):
@@ -0,0 +1,284 @@
+import datetime
+import hashlib
+import logging
+import sqlite3
+
+from collections import OrderedDict, namedtuple
+from os.path import join as pjoin
+
+from .config import config
+from .pgp_key import PGPKey, Fingerprint
+
+LOG = logging.getLogger(__name__)
+
+PRESENT = 'present'
+REVOKED = 'revoked'
+MISSING = 'missing'  # not returned by the keyserver in that night's crawl
+
+KeyState = namedtuple(
+    'KeyState', ['fingerprint', 'since', 'status', 'expiry_date', 'uids']
+)
+
+
+class KeyHistory():
+    """
+    Day-by-day history of every key seen by the crawl, stored as deltas: a
+    key only gets a row on the days its expiry, revocation or UIDs change
+    (or it disappears), so the state of any key on any date can be answered
+    locally instead of going back to the keyserver.
+
+    Record a night's crawl with:
+
+        history.start_snapshot(day)
+        history.observe(key)  # for every key, including revoked ones
+        history.finish_snapshot()
+    """
+
+    COMMIT_EVERY = 10000
+    QUERY_CHUNK_SIZE = 500  # stay under SQLite's limit on bound parameters
+
+    def __init__(self, filename=None):
+        self.filename = filename or pjoin(config.data_dir, 'key_history.db')
+
+        self._conn = sqlite3.connect(self.filename, timeout=60)
+        self._create_tables()
+
+        self._day = None
+        self._uncommitted = 0
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def start_snapshot(self, day):
+        self._day = day.isoformat()
+
+        self._conn.execute('DROP TABLE IF EXISTS temp.seen')
+        self._conn.execute(
+            'CREATE TEMP TABLE seen (fingerprint TEXT PRIMARY KEY)'
+        )
+
+    def observe(self, key):
+        fingerprint = key.fingerprint.hex_format
+        status = REVOKED if key.is_revoked else PRESENT
+        expiry_date = key.expiry_date.isoformat() if key.expiry_date else ''
+        uids = '|'.join(map(str, key.uids))
+
+        self._conn.execute(
+            'INSERT OR IGNORE INTO temp.seen (fingerprint) VALUES (?)',
+            (fingerprint,)
+        )
+
+        self._record_if_changed(
+            fingerprint, status, expiry_date, uids,
+            _digest(status, expiry_date, uids)
+        )
+
+        self._uncommitted += 1
+
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def mark_seen(self, fingerprint):
+        """
+        Note that a key is still there tonight, without fetching it again.
+        """
+        self._conn.execute(
+            'INSERT OR IGNORE INTO temp.seen (fingerprint) VALUES (?)',
+            (_normalize(fingerprint),)
+        )
+
+    def finish_snapshot(self):
+        """
+        Mark every key we knew about but didn't see tonight as missing.
+        """
+        vanished = self._conn.execute(
+            'SELECT fingerprint FROM current '
+            'WHERE status != ? '
+            'AND fingerprint NOT IN (SELECT fingerprint FROM temp.seen)',
+            (MISSING,)
+        ).fetchall()
+
+        for (fingerprint,) in vanished:
+            self._record_if_changed(
+                fingerprint, MISSING, '', '', _digest(MISSING, '', '')
+            )
+
+        self._conn.commit()
+        self._uncommitted = 0
+
+        LOG.info('Snapshot {}: {} keys went missing'.format(
+            self._day, len(vanished)))
+
+    def state_on(self, fingerprint, day):
+        """
+        Return the KeyState of the key as of `day`, or None if it hadn't
+        been seen by then.
+        """
+        row = self._conn.execute(
+            'SELECT fingerprint, day, status, expiry_date, uids '
+            'FROM changes WHERE fingerprint = ? AND day <= ? '
+            'ORDER BY day DESC LIMIT 1',
+            (_normalize(fingerprint), day.isoformat())
+        ).fetchone()
+
+        return _make_state(row) if row is not None else None
+
+    def expiry_moved_between(self, day1, day2):
+        """
+        Return fingerprints whose expiry date on `day2` differs from their
+        expiry date on `day1`.
+        """
+        candidates = self._conn.execute(
+            'SELECT DISTINCT fingerprint FROM changes '
+            'WHERE day > ? AND day <= ?',
+            (day1.isoformat(), day2.isoformat())
+        ).fetchall()
+
+        moved = []
+
+        for (fingerprint,) in candidates:
+            before = self.state_on(fingerprint, day1)
+            after = self.state_on(fingerprint, day2)
+
+            if before is None or after is None or after.status == MISSING:
+                continue
+
+            if before.expiry_date != after.expiry_date:
+                moved.append(fingerprint)
+
+        return moved
+
+    def renewal_days(self, fingerprints, after_day, expiry_date):
+        """
+        Return a dict of fingerprint -> the first day after `after_day` on
+        which the key's expiry was moved beyond `expiry_date` (or removed).
+        Keys which weren't renewed are left out.
+        """
+        fingerprints = [_normalize(fp) for fp in fingerprints]
+        renewed = {}
+
+        for start in range(0, len(fingerprints), self.QUERY_CHUNK_SIZE):
+            chunk = fingerprints[start:start + self.QUERY_CHUNK_SIZE]
+
+            rows = self._conn.execute(
+                'SELECT fingerprint, MIN(day) FROM changes '
+                'WHERE fingerprint IN ({}) AND day > ? AND status = ? '
+                'AND (expiry_date = \'\' OR expiry_date > ?) '
+                'GROUP BY fingerprint'.format(', '.join('?' * len(chunk))),
+                chunk + [after_day.isoformat(), PRESENT,
+                         expiry_date.isoformat()]
+            )
+
+            for fingerprint, day in rows:
+                renewed[fingerprint] = PGPKey._parse_date(day)
+
+        return renewed
+
+    def lookup_many(self, fingerprints, day=None):
+        """
+        Like CachedKeyLookup.lookup_many, but answered from the history:
+        return an OrderedDict of Fingerprint -> PGPKey as of `day` (default
+        today), or None for keys we have no record of.
+        """
+        day = day or datetime.date.today()
+
+        results = OrderedDict()
+
+        for fingerprint in fingerprints:
+            fingerprint = _as_fingerprint(fingerprint)
+            state = self.state_on(fingerprint, day)
+
+            if state is None or state.status == MISSING:
+                results[fingerprint] = None
+            else:
+                results[fingerprint] = _make_key(state)
+
+        return results
+
+    def _record_if_changed(self, fingerprint, status, expiry_date, uids,
+                           digest):
+        row = self._conn.execute(
+            'SELECT digest FROM current WHERE fingerprint = ?',
+            (fingerprint,)
+        ).fetchone()
+
+        if row is not None and row[0] == digest:
+            return
+
+        self._conn.execute(
+            'INSERT OR REPLACE INTO changes '
+            '(fingerprint, day, status, expiry_date, uids) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (fingerprint, self._day, status, expiry_date, uids)
+        )
+        self._conn.execute(
+            'INSERT OR REPLACE INTO current (fingerprint, digest, status) '
+            'VALUES (?, ?, ?)',
+            (fingerprint, digest, status)
+        )
+
+    def _create_tables(self):
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS changes ('
+            '  fingerprint TEXT NOT NULL,'
+            '  day TEXT NOT NULL,'
+            '  status TEXT NOT NULL,'
+            '  expiry_date TEXT NOT NULL,'
+            '  uids TEXT NOT NULL,'
+            '  PRIMARY KEY (fingerprint, day)'
+            ')'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS changes_day ON changes (day)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS current ('
+            '  fingerprint TEXT PRIMARY KEY,'
+            '  digest TEXT NOT NULL,'
+            '  status TEXT NOT NULL'
+            ')'
+        )
+        self._conn.commit()
+
+
+def _digest(status, expiry_date, uids):
+    return hashlib.sha1(
+        '\0'.join([status, expiry_date, uids]).encode('utf-8')
+    ).hexdigest()[:16]
+
+
+def _as_fingerprint(fingerprint):
+    if isinstance(fingerprint, Fingerprint):
+        return fingerprint
+    else:
+        return Fingerprint(fingerprint)
+
+
+def _normalize(fingerprint):
+    return _as_fingerprint(fingerprint).hex_format
+
+
+def _make_state(row):
+    fingerprint, day, status, expiry_date, uids = row
+
+    return KeyState(
+        fingerprint=fingerprint,
+        since=PGPKey._parse_date(day),
+        status=status,
+        expiry_date=PGPKey._parse_date(expiry_date) or None,
+        uids=uids.split('|') if uids else []
+    )
+
+
+def _make_key(state):
+    key = PGPKey(fingerprint=state.fingerprint, expiry_date=state.expiry_date)
+
+    for uid in state.uids:
+        key.add_uid(uid)
+
+    if state.status == REVOKED:
+        key.set_revoked()
+
+    return key
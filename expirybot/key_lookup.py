@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+
+import backoff
+import requests
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .keyserver_client import KeyserverClient
+from .pgp_key import Fingerprint
+
+LOG = logging.getLogger(__name__)
+
+
+class CachedKeyLookup():
+    """
+    Fetch the current state of many keys from the keyserver at once, using a
+    bounded pool of worker threads, and remember each result for
+    `cache_seconds`.
+
+    Each worker thread gets its own KeyserverClient, since a requests Session
+    shouldn't be shared between threads. Each HTTP request is limited to
+    `timeout` seconds and network errors are retried up to `max_tries`
+    times; any other error (e.g. SuspiciousKeyError) fails that lookup only.
+    """
+
+    def __init__(self, max_workers=8, cache_seconds=10 * 60, timeout=30,
+                 max_tries=3, make_client=None, clock=time.monotonic):
+        self.cache_seconds = cache_seconds
+        self.timeout = timeout
+        self.max_tries = max_tries
+        self.make_client = make_client or self._make_keyserver_client
+
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._local = threading.local()
+        self._cache = {}
+
+    def prefetch(self, fingerprints):
+        """
+        Start looking up the fingerprints in the background, without waiting.
+        """
+        for fingerprint in fingerprints:
+            self._get_future(fingerprint)
+
+    def lookup_many(self, fingerprints):
+        """
+        Return an OrderedDict of Fingerprint -> PGPKey, or None where the
+        lookup failed.
+        """
+        futures = OrderedDict(
+            (self._normalize(fp), self._get_future(fp)) for fp in fingerprints
+        )
+
+        results = OrderedDict()
+
+        for fingerprint, future in futures.items():
+            try:
+                results[fingerprint] = future.result()
+
+            except Exception as e:
+                LOG.warn('Failed to look up {}: {!r}'.format(fingerprint, e))
+                results[fingerprint] = None
+
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def _get_future(self, fingerprint):
+        fingerprint = self._normalize(fingerprint)
+        now = self._clock()
+
+        cached = self._cache.get(fingerprint)
+
+        if cached is not None:
+            submitted_at, future = cached
+
+            if now - submitted_at < self.cache_seconds:
+                return future
+
+        future = self._executor.submit(self._fetch, fingerprint)
+        self._cache[fingerprint] = (now, future)
+        return future
+
+    def _fetch(self, fingerprint):
+        fetch_with_retries = backoff.on_exception(
+            backoff.expo,
+            requests.exceptions.RequestException,
+            max_tries=self.max_tries
+        )(self._client().get_key_for_fingerprint)
+
+        return fetch_with_retries(fingerprint)
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.make_client()
+
+        return self._local.client
+
+    def _make_keyserver_client(self):
+        return KeyserverClient(timeout=self.timeout)
+
+    @staticmethod
+    def _normalize(fingerprint):
+        if isinstance(fingerprint, Fingerprint):
+            return fingerprint
+        else:
+            return Fingerprint(fingerprint)
@@ -0,0 +1,278 @@
+import datetime
+import io
+import json
+import logging
+import os
+
+from os.path import join as pjoin
+
+import numpy as np
+
+from .pgp_key import PGPKey
+
+LOG = logging.getLogger(__name__)
+
+FORMAT_VERSION = 3
+
+EPOCH = datetime.date(1970, 1, 1)
+NO_DATE = np.iinfo(np.int32).min
+
+# One file per column, each a flat array which can be memory mapped on its
+# own. Dates are days since 1970-01-01.
+#
+# UIDs are dictionary encoded: each distinct string is stored once in a
+# string table, and rows refer to it by number. Every key holds a run of
+# uid_ids, from uid_offsets[i] to uid_offsets[i + 1].
+COLUMNS = {
+    'fingerprint': np.uint8,  # 20 bytes per key
+    'algorithm_number': np.uint8,  # 0 if unknown
+    'size_bits': np.uint32,  # 0 if unknown
+    'created_days': np.int32,
+    'expiry_days': np.int32,
+    'uid_offsets': np.int64,  # count + 1 entries
+    'uid_ids': np.uint32,
+    'uid_string_offsets': np.int64,  # distinct UIDs + 1 entries
+    'uid_strings': np.uint8,  # UTF-8
+}
+
+FINGERPRINT_BYTES = 20
+
+
+class KeyStoreWriter():
+    """
+    Write keys to a columnar key store directory, one at a time. Columns are
+    buffered and appended every FLUSH_EVERY keys, and meta.json is written
+    last, on close. The UID string table grows as new UIDs turn up, so each
+    distinct UID is only stored once.
+    """
+
+    FLUSH_EVERY = 10000
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        os.makedirs(dirname, exist_ok=True)
+
+        self._files = {
+            name: io.open(pjoin(dirname, '{}.bin'.format(name)), 'wb')
+            for name in COLUMNS
+        }
+        self._buffers = {name: [] for name in COLUMNS}
+        self._fingerprints = bytearray()
+        self._uid_count = 0
+
+        self._uids = StringTable(self._buffers['uid_string_offsets'])
+
+        self._buffers['uid_offsets'].append(0)
+
+        self.count = 0
+
+    def write(self, key):
+        self._fingerprints += bytes.fromhex(key.fingerprint.hex_format[2:])
+
+        self._buffers['algorithm_number'].append(key.algorithm_number or 0)
+        self._buffers['size_bits'].append(key.size_bits or 0)
+        self._buffers['created_days'].append(to_days(key.created_date))
+        self._buffers['expiry_days'].append(to_days(key.expiry_date))
+
+        for uid in key.uids:
+            self._buffers['uid_ids'].append(self._uids.id_for(str(uid)))
+
+        self._uid_count += len(key.uids)
+        self._buffers['uid_offsets'].append(self._uid_count)
+
+        self.count += 1
+
+        if self.count % self.FLUSH_EVERY == 0:
+            self._flush()
+
+    def close(self):
+        self._flush()
+
+        for f in self._files.values():
+            f.close()
+
+        with io.open(pjoin(self.dirname, 'meta.json'), 'w') as f:
+            json.dump({
+                'version': FORMAT_VERSION,
+                'count': self.count,
+                'distinct_uids': len(self._uids),
+            }, f)
+
+    def _flush(self):
+        self._files['fingerprint'].write(self._fingerprints)
+        self._files['uid_strings'].write(self._uids.take_new_bytes())
+        self._fingerprints = bytearray()
+
+        for name, values in self._buffers.items():
+            if values:
+                np.array(values, dtype=COLUMNS[name]).tofile(self._files[name])
+                del values[:]  # the string table holds on to its list
+
+
+class StringTable():
+    """
+    Assign ids to strings as they're first seen, collecting the encoded
+    strings and their end offsets for the writer to append to disk.
+    """
+
+    def __init__(self, offsets):
+        self._ids = {}
+        self._offsets = offsets
+        self._new_bytes = bytearray()
+        self._total_bytes = 0
+
+        self._offsets.append(0)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def id_for(self, string):
+        string_id = self._ids.get(string)
+
+        if string_id is None:
+            string_id = self._ids[string] = len(self._ids)
+
+            encoded = string.encode('utf-8')
+            self._new_bytes += encoded
+            self._total_bytes += len(encoded)
+            self._offsets.append(self._total_bytes)
+
+        return string_id
+
+    def take_new_bytes(self):
+        new_bytes, self._new_bytes = self._new_bytes, bytearray()
+        return new_bytes
+
+
+class KeyStore():
+    """
+    Read a key store written by KeyStoreWriter. Each column is memory mapped
+    the first time it's used, so a scan only touches the columns it needs:
+
+        store = KeyStore(pjoin(config.data_dir, 'keys.store'))
+        for key in store.keys(store.expiring_in(3)):
+            ...
+
+    UID strings are only decoded when asked for, and each one is decoded
+    once, so keys loaded from the store share the same objects.
+    """
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+        with io.open(pjoin(dirname, 'meta.json')) as f:
+            meta = json.load(f)
+
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported key store version {} in {}'.format(
+                meta['version'], dirname))
+
+        self.count = meta['count']
+        self._columns = {}
+        self._uid_cache = {}
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.keys()
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = self._map_column(name)
+
+        return self._columns[name]
+
+    def expiring_in(self, days, today=None, start=None, stop=None):
+        """
+        Return the indices of keys which expire exactly `days` from today.
+        Only the expiry column is read, and only keys [start, stop) of it.
+        """
+        if today is None:
+            today = datetime.date.today()
+
+        start = start or 0
+        target = to_days(today) + days
+        return np.flatnonzero(
+            self.column('expiry_days')[start:stop] == target
+        ) + start
+
+    def keys(self, indices=None):
+        if indices is None:
+            indices = range(self.count)
+
+        for index in indices:
+            yield self.key(index)
+
+    def key(self, index):
+        index = int(index)
+        key = PGPKey()
+
+        key.set_fingerprint(
+            bytes(self.column('fingerprint')[index]).hex().upper()
+        )
+
+        algorithm_number = int(self.column('algorithm_number')[index])
+        size_bits = int(self.column('size_bits')[index])
+
+        if algorithm_number:
+            key.set_algorithm_number(algorithm_number)
+
+        if size_bits:
+            key.set_size_bits(size_bits)
+
+        key.set_created_date(from_days(self.column('created_days')[index]))
+        key.set_expiry_date(from_days(self.column('expiry_days')[index]))
+
+        for uid_id in self.uid_ids(index):
+            key.add_uid(self.uid_string(uid_id))
+
+        return key
+
+    def uid_ids(self, index):
+        offsets = self.column('uid_offsets')
+        return self.column('uid_ids')[offsets[index]:offsets[index + 1]]
+
+    def uid_string(self, uid_id):
+        return self._lookup_string(uid_id, 'uid', self._uid_cache)
+
+    def _lookup_string(self, string_id, table, cache):
+        string_id = int(string_id)
+
+        if string_id not in cache:
+            offsets = self.column('{}_string_offsets'.format(table))
+            start, end = offsets[string_id], offsets[string_id + 1]
+
+            cache[string_id] = bytes(
+                self.column('{}_strings'.format(table))[start:end]
+            ).decode('utf-8')
+
+        return cache[string_id]
+
+    def _map_column(self, name):
+        filename = pjoin(self.dirname, '{}.bin'.format(name))
+        dtype = COLUMNS[name]
+
+        if os.path.getsize(filename) == 0:
+            column = np.zeros(0, dtype=dtype)  # can't mmap an empty file
+        else:
+            column = np.memmap(filename, dtype=dtype, mode='r')
+
+        if name == 'fingerprint':
+            column = column.reshape(-1, FINGERPRINT_BYTES)
+
+        return column
+
+
+def to_days(date):
+    if not date:
+        return NO_DATE
+
+    return (date - EPOCH).days
+
+
+def from_days(days):
+    if days == NO_DATE:
+        return None
+
+    return EPOCH + datetime.timedelta(days=int(days))
@@ -0,0 +1,79 @@
+import glob
+import logging
+import mmap
+import multiprocessing
+import os
+
+from os.path import join as pjoin
+
+from .logs import (
+    init_worker_sampling, merge_sampled_counts, take_sampled_counts
+)
+from .openpgp_packets import OpenPGPPacketParser, PacketFormatError
+
+LOG = logging.getLogger(__name__)
+
+
+def find_keydump_files(paths):
+    """
+    Expand directories (e.g. SKS's `dump/`) into the *.pgp files inside them.
+    """
+    filenames = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(pjoin(path, '*.pgp'))))
+        else:
+            filenames.append(path)
+
+    return filenames
+
+
+def read_keydump(filename):
+    """
+    Yield every key in an SKS/Hockeypuck keydump file: binary OpenPGP packets
+    for many keys, one after the other. If the file is truncated or corrupt,
+    the keys before the damage are kept and the rest of the file skipped.
+    """
+    if os.path.getsize(filename) == 0:
+        return
+
+    with open(filename, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+
+        keys = OpenPGPPacketParser(mapped).keys()
+
+        try:
+            yield from keys
+
+        except PacketFormatError as e:
+            LOG.error('Skipping the rest of {}: {}'.format(filename, e))
+
+        finally:
+            keys.close()  # release the parser's views before unmapping
+
+
+def read_keydumps(filenames, workers=None):
+    """
+    Parse keydump files in parallel, yielding keys file by file in the order
+    given. Each dump file holds a few thousand keys, so a whole file's keys
+    are handed back from the worker at once.
+    """
+    if workers == 1:
+        for filename in filenames:
+            yield from read_keydump(filename)
+        return
+
+    workers = workers or multiprocessing.cpu_count()
+
+    with multiprocessing.Pool(
+            workers, init_worker_sampling, (workers,)) as pool:
+        for keys, sampled_counts in pool.imap(_read_whole_keydump, filenames):
+            merge_sampled_counts(sampled_counts)
+            yield from keys
+
+
+def _read_whole_keydump(filename):
+    keys = list(read_keydump(filename))
+    LOG.info('Read {} keys from {}'.format(len(keys), filename))
+    return keys, take_sampled_counts()
@@ -13,6 +13,7 @@ from .requests_wrapper import RequestsWithSessionAndUserAgent
 from .pgp_key import Fingerprint
 from .exceptions import SuspiciousKeyError
 from .keyserver_vindex_parser import KeyserverVindexParser
+from .openpgp_packets import OpenPGPPacketParser
 
 GPG_FINGERPRINT_PATTERN = '[A-F0-9]{4} [A-F0-9]{4} [A-F0-9]{4} [A-F0-9]{4} [A-F0-9]{4}  [A-F0-9]{4} [A-F0-9]{4} [A-F0-9]{4} [A-F0-9]{4} [A-F0-9]{4}'  # noqa
 LOG = logging.getLogger(__name__)
@@ -20,14 +21,15 @@ LOG = logging.getLogger(__name__)
 
 class KeyserverClient:
     def __init__(self, keyserver=config.keyserver,
-                 http_getter=None):
+                 http_getter=None, timeout=None):
         self.keyserver = keyserver
+        self.timeout = timeout
 
         self.http_getter = http_getter or RequestsWithSessionAndUserAgent()
 
-    def get_keys_for_short_id(self, short_id):
+    def get_keys_for_short_id(self, short_id, include_revoked=False):
         for key in self.do_vindex_search(short_id):
-            if key.is_valid:
+            if key.is_valid or (include_revoked and key.is_revoked):
                 yield key
 
     def get_key_for_fingerprint(self, fingerprint):
@@ -50,10 +52,39 @@ class KeyserverClient:
 
         return pgp_key
 
+    def get_full_key(self, fingerprint):
+        """
+        Fetch the whole key block (op=get) and parse it, which also gives
+        subkeys and per-UID revocations that the vindex doesn't.
+        """
+        if not isinstance(fingerprint, Fingerprint):
+            fingerprint = Fingerprint(fingerprint)
+
+        keys = list(OpenPGPPacketParser(
+            self.http_getter.get_content(
+                self.url_get_key_from_fingerprint(fingerprint),
+                timeout=self.timeout
+            )
+        ).keys())
+
+        if len(keys) != 1:
+            raise RuntimeError('Expected 1 key for {}, got: {}'.format(
+                fingerprint, keys))
+
+        if keys[0].fingerprint != fingerprint:
+            raise SuspiciousKeyError(
+                'Requested a key from the keyserver with fingerprint {} '
+                'and got one back with fingerprint {}'.format(
+                    fingerprint, keys[0].fingerprint))
+
+        return keys[0]
+
     def do_vindex_search(self, search_query):
         url = self._make_vindex_url(search_query)
 
-        return KeyserverVindexParser(self.http_getter.get_content(url)).keys()
+        return KeyserverVindexParser(
+            self.http_getter.get_content(url, timeout=self.timeout)
+        ).keys()
 
     def _make_vindex_url(self, search_query):
         return '{}/pks/lookup?search={}&op=vindex&options=mr'.format(
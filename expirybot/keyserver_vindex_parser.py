@@ -1,9 +1,11 @@
 import logging
 from urllib.parse import unquote
 
+from .logs import SampledLogger
 from .pgp_key import PGPKey, OpenPGPVersion3FingerprintUnsupported
 
 LOG = logging.getLogger(__name__)
+SAMPLED_LOG = SampledLogger(LOG)
 
 
 class KeyserverVindexParser:
@@ -59,7 +61,8 @@ class KeyserverVindexParser:
                 continue
 
             except ValueError as e:
-                LOG.exception(e)
+                SAMPLED_LOG.log(logging.ERROR, 'unparseable-key', '%r', e,
+                                exc_info=True)
                 key = PGPKey()  # invalidate the key
                 continue
 
@@ -81,7 +84,7 @@ class KeyserverVindexParser:
         ) = line.split(':')
 
         if flag != '' and flag != 'r':
-            LOG.info('Got this key flag: `{}`'.format(flag))
+            SAMPLED_LOG.info('key-flag', 'Got this key flag: `%s`', flag)
 
         key.set_fingerprint(fingerprint)
 
@@ -0,0 +1,181 @@
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+from collections import Counter
+
+LOG = logging.getLogger(__name__)
+
+_SAMPLED_LOGGERS = []
+
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """
+    Put log records on a queue for a background thread to format and write
+    with `handler`, so the caller never waits on the disk.
+
+    Records are queued as they are, with their arguments: formatting happens
+    on the background thread. Forked worker processes don't have the thread,
+    so they write through `handler` directly.
+    """
+
+    def __init__(self, handler):
+        super().__init__(queue.Queue())
+        self.handler = handler
+
+        self._pid = os.getpid()
+        self._listener = logging.handlers.QueueListener(
+            self.queue, handler, respect_handler_level=True
+        )
+        self._listener.start()
+
+    def prepare(self, record):
+        return record
+
+    def emit(self, record):
+        if os.getpid() == self._pid:
+            super().emit(record)
+        else:
+            self.handler.handle(record)
+
+    def close(self):
+        if self._listener is not None and os.getpid() == self._pid:
+            self._listener.stop()  # writes out anything still queued
+            self._listener = None
+            self.handler.close()
+
+        super().close()
+
+
+class SampledLogger():
+    """
+    For messages logged once per key: log the first `first` of each kind,
+    then one in every `every`, and count them all. The counts are logged by
+    log_sampled_counts(), which setup_logging runs at exit.
+
+        EXCLUDED = SampledLogger(logging.getLogger(__name__))
+        EXCLUDED.warning('weak-key', 'Skipping weak key: %s', key.fingerprint)
+
+    Counts are per process: worker processes hand theirs back with
+    take_sampled_counts() for the parent to merge_sampled_counts().
+    """
+
+    def __init__(self, logger, first=10, every=1000):
+        self.logger = logger
+        self.first = first
+        self.every = every
+
+        self.counts = Counter()
+        self.logged = Counter()
+        self._seen = Counter()  # what sampling goes by, kept by take()
+        self._lock = threading.Lock()
+
+        _SAMPLED_LOGGERS.append(self)
+
+    def log(self, level, kind, msg, *args, **kwargs):
+        with self._lock:
+            self._seen[kind] += 1
+            count = self._seen[kind]
+            sample = count <= self.first or count % self.every == 0
+
+            self.counts[kind] += 1
+
+            if sample:
+                self.logged[kind] += 1
+
+        if sample:
+            self.logger.log(level, msg, *args, **kwargs)
+
+    def info(self, kind, msg, *args, **kwargs):
+        self.log(logging.INFO, kind, msg, *args, **kwargs)
+
+    def warning(self, kind, msg, *args, **kwargs):
+        self.log(logging.WARNING, kind, msg, *args, **kwargs)
+
+    def summary(self):
+        with self._lock:
+            counts = sorted(self.counts.items())
+            logged = self.logged.copy()
+
+        return ', '.join(
+            '{}: {} ({} not logged)'.format(kind, count, count - logged[kind])
+            for kind, count in counts
+        )
+
+    def take(self):
+        """
+        Return (counts, logged) and start counting again from zero. Sampling
+        carries on where it was.
+        """
+        with self._lock:
+            taken = (self.counts, self.logged)
+            self.counts, self.logged = Counter(), Counter()
+
+        return taken
+
+    def reset(self):
+        with self._lock:
+            self.counts, self.logged = Counter(), Counter()
+            self._seen = Counter()
+
+    def merge(self, counts, logged):
+        with self._lock:
+            self.counts.update(counts)
+            self.logged.update(logged)
+
+
+def log_sampled_counts(reset=False):
+    """
+    Log each sampled logger's counts. With `reset`, start counting (and
+    logging the first few of each kind) again, e.g. for the next crawl.
+    """
+    for sampled in list(_SAMPLED_LOGGERS):
+        if sampled.counts:
+            sampled.logger.info('Message counts: %s', sampled.summary())
+
+        if reset:
+            sampled.reset()
+
+
+def init_worker_sampling(workers):
+    """
+    Pool initializer: drop the counts inherited from the parent, and share
+    out `first` so the pool logs about as many of each kind as one process.
+    """
+    for sampled in _SAMPLED_LOGGERS:
+        sampled.reset()
+        sampled.first = max(1, -(-sampled.first // workers))
+
+
+def take_sampled_counts():
+    """
+    Return and reset this process's counts from every sampled logger, by
+    logger name (summed, if several share a logger), for a pool's worker
+    processes to return with their results.
+    """
+    taken = {}
+
+    for sampled in list(_SAMPLED_LOGGERS):
+        if sampled.counts:
+            counts, logged = sampled.take()
+            total_counts, total_logged = taken.setdefault(
+                sampled.logger.name, (Counter(), Counter())
+            )
+            total_counts.update(counts)
+            total_logged.update(logged)
+
+    return taken
+
+
+def merge_sampled_counts(taken):
+    """
+    Add counts from take_sampled_counts() in a worker to this process's,
+    onto the first sampled logger for each logger name.
+    """
+    for name, (counts, logged) in taken.items():
+        for sampled in _SAMPLED_LOGGERS:
+            if sampled.logger.name == name:
+                sampled.merge(counts, logged)
+                break
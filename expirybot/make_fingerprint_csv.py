@@ -1,86 +1,308 @@
 #!/usr/bin/env python3
 
 """
-- iterate through a list of short ids
+- iterate through a stream of short ids (file, pipe or stdin, maybe compressed)
 - get the fingerprints, uids and expiries for that short id from the keyserver
-- output a ${DATA}/keys.csv of all non-revoked keys
+- or, with --keydump, parse the keys straight out of SKS/Hockeypuck dump files
+- output a ${DATA}/keys.csv of all non-revoked keys, and the same keys in
+  the columnar ${DATA}/keys.store, which is much quicker to scan
+- with --filter, also write today's keys_expiring.csv and keys_excluded.csv
+  as we go, instead of running make_keys_expiring_csv afterwards
+- record what changed since last night in the key history
+- keep the email -> key index up to date
 """
 
+import argparse
+import contextlib
 import datetime
-import sys
-import io
+import functools
 import logging
 
 from os.path import join as pjoin
 
+import requests
+
 from .config import config
+from .crawl_index import CrawlIndex, ShortIdQueue
+from .email_index import EmailIndex
+from .key_history import KeyHistory
+from .keydump import find_keydump_files, read_keydumps
 from .keyserver_client import KeyserverClient
+from .make_keys_expiring_csv import (
+    EXPIRING_DAYS, Stats, check_recipient_domains, handle_key,
+    setup_output_csvs
+)
+from .negative_cache import (
+    NegativeCache, NOT_FOUND, NO_USABLE_KEYS, REVOKED, UNPARSEABLE
+)
+from .streams import InputStream
 from .utils import (
-    make_atomic_csv_writer, write_key_to_csv, make_today_data_dir,
-    setup_logging
+    make_atomic_csv_writer, make_atomic_key_store_writer, write_key_to_csv,
+    make_today_data_dir, setup_logging
 )
 
 
 def main():
-    short_ids_file = sys.argv[1]
+    args = parse_args()
 
     today_data_dir = make_today_data_dir(datetime.date.today())
     setup_logging(pjoin(today_data_dir, 'make_fingerprint_csv.log'))
 
-    short_id_count = 0
-    keys_parsed_count = 0
+    if args.filter:
+        filter_stats = run_crawl_and_filter(
+            today_data_dir, args.short_ids_file, args.keydump, args.workers
+        )
+
+        logging.info("Excluded {}. {} expiring in {} days.".format(
+            filter_stats.excluded_count, filter_stats.expiring_count,
+            EXPIRING_DAYS
+        ))
+        logging.info("Excluded because: {}".format(
+            dict(filter_stats.exclusion_reasons)))
+
+    else:
+        run_crawl(args.short_ids_file, args.keydump, args.workers)
 
-    keyserver_client = KeyserverClient()
+
+def run_crawl_and_filter(today_data_dir, short_ids_file=None, keydump=None,
+                         workers=None, keyserver_client=None):
+    """
+    Crawl, writing today's keys_expiring.csv and keys_excluded.csv as keys
+    are found, then check the recipient domains. Return the filter's Stats.
+    """
+    filter_stats = Stats()
+    expiring_fn = pjoin(today_data_dir, 'keys_expiring.csv')
+    excluded_fn = pjoin(today_data_dir, 'keys_excluded.csv')
+
+    with setup_output_csvs(expiring_fn, excluded_fn) as \
+            (expiring_csv, excluded_csv):
+
+        on_key = functools.partial(
+            handle_key, expiring_csv=expiring_csv,
+            excluded_csv=excluded_csv, stats=filter_stats
+        )
+        run_crawl(short_ids_file, keydump, workers, on_key, keyserver_client)
+
+    check_recipient_domains(expiring_fn, excluded_fn, filter_stats)
+
+    return filter_stats
+
+
+def run_crawl(short_ids_file=None, keydump=None, workers=None, on_key=None,
+              keyserver_client=None):
+    """
+    Crawl every key, from the keyserver or keydump files, writing keys.csv
+    and keys.store and recording the night's snapshot in the key history.
+    `on_key` is called with each new, non-revoked key as it's found.
+    """
+    keys_parsed_count = 0
 
     with make_atomic_csv_writer(
             pjoin(config.data_dir, 'keys.csv'),
-            config.csv_header) as csv_writer:
+            config.csv_header) as csv_writer, \
+            make_atomic_key_store_writer(
+                pjoin(config.data_dir, 'keys.store')) as key_store, \
+            contextlib.closing(KeyHistory()) as history, \
+            contextlib.closing(CrawlIndex()) as crawl_index, \
+            contextlib.closing(NegativeCache()) as negative_cache, \
+            contextlib.closing(EmailIndex()) as email_index:
+
+        if keydump:
+            keys = read_keydumps(find_keydump_files(keydump), workers=workers)
+        else:
+            keys = get_keys_for_short_ids(
+                short_ids_file, crawl_index, negative_cache, keyserver_client
+            )
+
+        history.start_snapshot(datetime.date.today())
+        email_index.start_build()
+
+        for key in keys:
+            if not crawl_index.first_sighting(key):
+                continue
+
+            history.observe(key)
+
+            if key.is_revoked:
+                continue
+
+            write_key_to_csv(key, csv_writer)
+            key_store.write(key)
+            email_index.update(key)
+
+            keys_parsed_count += 1
+
+            if on_key is not None:
+                on_key(key)
+
+        for fingerprint in negative_cache.skipped_fingerprints:
+            history.mark_seen(fingerprint)  # revoked keys we didn't re-fetch
+
+        history.finish_snapshot()
+        email_index.finish_build()
+
+    logging.info("Parsed {} keys, dropped {} duplicates.".format(
+        keys_parsed_count, crawl_index.duplicates))
+    logging.info(negative_cache.report())
+
+    return keys_parsed_count
 
-        for short_id in read_short_ids(short_ids_file):
-            for key in keyserver_client.get_keys_for_short_id(short_id):
-                logging.debug("Key for short id {}: {}".format(short_id, key))
 
-                write_key_to_csv(key, csv_writer)
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'short_ids_file', nargs='?',
+        help='File of short key IDs to look up on the keyserver: may be a '
+             'FIFO, gzip/zstd compressed, or - for stdin'
+    )
+    parser.add_argument(
+        '--keydump', nargs='+', metavar='PATH',
+        help='Read keys from these keydump files (or directories of *.pgp '
+             'files) instead of querying the keyserver'
+    )
+    parser.add_argument(
+        '--filter', action='store_true',
+        help="Also write today's keys_expiring.csv and keys_excluded.csv "
+             "during the crawl"
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Processes for parsing keydump files (default: one per CPU)'
+    )
 
-                keys_parsed_count += 1
+    args = parser.parse_args()
 
-            short_id_count += 1
+    if not args.keydump and not args.short_ids_file:
+        parser.error('Give either a short IDs file or --keydump')
 
-            if short_id_count % 1000 == 0:
-                logging.info("Processed {} short ids".format(short_id_count))
+    return args
 
-    logging.info("Attempted to check {} short ids. Parsed {} keys.".format(
-        short_id_count, keys_parsed_count))
 
+def get_keys_for_short_ids(short_ids_file, crawl_index, negative_cache,
+                           keyserver_client=None):
+    """
+    Yield every key (including revoked ones) for each short ID, from the
+    keyserver. Short IDs which last time only matched a subkey are left
+    until the end, by which point their primary key has usually been
+    fetched through its own short ID and they can be skipped. Short IDs
+    which keep coming back empty are skipped by the negative cache.
+    """
+    keyserver_client = keyserver_client or KeyserverClient()
+    deferred = ShortIdQueue()
+    short_id_count = 0
+
+    for line in read_short_ids(short_ids_file):
+        short_id = line.split()[0]
+
+        if negative_cache.should_skip(short_id, line):
+            continue
+
+        if crawl_index.is_subkey_only(short_id):
+            deferred.append(short_id, line)
+            continue
+
+        yield from get_keys_for_short_id(
+            keyserver_client, crawl_index, negative_cache, short_id, line
+        )
+
+        short_id_count += 1
+
+        if short_id_count % 1000 == 0:
+            logging.info("Processed {} short ids".format(short_id_count))
+
+    logging.info("Checking {} deferred subkey short ids".format(len(deferred)))
+
+    for short_id, line in deferred.items():
+        if crawl_index.can_skip(short_id):
+            continue
+
+        yield from get_keys_for_short_id(
+            keyserver_client, crawl_index, negative_cache, short_id, line
+        )
+
+        short_id_count += 1
+
+    logging.info(
+        "Attempted to check {} short ids, skipped {} subkey short ids.".format(
+            short_id_count, crawl_index.skipped_short_ids))
+
+
+def get_keys_for_short_id(keyserver_client, crawl_index, negative_cache,
+                          short_id, line=None):
+    try:
+        keys = list(keyserver_client.get_keys_for_short_id(
+            short_id, include_revoked=True))
 
-def read_short_ids(filename):
-    num_lines = 0
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
 
-    with io.open(filename, 'r') as f:
-        for line in f:
-            num_lines += 1
+        negative_cache.record_miss(short_id, NOT_FOUND, line)
+        return
 
+    except ValueError as e:  # e.g. a response that isn't UTF-8
+        logging.warn("Couldn't parse keys for {}: {!r}".format(short_id, e))
+        negative_cache.record_miss(short_id, UNPARSEABLE, line)
+        return
+
+    crawl_index.record_short_id(short_id, keys)
+
+    if not keys:
+        negative_cache.record_miss(short_id, NO_USABLE_KEYS, line)
+
+    elif all(key.is_revoked for key in keys):
+        negative_cache.record_miss(
+            short_id, REVOKED, line,
+            fingerprints=[key.fingerprint.hex_format for key in keys]
+        )
+
+    else:
+        negative_cache.record_hit(short_id)
+
+    for key in keys:
+        logging.debug("Key for short id %s: %s", short_id, key)  # lazy
+        yield key
+
+
+def read_short_ids(filename, progress_every=5000):
+    """
+    Yield short IDs from a file, FIFO or stdin ('-'), optionally gzip or
+    zstd compressed, in a single pass. Progress is estimated from the bytes
+    consumed so far, so we can start while the dump is still being written.
+    """
     start_time = datetime.datetime.now()
 
-    with io.open(filename, 'r') as f:
+    with contextlib.closing(InputStream(filename)) as stream:
         count = 0
 
-        for line in f:
-            yield line.strip()
+        for line in stream:
+            short_id = line.strip()
+
+            if not short_id:
+                continue
+
+            yield short_id
             count += 1
 
-            if count % 5000 == 0:
-                duration = datetime.datetime.now() - start_time
-                time_per_line = duration / count
-
-                print('{} / {} ({:.1f}%) short ids in {} ({} per million), eta {}'.format(
-                    count,
-                    num_lines,
-                    count / num_lines * 100,
-                    duration,
-                    duration * (1000000 / count),
-                    (num_lines - count) * time_per_line)
-                )
+            if count % progress_every == 0:
+                print(format_progress(
+                    count, stream.fraction_read,
+                    datetime.datetime.now() - start_time
+                ))
+
+
+def format_progress(count, fraction_read, duration):
+    message = '{} short ids in {} ({} per million)'.format(
+        count, duration, duration * (1000000 / count)
+    )
+
+    if fraction_read:
+        message += ', {:.1f}% of input, eta {}'.format(
+            fraction_read * 100,
+            duration * ((1 - fraction_read) / fraction_read)
+        )
+
+    return message
 
 
 if __name__ == '__main__':
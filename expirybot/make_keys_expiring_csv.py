@@ -4,66 +4,225 @@
 - iterate through a list of short ids
 - download the key for each short id
 - if it expires in 3 days from now, add it to the output CSV
+- if make_fingerprint_csv wrote ${DATA}/keys.store, only read the keys
+  expiring in 3 days from it instead of parsing all of keys.csv
+- move keys whose recipient domain has no MX or address to the excluded CSV
+- with --workers N, split the keys into partitions filtered by N processes,
+  then merge their output in partition order
+
+    python -m expirybot.make_keys_expiring_csv [--workers N]
 """
 
+import argparse
 import contextlib
+import csv
 import datetime
+import io
 import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
 
+from collections import Counter
 from os.path import join as pjoin
 
 from .config import config
+from .dns_check import DomainValidator, DEAD
+from .logs import (
+    SampledLogger, init_worker_sampling, merge_sampled_counts,
+    take_sampled_counts
+)
+from .partitions import (
+    STORE, csv_partitions, read_partition, store_partitions
+)
 from .utils import (
-    make_atomic_csv_writer, write_key_to_csv, load_keys_from_csv,
-    make_today_data_dir, setup_logging
+    atomic_filename, make_atomic_csv_writer, write_key_to_csv,
+    load_keys_from_csv, make_today_data_dir, setup_logging, key_to_csv_row,
+    open_key_store
 )
 
 from .exclusions import (
-    is_strong_key, all_blacklisted_domains, no_valid_emails
+    WEAK_KEY, ALL_BLACKLISTED_DOMAINS, NO_VALID_EMAILS, DEAD_DOMAIN
 )
 
 EXPIRING_DAYS = 3
 
+# More partitions than workers, so one slow partition doesn't hold up the end
+PARTITIONS_PER_WORKER = 4
+
+# A few examples of each kind of excluded key, rather than every one
+EXCLUDED_LOG = SampledLogger(logging.getLogger())
+
 
 class Stats:
     def __init__(self):
         self.parsed_count = 0
         self.expiring_count = 0
         self.excluded_count = 0
+        self.exclusion_reasons = Counter()
+
+    def add(self, other):
+        self.parsed_count += other.parsed_count
+        self.expiring_count += other.expiring_count
+        self.excluded_count += other.excluded_count
+        self.exclusion_reasons.update(other.exclusion_reasons)
 
 
 def main():
+    args = parse_args()
+
     today_data_dir = make_today_data_dir(datetime.date.today())
     setup_logging(pjoin(today_data_dir, 'make_keys_expiring_csv.log'))
 
     stats = Stats()
 
-    all_keys_fn = pjoin(config.data_dir, 'keys.csv')
     expiring_fn = pjoin(today_data_dir, 'keys_expiring.csv')
     excluded_fn = pjoin(today_data_dir, 'keys_excluded.csv')
 
-    with setup_output_csvs(expiring_fn, excluded_fn) as \
-            (expiring_csv, excluded_csv):
+    if args.workers == 1:
+        with setup_output_csvs(expiring_fn, excluded_fn) as \
+                (expiring_csv, excluded_csv):
 
-        for key in load_keys_from_csv(all_keys_fn):
-            handle_key(key, expiring_csv, excluded_csv, stats)
+            for key in load_candidate_keys(stats):
+                handle_key(key, expiring_csv, excluded_csv, stats)
+    else:
+        filter_in_parallel(expiring_fn, excluded_fn, stats, args.workers)
+
+    check_recipient_domains(expiring_fn, excluded_fn, stats)
 
     logging.info("Checked {}, excluded {}. {} expiring in {} days.".format(
         stats.parsed_count, stats.excluded_count, stats.expiring_count,
         EXPIRING_DAYS
     ))
+    logging.info("Excluded because: {}".format(
+        dict(stats.exclusion_reasons)))
+
+
+def load_candidate_keys(stats):
+    """
+    Yield the keys worth checking: just those expiring in the window if
+    there's a key store, otherwise every key in keys.csv.
+    """
+    try:
+        store = open_key_store('keys.store')
+
+    except (EnvironmentError, ValueError) as e:  # missing, or old format
+        logging.info("Reading keys.csv, can't use keys.store: {!r}".format(e))
+        yield from load_keys_from_csv(pjoin(config.data_dir, 'keys.csv'))
+        return
+
+    indices = store.expiring_in(EXPIRING_DAYS)
+
+    stats.parsed_count += len(store) - len(indices)  # ruled out in bulk
+    yield from store.keys(indices)
+
+
+def filter_in_parallel(expiring_fn, excluded_fn, stats, workers=None):
+    """
+    Filter partitions of the keys in a process pool. Each worker writes its
+    own pair of partial CSVs, which are then concatenated in partition order,
+    so the output doesn't depend on which worker finished first.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    partitions = make_partitions(workers * PARTITIONS_PER_WORKER)
+
+    partial_dir = tempfile.mkdtemp(
+        prefix='.filter-', dir=os.path.dirname(expiring_fn)
+    )
+
+    try:
+        jobs = [
+            (partition, partial_filenames(partial_dir, partition))
+            for partition in partitions
+        ]
+
+        with multiprocessing.Pool(
+                workers, init_worker_sampling, (workers,)) as pool:
+            for partition_stats, sampled_counts in pool.imap(
+                    _filter_partition, jobs):
+                stats.add(partition_stats)
+                merge_sampled_counts(sampled_counts)
+
+        merge_csvs([fns[0] for _, fns in jobs], expiring_fn)
+        merge_csvs([fns[1] for _, fns in jobs], excluded_fn)
+
+    finally:
+        shutil.rmtree(partial_dir)
+
+    logging.info('Filtered {} partitions with {} workers'.format(
+        len(partitions), workers))
+
+
+def make_partitions(count):
+    store_dir = pjoin(config.data_dir, 'keys.store')
+
+    try:
+        return store_partitions(store_dir, count)
+
+    except (EnvironmentError, ValueError) as e:  # missing, or old format
+        logging.info("Reading keys.csv, can't use keys.store: {!r}".format(e))
+        return csv_partitions(pjoin(config.data_dir, 'keys.csv'), count)
+
+
+def partial_filenames(partial_dir, partition):
+    return tuple(
+        pjoin(partial_dir, '{}_{:05d}.csv'.format(name, partition.number))
+        for name in ('keys_expiring', 'keys_excluded')
+    )
+
+
+def _filter_partition(job):
+    partition, (expiring_fn, excluded_fn) = job
+    stats = Stats()
+
+    with setup_output_csvs(expiring_fn, excluded_fn) as \
+            (expiring_csv, excluded_csv):
+
+        for key in read_partition(partition, expiring_in=EXPIRING_DAYS):
+            handle_key(key, expiring_csv, excluded_csv, stats)
+
+    if partition.kind == STORE:  # the rest were ruled out in bulk
+        stats.parsed_count = partition.stop - partition.start
+
+    return stats, take_sampled_counts()
+
+
+def merge_csvs(partial_fns, output_fn):
+    """
+    Concatenate CSVs with the same header into `output_fn`, atomically.
+    """
+    with io.open(atomic_filename(output_fn), 'w', newline='') as output:
+        for i, partial_fn in enumerate(partial_fns):
+            with io.open(partial_fn, 'r', newline='') as f:
+                header = f.readline()
+
+                if i == 0:
+                    output.write(header)
+
+                shutil.copyfileobj(f, output)
+
+    os.rename(atomic_filename(output_fn), output_fn)
 
 
 def handle_key(key, expiring_csv, excluded_csv, stats):
+    """
+    Write the key to the expiring or excluded CSV if it's in the window.
+    Return True if it's one we should email.
+    """
     stats.parsed_count += 1
 
     if key.expires_in(EXPIRING_DAYS):
         if should_exclude(key):
             stats.excluded_count += 1
+            stats.exclusion_reasons[key.exclusion_reason] += 1
             write_key_to_csv(key, excluded_csv)
         else:
             write_key_to_csv(key, expiring_csv)
             stats.expiring_count += 1
+            return True
+
+    return False
 
 
 @contextlib.contextmanager
@@ -75,25 +234,110 @@ def setup_output_csvs(expiring_fn, excluded_fn):
         yield (expiring_csv, excluded_csv)
 
 
+def check_recipient_domains(expiring_fn, excluded_fn, stats):
+    if not config.check_recipient_dns:
+        return
+
+    with contextlib.closing(DomainValidator()) as validator:
+        dead_count = exclude_dead_domains(expiring_fn, excluded_fn, validator)
+
+    stats.expiring_count -= dead_count
+    stats.excluded_count += dead_count
+    stats.exclusion_reasons[DEAD_DOMAIN] += dead_count
+
+
+def exclude_dead_domains(expiring_fn, excluded_fn, validator):
+    """
+    Resolve the recipient domains of all the expiring keys at once, and
+    move keys whose domain can't receive email over to the excluded CSV.
+    Return how many were moved.
+    """
+    keys = list(load_keys_from_csv(expiring_fn))
+    dead = dead_domain_fingerprints(keys, validator)
+
+    if not dead:
+        return 0
+
+    with io.open(excluded_fn, 'r') as f:
+        excluded_rows = list(csv.DictReader(f))
+
+    with make_atomic_csv_writer(expiring_fn, config.csv_header) as \
+            expiring_csv, \
+            make_atomic_csv_writer(excluded_fn, config.csv_header) as \
+            excluded_csv:
+
+        for row in excluded_rows:
+            excluded_csv.writerow(row)
+
+        for key in keys:
+            if key.fingerprint in dead:
+                EXCLUDED_LOG.warning(
+                    DEAD_DOMAIN, "Skipping key with dead domain: %s",
+                    key.most_likely_uid().email
+                )
+                row = key_to_csv_row(key)
+                row['exclusion_reason'] = DEAD_DOMAIN
+                excluded_csv.writerow(row)
+            else:
+                write_key_to_csv(key, expiring_csv)
+
+    return len(dead)
+
+
+def dead_domain_fingerprints(keys, validator):
+    """
+    Return the set of fingerprints whose recipient's domain is dead.
+    """
+    domains = {}
+
+    for key in keys:
+        uid = key.most_likely_uid()
+
+        if uid is not None:
+            domains[key.fingerprint] = uid.domain.lower()
+
+    statuses = validator.validate_many(domains.values())
+
+    return set(
+        fingerprint for fingerprint, domain in domains.items()
+        if statuses[domain] == DEAD
+    )
+
+
 def should_exclude(key):
-    if not is_strong_key(key):
-        logging.warn("Skipping weak key: {}".format(
-            key.fingerprint))
+    reason = key.exclusion_reason
+
+    if reason == WEAK_KEY:
+        EXCLUDED_LOG.warning(reason, "Skipping weak key: %s", key.fingerprint)
         return True
 
-    elif all_blacklisted_domains(key):
-        logging.warn("Skipping key with all blacklisted domains: {}".format(
-            key.email_lines))
+    elif reason == ALL_BLACKLISTED_DOMAINS:
+        EXCLUDED_LOG.warning(
+            reason, "Skipping key with all blacklisted domains: %s",
+            key.email_lines
+        )
         return True
 
-    elif no_valid_emails(key):
-        logging.warn("Skipping key without any valid emails: {}".format(
-            key.fingerprint))
+    elif reason == NO_VALID_EMAILS:
+        EXCLUDED_LOG.warning(
+            reason, "Skipping key without any valid emails: %s",
+            key.fingerprint
+        )
         return True
 
     else:
         return False
 
 
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Filter in parallel with this many processes, 0 for one per '
+             'CPU (default: 1, no parallelism)'
+    )
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import sqlite3
+import time
+
+from collections import Counter
+from os.path import join as pjoin
+
+from .config import config
+from .crawl_index import normalize_short_id
+
+LOG = logging.getLogger(__name__)
+
+# Why a short ID gave us nothing to write to keys.csv.
+NOT_FOUND = 'not-found'  # the keyserver said 404
+NO_USABLE_KEYS = 'no-usable-keys'  # e.g. only v3 keys, which we drop
+REVOKED = 'revoked'  # every key for the short ID is revoked
+UNPARSEABLE = 'unparseable'
+
+# A new key for the short ID would turn these into hits.
+NEW_KEY_REASONS = (NOT_FOUND, REVOKED)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class NegativeCache():
+    """
+    Remember short IDs which never yield usable keys, and skip them for a
+    while rather than asking the keyserver again every night. The backoff
+    doubles each time the short ID comes up empty again, up to a maximum.
+
+    If the line for a short ID in the dump changes, its entry is dropped.
+    sks-dump-short-key-ids writes the number of keys after each short ID, so
+    a new key changes the line. Bare short ID lines (older dumps, deferred
+    subkey short IDs) can't show a new key, so NOT_FOUND and REVOKED misses
+    without a key count only back off for `max_unchecked_backoff_days`.
+    """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, filename=None, backoff_days=None,
+                 max_backoff_days=None, max_unchecked_backoff_days=None,
+                 clock=time.time):
+        self.filename = filename or pjoin(config.data_dir, 'negative_cache.db')
+        self.backoff_days = backoff_days or config.negative_cache_backoff_days
+        self.max_backoff_days = (
+            max_backoff_days or config.negative_cache_max_backoff_days
+        )
+        self.max_unchecked_backoff_days = (
+            max_unchecked_backoff_days or
+            config.negative_cache_max_unchecked_backoff_days
+        )
+        self._clock = clock
+
+        self._conn = sqlite3.connect(self.filename, timeout=60)
+        self._create_tables()
+        self._uncommitted = 0
+
+        self.skipped = Counter()
+        self.skipped_fingerprints = []
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+    def should_skip(self, short_id, line=None):
+        """
+        Return True if the short ID is still backing off. `line` is the
+        short ID's line in the dump; if given and different from last time,
+        the entry is invalidated.
+        """
+        short_id = normalize_short_id(short_id)
+
+        row = self._conn.execute(
+            'SELECT reason, line_digest, retry_after, fingerprints '
+            'FROM misses WHERE short_id = ?', (short_id,)
+        ).fetchone()
+
+        if row is None:
+            return False
+
+        reason, line_digest, retry_after, fingerprints = row
+
+        if line is not None and _digest(line) != line_digest:
+            self._delete(short_id)
+            return False
+
+        if self._clock() >= retry_after:
+            return False
+
+        self.skipped[reason] += 1
+
+        if fingerprints:
+            self.skipped_fingerprints.extend(fingerprints.split(' '))
+
+        return True
+
+    def record_miss(self, short_id, reason, line=None, fingerprints=()):
+        short_id = normalize_short_id(short_id)
+
+        row = self._conn.execute(
+            'SELECT misses FROM misses WHERE short_id = ?', (short_id,)
+        ).fetchone()
+
+        misses = row[0] + 1 if row is not None else 1
+        backoff_days = min(
+            self._max_backoff_days(reason, line),
+            self.backoff_days * 2 ** (misses - 1)
+        )
+        now = self._clock()
+
+        self._conn.execute(
+            'INSERT OR REPLACE INTO misses '
+            '(short_id, reason, line_digest, misses, last_checked, '
+            ' retry_after, fingerprints) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (
+                short_id, reason, _digest(line or short_id), misses, now,
+                now + backoff_days * SECONDS_PER_DAY, ' '.join(fingerprints)
+            )
+        )
+        self._maybe_commit()
+
+    def record_hit(self, short_id):
+        self._delete(normalize_short_id(short_id))
+
+    def report(self):
+        total = sum(self.skipped.values())
+
+        if not total:
+            return 'Negative cache: no lookups skipped'
+
+        return 'Negative cache: skipped {} lookups ({})'.format(
+            total, ', '.join(
+                '{} {}'.format(count, reason)
+                for reason, count in sorted(self.skipped.items())
+            )
+        )
+
+    def _max_backoff_days(self, reason, line):
+        if reason in NEW_KEY_REASONS and not _has_key_count(line):
+            return min(self.max_backoff_days, self.max_unchecked_backoff_days)
+
+        return self.max_backoff_days
+
+    def _delete(self, short_id):
+        self._conn.execute('DELETE FROM misses WHERE short_id = ?',
+                           (short_id,))
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+
+        if self._uncommitted >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def _create_tables(self):
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS misses ('
+            '  short_id TEXT PRIMARY KEY,'
+            '  reason TEXT NOT NULL,'
+            '  line_digest TEXT NOT NULL,'
+            '  misses INTEGER NOT NULL,'
+            '  last_checked REAL NOT NULL,'
+            '  retry_after REAL NOT NULL,'
+            '  fingerprints TEXT NOT NULL'
+            ')'
+        )
+        self._conn.commit()
+
+
+def _has_key_count(line):
+    return line is not None and len(line.split()) > 1
+
+
+def _digest(line):
+    """
+    Digest a dump line, ignoring the case of its short ID, so a line put
+    back together by ShortIdQueue matches the original.
+    """
+    fields = line.split()
+    fields[0] = normalize_short_id(fields[0])
+
+    return hashlib.sha1(' '.join(fields).encode('utf-8')).hexdigest()[:16]
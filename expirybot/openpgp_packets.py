@@ -0,0 +1,484 @@
+import base64
+import binascii
+import hashlib
+import logging
+import struct
+
+from .logs import SampledLogger
+from .pgp_key import (
+    PGPKey, Subkey, Fingerprint, OpenPGPVersion3FingerprintUnsupported
+)
+
+LOG = logging.getLogger(__name__)
+SAMPLED_LOG = SampledLogger(LOG)
+
+# Packet tags, RFC 4880 section 4.3
+SIGNATURE = 2
+PUBLIC_KEY = 6
+USER_ID = 13
+PUBLIC_SUBKEY = 14
+USER_ATTRIBUTE = 17
+
+# Signature types, RFC 4880 section 5.2.1
+CERTIFICATIONS = (0x10, 0x11, 0x12, 0x13)
+SUBKEY_BINDING = 0x18
+DIRECT_KEY = 0x1F
+KEY_REVOCATION = 0x20
+SUBKEY_REVOCATION = 0x28
+CERTIFICATION_REVOCATION = 0x30
+
+# Signature subpacket types, RFC 4880 section 5.2.3.1
+SIGNATURE_CREATION_TIME = 2
+KEY_EXPIRATION_TIME = 9
+ISSUER = 16
+ISSUER_FINGERPRINT = 33
+
+RSA_ALGORITHMS = (1, 2, 3)
+DLOG_ALGORITHMS = (16, 17, 20)  # Elgamal & DSA: size is that of p
+CURVE_ALGORITHMS = (18, 19, 22)  # ECDH, ECDSA, EdDSA: size from curve OID
+
+# Curve OID -> size in bits, as reported by `gpg --with-colons`
+CURVE_SIZES = {
+    bytes.fromhex('2A8648CE3D030107'): 256,  # NIST P-256
+    bytes.fromhex('2B81040022'): 384,  # NIST P-384
+    bytes.fromhex('2B81040023'): 521,  # NIST P-521
+    bytes.fromhex('2B8104000A'): 256,  # secp256k1
+    bytes.fromhex('2B2403030208010107'): 256,  # brainpoolP256r1
+    bytes.fromhex('2B240303020801010B'): 384,  # brainpoolP384r1
+    bytes.fromhex('2B240303020801010D'): 512,  # brainpoolP512r1
+    bytes.fromhex('2B06010401DA470F01'): 255,  # Ed25519
+    bytes.fromhex('2B060104019755010501'): 255,  # Curve25519
+    bytes.fromhex('2B0601040197550105'): 255,  # Curve25519 (legacy OID)
+    bytes.fromhex('2B656F'): 448,  # X448
+    bytes.fromhex('2B6571'): 448,  # Ed448
+}
+
+
+class PacketFormatError(ValueError):
+    """
+    The data isn't a valid sequence of packets, e.g. it's truncated or has
+    garbage after the last key.
+    """
+
+
+class OpenPGPPacketParser():
+    """
+    Parse OpenPGP transferable public keys (e.g. the armored output of a
+    keyserver's op=get) straight into PGPKey objects, without running gpg.
+
+    Signatures are not verified: like the vindex output we already rely on,
+    we trust the keyserver. Self-signatures are identified by issuer key ID.
+    """
+
+    def __init__(self, data):
+        if isinstance(data, bytes) and data.lstrip().startswith(b'-----'):
+            data = data.decode('ascii', errors='replace')
+
+        if isinstance(data, str):
+            data = dearmor(data)
+
+        self.data = data
+
+    def keys(self):
+        """
+        Yield each key in turn. If the packets turn out to be corrupt, the
+        key being read is dropped and PacketFormatError raised, so keys
+        before the damage are still had.
+        """
+        builder = None
+
+        for tag, body in iter_packets(self.data):
+            if tag == PUBLIC_KEY:
+                if builder is not None:
+                    yield from builder.finish()
+
+                builder = _KeyBuilder()
+
+            if builder is not None:
+                builder.add_packet(tag, body)
+
+        if builder is not None:
+            yield from builder.finish()
+
+
+class _KeyBuilder():
+    def __init__(self):
+        self.invalid = False
+
+        self.primary = None
+        self.uids = []
+        self.subkeys = []
+        self.revoked = False
+
+        self.current = None
+
+    def add_packet(self, tag, body):
+        if self.invalid:
+            return
+
+        try:
+            self._add_packet(tag, body)
+
+        except OpenPGPVersion3FingerprintUnsupported:
+            self.invalid = True
+
+        except (ValueError, IndexError, struct.error) as e:
+            SAMPLED_LOG.warning('unparseable-key',
+                                'Skipping unparseable key: %r', e)
+            self.invalid = True
+
+    def _add_packet(self, tag, body):
+        if tag == PUBLIC_KEY:
+            self.primary = _parse_public_key(body)
+            self.current = self.primary
+
+        elif tag == PUBLIC_SUBKEY:
+            subkey = _parse_public_key(body)
+            self.subkeys.append(subkey)
+            self.current = subkey
+
+        elif tag == USER_ID:
+            uid = _Component(body.decode('utf-8', errors='replace'))
+            self.uids.append(uid)
+            self.current = uid
+
+        elif tag == USER_ATTRIBUTE:
+            self.current = _Component(None)  # e.g. a photo, ignore
+
+        elif tag == SIGNATURE and self.primary is not None:
+            self._add_signature(_parse_signature(body))
+
+    def _add_signature(self, signature):
+        if not signature.is_issued_by(self.primary):
+            return  # third-party certification
+
+        if self.current is self.primary:
+            if signature.sig_type == KEY_REVOCATION:
+                self.revoked = True
+            elif signature.sig_type == DIRECT_KEY:
+                self.primary.add_self_signature(signature)
+
+        elif self.current in self.uids:
+            if signature.sig_type in CERTIFICATIONS:
+                self.current.add_self_signature(signature)
+                self.primary.add_self_signature(signature)
+            elif signature.sig_type == CERTIFICATION_REVOCATION:
+                self.current.add_revocation(signature)
+
+        elif self.current in self.subkeys:
+            if signature.sig_type == SUBKEY_BINDING:
+                self.current.add_self_signature(signature)
+            elif signature.sig_type == SUBKEY_REVOCATION:
+                self.current.add_revocation(signature)
+
+    def finish(self):
+        if self.invalid or self.primary is None:
+            return
+
+        key = PGPKey(
+            fingerprint=self.primary.fingerprint,
+            algorithm_number=self.primary.algorithm_number,
+            size_bits=self.primary.size_bits
+        )
+        key.set_created_timestamp(self.primary.created)
+
+        if self.primary.expires is not None:
+            key.set_expiry_timestamp(self.primary.expires)
+
+        if self.revoked:
+            key.set_revoked()
+
+        for uid in self.uids:
+            if not uid.is_revoked and '\0' not in uid.value:
+                key.add_uid(uid.value)
+
+        for subkey in self.subkeys:
+            key.add_subkey(Subkey(
+                fingerprint=Fingerprint(subkey.fingerprint),
+                algorithm_number=subkey.algorithm_number,
+                size_bits=subkey.size_bits,
+                created_date=PGPKey._parse_timestamp(subkey.created),
+                expiry_date=(
+                    PGPKey._parse_timestamp(subkey.expires)
+                    if subkey.expires is not None else None
+                ),
+                revoked=subkey.is_revoked
+            ))
+
+        yield key
+
+
+class _Component():
+    """
+    A user ID or (sub)key, and the most recent self-signature on it.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.latest_signature = None
+        self.latest_revocation = None
+
+    def add_self_signature(self, signature):
+        if self.latest_signature is None or \
+                signature.created >= self.latest_signature.created:
+            self.latest_signature = signature
+
+    def add_revocation(self, signature):
+        self.latest_revocation = signature
+
+    @property
+    def is_revoked(self):
+        # A later self-signature (e.g. re-adding a UID) trumps a revocation.
+        if self.latest_revocation is None:
+            return False
+
+        return self.latest_signature is None or \
+            self.latest_revocation.created >= self.latest_signature.created
+
+
+class _PublicKey(_Component):
+    def __init__(self, fingerprint, algorithm_number, size_bits, created):
+        super().__init__(fingerprint)
+
+        self.fingerprint = fingerprint
+        self.algorithm_number = algorithm_number
+        self.size_bits = size_bits
+        self.created = created
+
+    @property
+    def key_id(self):
+        return bytes.fromhex(self.fingerprint[-16:])
+
+    @property
+    def expires(self):
+        if self.latest_signature is None:
+            return None
+
+        seconds = self.latest_signature.key_expiration_seconds
+
+        if not seconds:
+            return None
+
+        return self.created + seconds
+
+
+class _Signature():
+    def __init__(self, sig_type, created, key_expiration_seconds,
+                 issuer_key_id, issuer_fingerprint):
+        self.sig_type = sig_type
+        self.created = created
+        self.key_expiration_seconds = key_expiration_seconds
+        self.issuer_key_id = issuer_key_id
+        self.issuer_fingerprint = issuer_fingerprint
+
+    def is_issued_by(self, public_key):
+        if self.issuer_fingerprint is not None:
+            return self.issuer_fingerprint == public_key.fingerprint
+
+        if self.issuer_key_id is not None:
+            return self.issuer_key_id == public_key.key_id
+
+        return True  # no issuer: assume a self-signature
+
+
+def dearmor(text):
+    """
+    Decode every ASCII-armored block in `text` and return the concatenated
+    binary packets.
+    """
+    data = bytearray()
+    lines = None
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        if line.startswith('-----BEGIN PGP'):
+            lines = []
+
+        elif line.startswith('-----END PGP'):
+            data.extend(base64.b64decode(''.join(lines)))
+            lines = None
+
+        elif lines is None or line.startswith('='):
+            continue  # outside a block, or the CRC24 checksum
+
+        elif ':' in line and not lines:
+            continue  # armor header, e.g. `Comment: ...`
+
+        else:
+            lines.append(line)
+
+    return bytes(data)
+
+
+def iter_packets(data):
+    """
+    Yield (tag, body) for each packet in `data`, handling both old and new
+    format packet headers.
+    """
+    data = memoryview(data)
+    offset = 0
+
+    while offset < len(data):
+        packet_offset = offset
+        header = data[offset]
+        offset += 1
+
+        if not header & 0x80:
+            raise PacketFormatError(
+                'Invalid packet header at offset {}'.format(packet_offset))
+
+        try:
+            if header & 0x40:  # new format
+                tag = header & 0x3F
+                body, offset = _read_new_format_body(data, offset)
+
+            else:  # old format
+                tag = (header >> 2) & 0x0F
+                length_type = header & 0x03
+
+                if length_type == 3:  # indeterminate: runs to the end
+                    length = len(data) - offset
+                else:
+                    size = 1 << length_type
+                    length = int.from_bytes(
+                        data[offset:offset + size], 'big')
+                    offset += size
+
+                body = bytes(data[offset:offset + length])
+                offset += length
+
+        except IndexError:
+            offset = len(data) + 1
+
+        if offset > len(data):
+            raise PacketFormatError(
+                'Truncated packet at offset {}'.format(packet_offset))
+
+        yield tag, body
+
+
+def _read_new_format_body(data, offset):
+    chunks = []
+
+    while True:
+        first = data[offset]
+
+        if first < 192:
+            length, offset = first, offset + 1
+        elif first < 224:
+            length = ((first - 192) << 8) + data[offset + 1] + 192
+            offset += 2
+        elif first == 255:
+            length = int.from_bytes(data[offset + 1:offset + 5], 'big')
+            offset += 5
+        else:  # partial body length, more chunks follow
+            length = 1 << (first & 0x1F)
+            chunks.append(bytes(data[offset + 1:offset + 1 + length]))
+            offset += 1 + length
+            continue
+
+        chunks.append(bytes(data[offset:offset + length]))
+        return b''.join(chunks), offset + length
+
+
+def _parse_public_key(body):
+    version = body[0]
+
+    if version in (2, 3):
+        raise OpenPGPVersion3FingerprintUnsupported(
+            'Version {} key'.format(version))
+
+    if version != 4:
+        raise ValueError('Unsupported key version {}'.format(version))
+
+    created, algorithm_number = struct.unpack('>IB', body[1:6])
+
+    fingerprint = hashlib.sha1(
+        b'\x99' + struct.pack('>H', len(body)) + body
+    ).hexdigest().upper()
+
+    return _PublicKey(
+        fingerprint, algorithm_number,
+        _key_size_bits(algorithm_number, body[6:]),
+        created
+    )
+
+
+def _key_size_bits(algorithm_number, material):
+    if algorithm_number in RSA_ALGORITHMS + DLOG_ALGORITHMS:
+        return struct.unpack('>H', material[0:2])[0]  # first MPI's bit count
+
+    elif algorithm_number in CURVE_ALGORITHMS:
+        oid = bytes(material[1:1 + material[0]])
+        return CURVE_SIZES.get(oid, 0)
+
+    else:
+        return 0
+
+
+def _parse_signature(body):
+    version = body[0]
+
+    if version == 3:
+        sig_type = body[2]
+        created = struct.unpack('>I', body[3:7])[0]
+        issuer_key_id = bytes(body[7:15])
+
+        return _Signature(sig_type, created, None, issuer_key_id, None)
+
+    if version != 4:
+        raise ValueError('Unsupported signature version {}'.format(version))
+
+    sig_type = body[1]
+
+    hashed_length = struct.unpack('>H', body[4:6])[0]
+    hashed = body[6:6 + hashed_length]
+
+    offset = 6 + hashed_length
+    unhashed_length = struct.unpack('>H', body[offset:offset + 2])[0]
+    unhashed = body[offset + 2:offset + 2 + unhashed_length]
+
+    created = 0
+    key_expiration_seconds = None
+    issuer_key_id = None
+    issuer_fingerprint = None
+
+    # Only trust creation & expiry times from the hashed area.
+    for subpacket_type, value in _iter_subpackets(hashed):
+        if subpacket_type == SIGNATURE_CREATION_TIME:
+            created = struct.unpack('>I', value)[0]
+
+        elif subpacket_type == KEY_EXPIRATION_TIME:
+            key_expiration_seconds = struct.unpack('>I', value)[0]
+
+    for subpacket_type, value in _iter_subpackets(hashed + unhashed):
+        if subpacket_type == ISSUER:
+            issuer_key_id = bytes(value)
+
+        elif subpacket_type == ISSUER_FINGERPRINT and value[0] == 4:
+            issuer_fingerprint = binascii.hexlify(value[1:]).decode().upper()
+
+    return _Signature(sig_type, created, key_expiration_seconds,
+                      issuer_key_id, issuer_fingerprint)
+
+
+def _iter_subpackets(data):
+    offset = 0
+
+    while offset < len(data):
+        first = data[offset]
+
+        if first < 192:
+            length, offset = first, offset + 1
+        elif first < 255:
+            length = ((first - 192) << 8) + data[offset + 1] + 192
+            offset += 2
+        else:
+            length = struct.unpack('>I', data[offset + 1:offset + 5])[0]
+            offset += 5
+
+        subpacket_type = data[offset] & 0x7F  # top bit is 'critical'
+        yield subpacket_type, data[offset + 1:offset + length]
+
+        offset += length
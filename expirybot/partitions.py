@@ -0,0 +1,140 @@
+import csv
+import io
+import os
+import re
+
+from collections import namedtuple
+
+from .key_store import KeyStore
+from .pgp_key import PGPKey
+
+# A slice of keys.csv (byte offsets) or of a key store (key indices), small
+# enough to pickle and hand to a worker process.
+Partition = namedtuple(
+    'Partition', ['number', 'kind', 'path', 'start', 'stop']
+)
+
+CSV = 'csv'
+STORE = 'store'
+
+# Every keys.csv row starts with its quoted, space-separated fingerprint.
+ROW_START = re.compile(br'^"[0-9A-F]{4}( {1,2}[0-9A-F]{4}){9}",')
+
+
+def csv_partitions(filename, count):
+    """
+    Split keys.csv into `count` byte ranges. A partition holds the rows which
+    start inside its range, so each row belongs to exactly one.
+    """
+    with io.open(filename, 'rb') as f:
+        header_bytes = len(f.readline())
+
+    size = os.path.getsize(filename)
+    bounds = [
+        header_bytes + ((size - header_bytes) * i) // count
+        for i in range(count + 1)
+    ]
+
+    return [
+        Partition(number, CSV, filename, bounds[number], bounds[number + 1])
+        for number in range(count)
+    ]
+
+
+def store_partitions(dirname, count):
+    """
+    Split a key store into `count` runs of key indices.
+    """
+    total = len(KeyStore(dirname))
+    bounds = [(total * i) // count for i in range(count + 1)]
+
+    return [
+        Partition(number, STORE, dirname, bounds[number], bounds[number + 1])
+        for number in range(count)
+    ]
+
+
+def read_partition(partition, expiring_in=None):
+    """
+    Yield the keys in a partition. For a key store, `expiring_in` only
+    yields keys expiring that many days from now, using the expiry column.
+    """
+    if partition.kind == STORE:
+        store = KeyStore(partition.path)
+
+        if expiring_in is None:
+            indices = range(partition.start, partition.stop)
+        else:
+            indices = store.expiring_in(
+                expiring_in, start=partition.start, stop=partition.stop
+            )
+
+        yield from store.keys(indices)
+
+    else:
+        for row in _read_csv_rows(partition):
+            yield PGPKey(**row)
+
+
+def _read_csv_rows(partition):
+    csv.field_size_limit(500 * 1024 * 1024)
+
+    with io.open(partition.path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8')]))
+
+        f.seek(partition.start)
+        position = _seek_to_row_start(f, partition.start)
+
+        while position < partition.stop:
+            lines = _read_record_lines(f)
+
+            if not lines:
+                break
+
+            record = b''.join(lines).decode('utf-8')
+            yield dict(zip(header, next(csv.reader(io.StringIO(record)))))
+
+            position = f.tell()
+
+
+def _seek_to_row_start(f, start):
+    """
+    Skip forward to the first row starting at or after `start`, and return
+    its offset. Continuation lines of a multi-line field are skipped too.
+    """
+    position = start
+
+    if start > 0:
+        f.seek(start - 1)
+        f.readline()  # rest of the row we landed in (or just its newline)
+        position = f.tell()
+
+    while True:
+        line = f.readline()
+
+        if not line or ROW_START.match(line):
+            f.seek(position)
+            return position
+
+        position = f.tell()
+
+
+def _read_record_lines(f):
+    """
+    Read one CSV record, which may span lines if a field contains newlines:
+    every field is quoted, so a record is complete once its quotes balance.
+    """
+    lines = []
+    quotes = 0
+
+    while True:
+        line = f.readline()
+
+        if not line:
+            return lines
+
+        lines.append(line)
+        quotes += line.count(b'"')
+
+        if quotes % 2 == 0:
+            return lines
@@ -2,6 +2,9 @@ import datetime
 import re
 
 import logging
+from collections import namedtuple
+from . import exclusions
+from .config import config
 from .exclusions import roughly_validate_email, is_blacklisted
 
 LOG = logging.getLogger(__name__)
@@ -11,6 +14,27 @@ class OpenPGPVersion3FingerprintUnsupported(ValueError):
     pass
 
 
+# Facts derived from a key's UIDs and algorithm, worked out once by the crawl
+# and stored as extra columns in the CSVs. Bump the version whenever the way
+# they're derived changes, so stale values are ignored and recomputed. The
+# stored version also includes the blacklist's digest, see derived_version().
+DERIVED_COLUMNS_VERSION = 2
+
+
+def derived_version():
+    """
+    Return the derived_version to store: exclusion_reason and the recipient
+    depend on the blacklist, so changing it also makes stored values stale.
+    """
+    return '{}-{}'.format(DERIVED_COLUMNS_VERSION, config.domain_rules.digest)
+
+
+Subkey = namedtuple(
+    'Subkey', ['fingerprint', 'algorithm_number', 'size_bits', 'created_date',
+               'expiry_date', 'revoked']
+)
+
+
 class PGPKey:
 
     def __init__(self, fingerprint=None, algorithm_number=None, size_bits=None,
@@ -21,6 +45,8 @@ class PGPKey:
         self._created_date = None
         self._expiry_date = None
         self._uids = []
+        self._derived = None
+        self._subkeys = []
         self._revoked = False
 
         if fingerprint is not None:
@@ -42,6 +68,8 @@ class PGPKey:
         if expiry_date is not None:
             self.set_expiry_date(expiry_date)
 
+        self._derived = self._parse_derived_columns(kwargs)
+
     def __str__(self):
         return 'PGPKey({} {})'.format(
             self.fingerprint,
@@ -54,12 +82,14 @@ class PGPKey:
 
     def set_algorithm_number(self, algorithm_number):
         self._algorithm_number = int(algorithm_number)
+        self._derived = None
 
     def set_size_bits(self, size_bits):
         if not isinstance(size_bits, int):
             size_bits = int(size_bits)
 
         self._size_bits = size_bits
+        self._derived = None
 
     def set_created_timestamp(self, timestamp):
         self._created_date = self._parse_timestamp(timestamp)
@@ -79,6 +109,11 @@ class PGPKey:
             raise ValueError('NULL byte in uid for {}'.format(self))
 
         self._uids.append(uid_string)
+        self._derived = None
+
+    def add_subkey(self, subkey):
+        assert isinstance(subkey, Subkey)
+        self._subkeys.append(subkey)
 
     def set_revoked(self):
         self._revoked = True
@@ -150,6 +185,10 @@ class PGPKey:
     def uids(self):
         return list(map(UID, self._uids))
 
+    @property
+    def subkeys(self):
+        return list(self._subkeys)
+
     @property
     def email_lines(self):
         return list(filter(None, (uid.email_line for uid in self.uids)))
@@ -158,7 +197,49 @@ class PGPKey:
     def emails(self):
         return list(filter(None, (uid.email for uid in self.uids)))
 
+    @property
+    def is_strong(self):
+        if self._derived is not None:
+            return self._derived['is_strong']
+
+        return exclusions.is_strong_key(self)
+
+    @property
+    def exclusion_reason(self):
+        if self._derived is not None:
+            return self._derived['exclusion_reason']
+
+        return exclusions.exclusion_reason(self)
+
+    @property
+    def domains(self):
+        if self._derived is not None:
+            return self._derived['domains']
+
+        domains = []
+
+        for uid in self.uids:
+            if uid.domain is not None and uid.domain.lower() not in domains:
+                domains.append(uid.domain.lower())
+
+        return domains
+
+    def derived_columns(self):
+        uid = self.most_likely_uid()
+
+        return {
+            'derived_version': derived_version(),
+            'recipient_email_line': uid.email_line if uid else '',
+            'is_strong': int(self.is_strong),
+            'exclusion_reason': self.exclusion_reason or '',
+            'domains': '|'.join(self.domains),
+        }
+
     def most_likely_uid(self):
+        if self._derived is not None:
+            line = self._derived['recipient_email_line']
+            return UID(line) if line else None
+
         uids_with_emails = filter(
             lambda uid: uid.email is not None,
             self.uids
@@ -178,6 +259,22 @@ class PGPKey:
     def expires_in(self, days):
         return self.days_until_expiry == days
 
+    @staticmethod
+    def _parse_derived_columns(row):
+        """
+        Return the stored derived facts from a CSV row, or None if they're
+        missing, from a different version or from a different blacklist.
+        """
+        if row.get('derived_version') != derived_version():
+            return None
+
+        return {
+            'recipient_email_line': row['recipient_email_line'],
+            'is_strong': row['is_strong'] == '1',
+            'exclusion_reason': row['exclusion_reason'] or None,
+            'domains': row['domains'].split('|') if row['domains'] else [],
+        }
+
     @staticmethod
     def _parse_date(date):
         """
@@ -292,7 +389,7 @@ class Fingerprint():
             )  # e.g. return 'A999B749...'
         else:
             if len(string) == 16:
-                LOG.debug("Dropping v3 key {}".format(string))
+                LOG.debug("Dropping v3 key %s", string)
                 raise OpenPGPVersion3FingerprintUnsupported(
                     '{}'.format(string)
                 )
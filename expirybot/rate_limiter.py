@@ -0,0 +1,129 @@
+import datetime
+import fcntl
+import io
+import json
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+
+from .exceptions import DailyCapReached
+
+LOG = logging.getLogger(__name__)
+
+
+class PersistentTokenBucket():
+    """
+    A token bucket whose state lives in a flock-protected JSON file, so every
+    process sending mail (each cron run of send_emails, evaluate_last_week)
+    draws from the same budget rather than starting with a full bucket.
+
+    Tokens refill continuously at `per_hour`. With the default burst of 1,
+    sends are spaced evenly across the hour instead of bunching at the start
+    of each run.
+    """
+
+    def __init__(self, state_filename, per_hour, burst=1, daily_cap=None,
+                 clock=time.time, sleep=time.sleep):
+        self.state_filename = state_filename
+        self.seconds_per_token = 60 * 60 / per_hour
+        self.burst = burst
+        self.daily_cap = daily_cap
+
+        self._clock = clock
+        self._sleep = sleep
+
+    def acquire(self, counts_towards_daily_cap=True):
+        """
+        Block until a token is available and take it. Raises DailyCapReached
+        if today's cap has already been used up.
+        """
+        while True:
+            wait_seconds = self._try_acquire(counts_towards_daily_cap)
+
+            if wait_seconds == 0:
+                return
+
+            LOG.debug('Rate limited, waiting {:.1f}s'.format(wait_seconds))
+            self._sleep(wait_seconds)
+
+    def refund(self):
+        """
+        Give back today's cap for a send which didn't go out. The token isn't
+        returned: the attempt still took up the server's time.
+        """
+        with self._locked_state() as state:
+            state['sent_today'] = max(0, state['sent_today'] - 1)
+
+    def sent_today(self):
+        with self._locked_state() as state:
+            return state['sent_today']
+
+    def _try_acquire(self, counts_towards_daily_cap):
+        with self._locked_state() as state:
+            if counts_towards_daily_cap and self.daily_cap is not None \
+                    and state['sent_today'] >= self.daily_cap:
+                raise DailyCapReached(
+                    'Already sent {} of {} today'.format(
+                        state['sent_today'], self.daily_cap))
+
+            if state['tokens'] < 1:
+                return (1 - state['tokens']) * self.seconds_per_token
+
+            state['tokens'] -= 1
+
+            if counts_towards_daily_cap:
+                state['sent_today'] += 1
+
+            return 0
+
+    @contextmanager
+    def _locked_state(self):
+        with io.open(self.state_filename, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                f.seek(0)
+                state = self._refill(self._parse(f.read()))
+
+                yield state
+
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _parse(self, content):
+        try:
+            return json.loads(content)
+        except ValueError:
+            if content:
+                LOG.warn('Ignoring corrupt rate limit state in {}'.format(
+                    self.state_filename))
+
+            return {}
+
+    def _refill(self, state):
+        now = self._clock()
+        today = datetime.date.fromtimestamp(now).isoformat()
+
+        tokens = state.get('tokens', self.burst)
+        elapsed = max(0, now - state.get('updated_at', now))
+        tokens = min(self.burst, tokens + elapsed / self.seconds_per_token)
+
+        if state.get('day') != today:
+            sent_today = 0
+        else:
+            sent_today = state.get('sent_today', 0)
+
+        return {
+            'tokens': tokens,
+            'updated_at': now,
+            'day': today,
+            'sent_today': sent_today,
+        }
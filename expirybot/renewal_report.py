@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""
+- load keys_expiring.csv and emails_sent.csv for every day in the window
+- find out from the key history when (if ever) each key was renewed
+- compute renewal rates for every cohort, lag and domain in one pass
+- output ${DATA}/renewal_timeseries.csv and ${DATA}/domain_renewal_rates.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+
+from collections import OrderedDict
+from os.path import join as pjoin
+
+import numpy as np
+
+from .config import config
+from .key_history import KeyHistory
+from .make_keys_expiring_csv import EXPIRING_DAYS
+from .utils import (
+    load_keys_from_csv, make_atomic_csv_writer, make_today_data_dir,
+    setup_logging
+)
+
+LAGS = (1, 3, 7, 14, 30)
+
+# The lag and minimum number of emailed keys used for the per-domain rates
+# that feed the send queue.
+DOMAIN_RATE_LAG = 7
+MIN_KEYS_PER_DOMAIN = 20
+
+EPOCH = datetime.date(1970, 1, 1)
+NOT_RENEWED = -1
+
+
+class CohortColumns():
+    """
+    One entry per key per cohort (day it was in keys_expiring.csv), held as
+    parallel NumPy arrays. Domains are stored as indexes into `domains`.
+    """
+
+    def __init__(self, cohort_day, emailed, domain, renewal_lag, domains):
+        self.cohort_day = np.asarray(cohort_day, dtype=np.int32)
+        self.emailed = np.asarray(emailed, dtype=bool)
+        self.domain = np.asarray(domain, dtype=np.int32)
+        self.renewal_lag = np.asarray(renewal_lag, dtype=np.int32)
+        self.domains = domains
+
+    def __len__(self):
+        return len(self.cohort_day)
+
+
+def main():
+    args = parse_args()
+
+    today = datetime.date.today()
+    setup_logging(pjoin(make_today_data_dir(today), 'renewal_report.log'))
+
+    days = [today - datetime.timedelta(days=n) for n in range(args.days, 0, -1)]
+
+    with contextlib.closing(KeyHistory()) as history:
+        columns = load_cohorts(days, history)
+
+    logging.info("Loaded {} keys from {} days".format(len(columns), len(days)))
+
+    write_timeseries(
+        cohort_renewal_rates(columns, LAGS, today),
+        pjoin(config.data_dir, 'renewal_timeseries.csv')
+    )
+
+    write_domain_renewal_rates(
+        domain_renewal_rates(
+            columns, DOMAIN_RATE_LAG, today, MIN_KEYS_PER_DOMAIN
+        ),
+        pjoin(config.data_dir, 'domain_renewal_rates.json')
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--days', type=int, default=90,
+        help='How many days of cohorts to include (default: 90)'
+    )
+    return parser.parse_args()
+
+
+def load_cohorts(days, history):
+    cohort_day, emailed, domain, renewal_lag = [], [], [], []
+    domain_ids = OrderedDict()
+
+    for day in days:
+        data_dir = make_today_data_dir(day)
+        expiring_fn = pjoin(data_dir, 'keys_expiring.csv')
+        emails_sent_fn = pjoin(data_dir, 'emails_sent.csv')
+
+        if not os.path.exists(expiring_fn):
+            logging.info("No keys_expiring.csv for {}".format(day))
+            continue
+
+        keys = list(load_keys_from_csv(expiring_fn))
+
+        if os.path.exists(emails_sent_fn):
+            emailed_fingerprints = set(
+                k.fingerprint for k in load_keys_from_csv(emails_sent_fn)
+            )
+        else:
+            emailed_fingerprints = set()
+
+        renewal_days = history.renewal_days(
+            [key.fingerprint for key in keys],
+            day,
+            day + datetime.timedelta(days=EXPIRING_DAYS)
+        )
+
+        for key in keys:
+            uid = key.most_likely_uid()
+            key_domain = uid.domain.lower() if uid is not None else ''
+            renewed_on = renewal_days.get(key.fingerprint.hex_format)
+
+            cohort_day.append(to_day_number(day))
+            emailed.append(key.fingerprint in emailed_fingerprints)
+            domain.append(domain_ids.setdefault(key_domain, len(domain_ids)))
+            renewal_lag.append(
+                (renewed_on - day).days if renewed_on else NOT_RENEWED
+            )
+
+    return CohortColumns(
+        cohort_day, emailed, domain, renewal_lag, list(domain_ids.keys())
+    )
+
+
+def renewed_within(columns, lags):
+    """
+    Return a boolean matrix, one row per key and one column per lag, of
+    whether the key was renewed within that many days.
+    """
+    lag = columns.renewal_lag[:, np.newaxis]
+    return (lag != NOT_RENEWED) & (lag <= np.asarray(lags)[np.newaxis, :])
+
+
+def cohort_renewal_rates(columns, lags, today):
+    """
+    Return a list of OrderedDict rows, one per (cohort day, emailed), with
+    the renewal percentage at each lag. Lags which haven't fully elapsed yet
+    for a cohort are left as None.
+    """
+    if not len(columns):
+        return []
+
+    group = columns.cohort_day.astype(np.int64) * 2 + columns.emailed
+    groups, inverse = np.unique(group, return_inverse=True)
+
+    keys = np.bincount(inverse)
+    renewed = np.stack([
+        np.bincount(inverse, weights=column, minlength=len(groups))
+        for column in renewed_within(columns, lags).T
+    ], axis=1)
+
+    group_day = groups // 2
+    observed = (to_day_number(today) - group_day)[:, np.newaxis] >= \
+        np.asarray(lags)[np.newaxis, :]
+    pct = np.where(observed, 100 * renewed / keys[:, np.newaxis], np.nan)
+
+    rows = []
+
+    for i, group_key in enumerate(groups):
+        row = OrderedDict([
+            ('cohort_date', from_day_number(group_day[i]).isoformat()),
+            ('emailed', bool(group_key % 2)),
+            ('keys', int(keys[i])),
+        ])
+
+        for j, lag in enumerate(lags):
+            row['renewed_pct_{}d'.format(lag)] = (
+                None if np.isnan(pct[i, j]) else round(float(pct[i, j]), 2)
+            )
+
+        rows.append(row)
+
+    return rows
+
+
+def domain_renewal_rates(columns, lag, today, min_keys):
+    """
+    Return {domain: fraction of emailed keys renewed within `lag` days} for
+    domains with at least `min_keys` emailed keys old enough to judge.
+    """
+    if not len(columns):
+        return {}
+
+    eligible = columns.emailed & \
+        (to_day_number(today) - columns.cohort_day >= lag)
+
+    domain = columns.domain[eligible]
+    renewed = renewed_within(columns, [lag])[eligible, 0]
+
+    keys = np.bincount(domain, minlength=len(columns.domains))
+    renewed = np.bincount(domain, weights=renewed,
+                          minlength=len(columns.domains))
+
+    return OrderedDict(
+        (columns.domains[i], round(float(renewed[i] / keys[i]), 4))
+        for i in np.flatnonzero(keys >= min_keys)
+        if columns.domains[i]
+    )
+
+
+def write_timeseries(rows, filename):
+    header = ['cohort_date', 'emailed', 'keys'] + [
+        'renewed_pct_{}d'.format(lag) for lag in LAGS
+    ]
+
+    with make_atomic_csv_writer(filename, header) as csv_writer:
+        for row in rows:
+            csv_writer.writerow(row)
+
+
+def write_domain_renewal_rates(rates, filename):
+    with io.open(filename, 'w') as f:
+        json.dump(rates, f, indent=4)
+
+
+def to_day_number(date):
+    return (date - EPOCH).days
+
+
+def from_day_number(number):
+    return EPOCH + datetime.timedelta(days=int(number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import math
+import random
+
+from collections import OrderedDict
+
+# Two-sided critical values of the standard normal distribution.
+Z_SCORES = {
+    0.90: 1.6449,
+    0.95: 1.9600,
+    0.99: 2.5758,
+}
+
+
+def sample_size_for_interval(population, width, confidence=0.95, p=0.5):
+    """
+    How many of `population` to sample so the confidence interval for a
+    proportion is at most `width` wide (e.g. 0.1 for +/- 5 percentage
+    points). p=0.5 is the worst case, so the width holds whatever the true
+    proportion turns out to be.
+    """
+    if population == 0:
+        return 0
+
+    z = Z_SCORES[confidence]
+    margin = width / 2
+
+    n0 = z ** 2 * p * (1 - p) / margin ** 2
+    n = n0 / (1 + (n0 - 1) / population)  # finite population correction
+
+    return min(population, int(math.ceil(n)))
+
+
+def stratified_sample(items, size, stratum, rng=random):
+    """
+    Randomly pick `size` items, allocating picks to each stratum in
+    proportion to its share of `items`.
+    """
+    strata = OrderedDict()
+
+    for item in items:
+        strata.setdefault(stratum(item), []).append(item)
+
+    total = sum(len(members) for members in strata.values())
+
+    if size >= total:
+        return list(items)
+
+    quotas = OrderedDict(
+        (name, size * len(members) / total)
+        for name, members in strata.items()
+    )
+    allocation = OrderedDict(
+        (name, int(quota)) for name, quota in quotas.items()
+    )
+
+    # Hand out the remaining picks by largest remainder.
+    by_remainder = sorted(
+        quotas, key=lambda name: quotas[name] - allocation[name], reverse=True
+    )
+    for name in by_remainder[:size - sum(allocation.values())]:
+        allocation[name] += 1
+
+    sample = []
+
+    for name, members in strata.items():
+        sample.extend(rng.sample(members, allocation[name]))
+
+    return sample
+
+
+def wilson_interval(successes, n, confidence=0.95):
+    """
+    Return the (low, high) Wilson score interval for a proportion.
+    """
+    if n == 0:
+        return (0.0, 1.0)
+
+    z = Z_SCORES[confidence]
+    p = successes / n
+
+    centre = p + z ** 2 / (2 * n)
+    spread = z * math.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+    denominator = 1 + z ** 2 / n
+
+    return (
+        max(0.0, (centre - spread) / denominator),
+        min(1.0, (centre + spread) / denominator)
+    )
+
+
+def two_proportion_z_test(successes_a, n_a, successes_b, n_b):
+    """
+    Return (z, two-sided p-value) for the difference between two
+    proportions.
+    """
+    if n_a == 0 or n_b == 0:
+        return (0.0, 1.0)
+
+    pooled = (successes_a + successes_b) / (n_a + n_b)
+    standard_error = math.sqrt(pooled * (1 - pooled) * (1 / n_a + 1 / n_b))
+
+    if standard_error == 0:
+        return (0.0, 1.0)
+
+    z = (successes_a / n_a - successes_b / n_b) / standard_error
+    p_value = math.erfc(abs(z) / math.sqrt(2))
+
+    return (z, p_value)
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 """
-- load all the emails we've currently sent from emails_sent
 - work thru the rows in keys expiring CSV
+- skip keys the sent ledger says we've emailed before, on any day
+- queue one email per person, covering all their expiring keys, most
+  valuable first
+- just before each batch, drop keys renewed or revoked since the crawl
 - send emails to N people we haven't already emailed
 """
 
@@ -14,18 +17,26 @@ import io
 import logging
 import os
 import requests
+import time
 
+from collections import OrderedDict
 from os.path import dirname, join as pjoin
 
-import ratelimit
 from requests import HTTPError
 
 from .config import config
+from .exceptions import DailyCapReached
+from .make_keys_expiring_csv import EXPIRING_DAYS
+from .rate_limiter import PersistentTokenBucket
+from .sent_ledger import SentLedger
+from .send_queue import SendQueue, load_domain_renewal_rates
 from .requests_wrapper import RequestsWithSessionAndUserAgent
 from .utils import (
     make_today_data_dir, load_keys_from_csv, write_key_to_csv, setup_logging
 )
 from .gpg import sign_text
+from .key_lookup import CachedKeyLookup
+from .smtp_transport import SMTPConnectionPool, SMTPTransport
 
 
 EMAILS_TO_SEND = 500
@@ -35,16 +46,21 @@ EMAILS_TO_SEND = 500
 # Mailgun counts an email with multiple To: recipients as multiple emails, so
 # we need to limit further than 100 per hour.
 EMAILS_PER_HOUR = 95
-ONE_HOUR = 60 * 60
+
+# Re-check this many recipients' keys against the keyserver at a time, just
+# before emailing them.
+FRESHNESS_BATCH_SIZE = 10
 
 
 class ExpiryEmail():
     """
-    Render an expiry email for the given PGP key.
+    Render an expiry email for the given PGP key, or one email covering
+    several keys that share a recipient.
     """
 
-    def __init__(self, key):
+    def __init__(self, key, *more_keys):
         self.key = key
+        self.keys = [key] + list(more_keys)
         self.ok_to_send = False
 
         if not self._get_uid():
@@ -58,17 +74,34 @@ class ExpiryEmail():
             'zero_x_fingerprint': key.zero_x_fingerprint,
             'key_id': key.long_id,
             'friendly_expiry_date': key.friendly_expiry_date,
-            'days_until_expiry': key.days_until_expiry,
+            'days_until_expiry': min(k.days_until_expiry for k in self.keys),
+            'key_count': len(self.keys),
+            'key_list': '\n'.join(
+                load_template('email_key_summary.txt').format(
+                    fingerprint=k.fingerprint,
+                    zero_x_fingerprint=k.zero_x_fingerprint,
+                    key_id=k.long_id,
+                    friendly_expiry_date=k.friendly_expiry_date
+                ) for k in self.keys
+            ),
             'email_address': self.__uid.email,
             'unsubscribe_link': self.unsubscribe_link
         }
 
-        self.__unsigned_body = load_template('email_body.txt').format(**data)
+        if len(self.keys) == 1:
+            body_template = 'email_body.txt'
+            subject_template = 'email_subject.txt'
+        else:
+            body_template = 'email_body_multiple_keys.txt'
+            subject_template = 'email_subject_multiple_keys.txt'
+
+        self.__unsigned_body = load_template(body_template).format(**data)
         self.subject = load_template(
-            'email_subject.txt'
+            subject_template
         ).format(**data).rstrip()
 
         self.to = self.__uid.email_line
+        self.email_address = self.__uid.email
         self.from_line = config.from_line
         self.reply_to = config.reply_to
 
@@ -129,61 +162,214 @@ def main():
     keys_expiring_fn = pjoin(today_data_dir, 'keys_expiring.csv')
     emails_sent_fn = pjoin(today_data_dir, 'emails_sent.csv')
 
-    key_ids_already_emailed = load_key_ids_already_emailed(
-        emails_sent_fn
-    )
-    logging.info("Already sent {} emails".format(len(key_ids_already_emailed)))
+    rate_limiter = make_rate_limiter()
+    logging.info("Already sent {} emails".format(rate_limiter.sent_today()))
 
-    with setup_output_csvs(emails_sent_fn) as emails_sent_csv:
+    with setup_output_csvs(emails_sent_fn) as emails_sent_csv, \
+            contextlib.closing(SentLedger()) as ledger, \
+            contextlib.closing(make_transport()) as transport, \
+            contextlib.closing(CachedKeyLookup()) as key_lookup:
 
         send_emails_for_keys(
             load_keys_from_csv(keys_expiring_fn),
             emails_sent_csv,
-            key_ids_already_emailed
+            ledger,
+            transport,
+            rate_limiter,
+            key_lookup
         )
 
 
 @contextlib.contextmanager
 def setup_output_csvs(emails_sent_fn):
+    write_header = not os.path.exists(emails_sent_fn) or \
+        os.path.getsize(emails_sent_fn) == 0
+
+    if write_header:
+        header = config.csv_header
+    else:
+        # keep appending with the columns the file was started with
+        with io.open(emails_sent_fn, 'r') as f:
+            header = next(csv.reader(f), config.csv_header)
 
     with io.open(emails_sent_fn, 'a', 1) as f:
 
         emails_sent_csv = csv.DictWriter(
-            f, config.csv_header, quoting=csv.QUOTE_ALL
+            f, header, quoting=csv.QUOTE_ALL, extrasaction='ignore'
         )
 
+        if write_header:
+            emails_sent_csv.writeheader()
+
         yield emails_sent_csv
 
 
-def send_emails_for_keys(keys, emails_sent_csv, key_ids_already_emailed):
+def send_emails_for_keys(keys, emails_sent_csv, ledger, transport,
+                         rate_limiter, key_lookup):
 
-    for key in keys:
-        if len(key_ids_already_emailed) >= EMAILS_TO_SEND:
-            logging.info("Stopping now, sent {} emails".format(
-                len(key_ids_already_emailed)))
-            break
+    send_queue = SendQueue(ledger, load_domain_renewal_rates())
+
+    for email_address, recipient_keys in group_keys_by_recipient(keys).items():
+        recipient_keys = [
+            key for key in recipient_keys
+            if not already_emailed(key, ledger)
+        ]
+
+        if recipient_keys:
+            send_queue.push(email_address, recipient_keys)
+
+    logging.info("{} recipients queued".format(len(send_queue)))
+
+    batch = pop_batch(send_queue)
+
+    try:
+        while batch:
+            # Look up the next batch while this one is being rate limited.
+            next_batch = pop_batch(send_queue)
+            key_lookup.prefetch(fingerprints_in_batch(next_batch))
+
+            for recipient_keys in drop_stale_keys(batch, key_lookup):
+                send_to_recipient(recipient_keys, emails_sent_csv, ledger,
+                                  transport, rate_limiter)
+
+            batch = next_batch
+
+    except DailyCapReached as e:
+        logging.info("Stopping now: {}".format(e))
+
+
+def send_to_recipient(recipient_keys, emails_sent_csv, ledger, transport,
+                      rate_limiter):
+    """
+    Claim the keys in the ledger, then email about the ones we got. Keys
+    another sender has claimed in the meantime are left to them, and claims
+    are given up if the email couldn't be sent.
+    """
+    uid = recipient_keys[0].most_likely_uid()
+
+    claims = {}
 
-        if key.long_id in key_ids_already_emailed:
-            logging.info("Already emailed key: {}".format(key))
+    for key in recipient_keys:
+        claim = ledger.claim(key, uid.email if uid else '')
 
-        elif send_email(key):
+        if claim is not None:
+            claims[claim] = key
+
+    claimed_keys = list(claims.values())
+
+    if not claimed_keys:
+        logging.info("Already emailed {}".format(
+            ', '.join(map(str, recipient_keys))))
+        return
+
+    sent = False
+
+    try:
+        sent = send_email(ExpiryEmail(*claimed_keys), transport, rate_limiter)
+
+    finally:
+        if not sent:
+            for claim in claims:
+                ledger.release(claim)
+
+    if sent:
+        for key in claimed_keys:
             logging.info("Emailed {}".format(key))
             write_key_to_csv(key, emails_sent_csv)
-            key_ids_already_emailed.add(key.long_id)
 
-        else:
-            logging.warn("Failed emailing {}".format(key))
+    else:
+        logging.warn("Failed emailing {}".format(
+            ', '.join(map(str, claimed_keys))))
+
+
+def pop_batch(send_queue, size=FRESHNESS_BATCH_SIZE):
+    batch = []
+
+    while send_queue and len(batch) < size:
+        batch.append(send_queue.pop())
+
+    return batch
+
+
+def fingerprints_in_batch(batch):
+    return [key.fingerprint for _, keys in batch for key in keys]
+
+
+def drop_stale_keys(batch, key_lookup):
+    """
+    keys_expiring.csv comes from a crawl hours before the send window, and
+    the daemon may hold keys over for days. Drop any which are no longer
+    due a reminder, then fetch the rest again just before emailing and drop
+    any whose expiry has since changed, or which have been revoked.
+    """
+    batch = [
+        (email_address, [k for k in keys if is_in_reminder_window(k)])
+        for email_address, keys in batch
+    ]
+    current_keys = key_lookup.lookup_many(fingerprints_in_batch(batch))
+
+    for _, recipient_keys in batch:
+        fresh_keys = [
+            key for key in recipient_keys
+            if is_unchanged(key, current_keys[key.fingerprint])
+        ]
+
+        if fresh_keys:
+            yield fresh_keys
 
 
-def load_key_ids_already_emailed(emails_sent_csv):
-    if not os.path.exists(emails_sent_csv):
-        with io.open(emails_sent_csv, 'w') as f:
-            csv_writer = csv.DictWriter(
-                f, config.csv_header, quoting=csv.QUOTE_ALL)
-            csv_writer.writeheader()
-        return set([])
+def is_in_reminder_window(key):
+    days = key.days_until_expiry
 
-    return set([key.long_id for key in load_keys_from_csv(emails_sent_csv)])
+    if days is None or not 0 < days <= EXPIRING_DAYS:
+        logging.info("Key isn't expiring in the next {} days: {}".format(
+            EXPIRING_DAYS, key))
+        return False
+
+    return True
+
+
+def is_unchanged(key, current_key):
+    if current_key is None:
+        return True  # couldn't check, assume nothing's changed
+
+    if current_key.is_revoked:
+        logging.info("Key has been revoked: {}".format(key))
+        return False
+
+    if current_key.expiry_date != key.expiry_date:
+        logging.info("Expiry has changed from {} to {}: {}".format(
+            key.expiry_date, current_key.expiry_date, key))
+        return False
+
+    return True
+
+
+def already_emailed(key, ledger):
+    if ledger.has_emailed_key(key):
+        logging.info("Already emailed key: {}".format(key))
+        return True
+
+    return False
+
+
+def group_keys_by_recipient(keys):
+    """
+    Return an OrderedDict of email address -> [PGPKey, ...] so that someone
+    with several keys expiring together gets a single email.
+    """
+    groups = OrderedDict()
+
+    for key in keys:
+        uid = key.most_likely_uid()
+
+        if uid is None:
+            logging.warn("No email address for {}".format(key))
+            continue
+
+        groups.setdefault(uid.email.lower(), []).append(key)
+
+    return groups
 
 
 def load_template(name):
@@ -191,20 +377,74 @@ def load_template(name):
         return f.read()
 
 
-def send_email(key):
-    email = ExpiryEmail(key)
+def send_email(email, transport, rate_limiter):
     if not email.ok_to_send:
         return False
 
     logging.info("About to send email for {} to `{}`\nSubject: {}".format(
-        key, email.to, email.subject)
+        email.key, email.to, email.subject)
     )
     logging.debug(email.body)
 
-    return send_with_mailgun(email)
+    rate_limiter.acquire()
+
+    start_time = time.monotonic()
+    sent = False
+
+    try:
+        sent = transport.send(email)
+    finally:
+        if not sent:
+            rate_limiter.refund()  # only emails sent count towards the cap
+
+    logging.info("Transport took {:.0f}ms for {}".format(
+        (time.monotonic() - start_time) * 1000, email.key))
+
+    return sent
+
+
+def make_rate_limiter():
+    return PersistentTokenBucket(
+        pjoin(config.data_dir, 'send_rate_limit.json'),
+        per_hour=EMAILS_PER_HOUR,
+        daily_cap=EMAILS_TO_SEND
+    )
+
+
+def make_transport():
+    if config.email_transport == 'smtp':
+        return SMTPTransport(SMTPConnectionPool(
+            config.smtp_host,
+            config.smtp_port,
+            username=config.smtp_username,
+            password=config.smtp_password,
+            starttls=config.smtp_starttls,
+            size=config.smtp_pool_size
+        ))
+
+    elif config.email_transport == 'mailgun':
+        return MailgunTransport()
+
+    else:
+        raise ValueError('Unknown email_transport: `{}`'.format(
+            config.email_transport))
+
+
+class MailgunTransport():
+    """
+    Send emails through the Mailgun HTTP API.
+    """
+
+    def __init__(self, http=None):
+        self.http = http or RequestsWithSessionAndUserAgent()
+
+    def send(self, email):
+        return send_with_mailgun(email, http=self.http)
+
+    def close(self):
+        pass
 
 
-@ratelimit.rate_limited(EMAILS_PER_HOUR, ONE_HOUR)
 def send_with_mailgun(email, http=None):
 
     http = http or RequestsWithSessionAndUserAgent()
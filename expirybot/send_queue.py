@@ -0,0 +1,105 @@
+import heapq
+import io
+import itertools
+import json
+import logging
+
+from os.path import join as pjoin
+
+from .config import config
+from .exclusions import RSA, DSA
+
+LOG = logging.getLogger(__name__)
+
+# Recipients we've emailed before (about other keys) are less likely to act
+# on another email than someone hearing from us for the first time.
+PREVIOUSLY_EMAILED_WEIGHT = 0.5
+
+FULL_STRENGTH_BITS = 4096
+
+
+class SendQueue():
+    """
+    A heap of (recipient, keys) groups ordered by how much an email is
+    expected to be worth, so when there are more candidates than the daily
+    budget the most valuable emails go first.
+
+    Groups can be pushed at any time, including while the queue is being
+    drained during the send window.
+    """
+
+    def __init__(self, ledger=None, domain_renewal_rates=None):
+        self.ledger = ledger
+        self.domain_renewal_rates = domain_renewal_rates or {}
+
+        self._default_renewal_rate = self._mean_renewal_rate()
+        self._heap = []
+        self._counter = itertools.count()  # FIFO among equal scores
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, email_address, keys):
+        score = self.score(email_address, keys)
+
+        heapq.heappush(
+            self._heap,
+            (-score, next(self._counter), email_address, keys)
+        )
+
+    def pop(self):
+        _, _, email_address, keys = heapq.heappop(self._heap)
+        return email_address, keys
+
+    def score(self, email_address, keys):
+        _, domain = email_address.rsplit('@', 1)
+
+        value = sum(urgency(key) * strength(key) for key in keys)
+        value *= self.domain_renewal_rates.get(
+            domain.lower(), self._default_renewal_rate
+        )
+
+        if self.ledger is not None and \
+                self.ledger.has_emailed_address(email_address):
+            value *= PREVIOUSLY_EMAILED_WEIGHT
+
+        return value
+
+    def _mean_renewal_rate(self):
+        if self.domain_renewal_rates:
+            rates = self.domain_renewal_rates.values()
+            return sum(rates) / len(rates)
+        else:
+            return 1.0
+
+
+def urgency(key):
+    days = key.days_until_expiry
+
+    if days is None:
+        return 0.0
+
+    return 1 / (1 + max(0, days))
+
+
+def strength(key):
+    if key.algorithm_number in (RSA, DSA) and key.size_bits:
+        return min(1.0, key.size_bits / FULL_STRENGTH_BITS)
+    else:
+        return 1.0
+
+
+def load_domain_renewal_rates(filename=None):
+    """
+    Load a JSON object of {domain: renewal rate (0-1)}, or return an empty
+    dict if there isn't one yet.
+    """
+    filename = filename or pjoin(config.data_dir, 'domain_renewal_rates.json')
+
+    try:
+        with io.open(filename) as f:
+            return json.load(f)
+
+    except EnvironmentError:
+        LOG.info('No domain renewal rates at {}'.format(filename))
+        return {}
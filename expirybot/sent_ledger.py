@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""
+- keep one record of every expiry email ever sent
+- answer "have we emailed this key about this expiry date / this address
+  before?" from an on-disk index
+
+Run as a script to import historic ${DATA}/YYYY-MM-DD/emails_sent.csv files.
+"""
+
+import datetime
+import glob
+import logging
+import os
+import sqlite3
+
+from os.path import basename, dirname, join as pjoin
+
+from .config import config
+from .utils import load_keys_from_csv
+
+LOG = logging.getLogger(__name__)
+
+# Rows from before expiry dates were recorded only count as a recent send.
+LEGACY_LOOKBACK_DAYS = 30
+
+
+class SentLedger():
+    """
+    A key is emailed once per expiry date, so a key that's renewed and comes
+    up for expiry again next year gets another email.
+
+    Senders claim a key before emailing it: the unique index on (long_id,
+    expiry_date) makes the claim a single atomic insert, so of several
+    senders sharing the file only one wins. The indexes mean lookups don't
+    depend on how many years of history the ledger holds.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or pjoin(config.data_dir, 'sent_ledger.db')
+
+        self._conn = sqlite3.connect(
+            self.filename, timeout=60, isolation_level=None
+        )
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._create_tables()
+
+    def has_emailed_key(self, key, now=None):
+        """
+        True if we've emailed about this key's current expiry date.
+        """
+        now = now or datetime.datetime.now()
+        legacy_since = now - datetime.timedelta(days=LEGACY_LOOKBACK_DAYS)
+
+        cursor = self._conn.execute(
+            'SELECT 1 FROM sent WHERE long_id = ? AND ('
+            "  expiry_date = ? OR (expiry_date = '' AND sent_at >= ?)"
+            ') LIMIT 1',
+            (key.long_id, _expiry(key), legacy_since.isoformat())
+        )
+        return cursor.fetchone() is not None
+
+    def has_emailed_address(self, email):
+        cursor = self._conn.execute(
+            'SELECT 1 FROM sent WHERE email = ? LIMIT 1', (email.lower(),)
+        )
+        return cursor.fetchone() is not None
+
+    def claim(self, key, email, sent_at=None):
+        """
+        Record that we're about to email this key about its expiry date, and
+        return the claim for release(). Return None, recording nothing, if
+        it's already been emailed.
+        """
+        sent_at = sent_at or datetime.datetime.now()
+
+        self._conn.execute('BEGIN IMMEDIATE')
+
+        try:
+            claim = None
+
+            if not self.has_emailed_key(key, now=sent_at):
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO sent '
+                    '(long_id, fingerprint, email, sent_at, expiry_date) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (
+                        key.long_id,
+                        key.fingerprint.hex_format,
+                        email.lower() if email else '',
+                        sent_at.isoformat(),
+                        _expiry(key)
+                    )
+                )
+
+                if cursor.rowcount == 1:
+                    claim = cursor.lastrowid
+
+            self._conn.execute('COMMIT')
+
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+
+        return claim
+
+    def release(self, claim):
+        """
+        Give up a claim when the email couldn't be sent, so it's retried.
+        Only the claim's own row goes: a key without an expiry date may
+        have older rows too.
+        """
+        self._conn.execute('DELETE FROM sent WHERE rowid = ?', (claim,))
+
+    def close(self):
+        self._conn.close()
+
+    def _create_tables(self):
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS sent ('
+            '  long_id TEXT NOT NULL,'
+            '  fingerprint TEXT NOT NULL,'
+            '  email TEXT NOT NULL,'
+            '  sent_at TEXT NOT NULL,'
+            "  expiry_date TEXT NOT NULL DEFAULT ''"
+            ')'
+        )
+
+        columns = [row[1] for row in self._conn.execute(
+            'PRAGMA table_info(sent)')]
+
+        if 'expiry_date' not in columns:  # ledger from before expiry dates
+            self._conn.execute(
+                "ALTER TABLE sent ADD COLUMN expiry_date TEXT NOT NULL "
+                "DEFAULT ''"
+            )
+
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS sent_long_id ON sent (long_id)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS sent_email ON sent (email)'
+        )
+        self._conn.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS sent_expiry '
+            "ON sent (long_id, expiry_date) WHERE expiry_date != ''"
+        )
+
+
+def _expiry(key):
+    return key.expiry_date.isoformat() if key.expiry_date else ''
+
+
+def import_emails_sent_csv(ledger, emails_sent_csv):
+    """
+    Backfill the ledger from one day's emails_sent.csv. That file doesn't
+    record the address used, so take the one we'd pick today.
+    """
+    sent_at = datetime.datetime.strptime(
+        basename(dirname(emails_sent_csv)), '%Y-%m-%d'
+    )
+
+    count = 0
+
+    for key in load_keys_from_csv(emails_sent_csv):
+        uid = key.most_likely_uid()
+
+        if ledger.claim(key, uid.email if uid else '', sent_at=sent_at):
+            count += 1
+
+    return count
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    ledger = SentLedger()
+
+    for emails_sent_csv in sorted(glob.glob(
+            pjoin(config.data_dir, '*', 'emails_sent.csv'))):
+
+        if os.path.islink(dirname(emails_sent_csv)):
+            continue  # e.g. data/latest
+
+        count = import_emails_sent_csv(ledger, emails_sent_csv)
+        LOG.info('Imported {} keys from {}'.format(count, emails_sent_csv))
+
+    ledger.close()
+
+
+if __name__ == '__main__':
+    main()
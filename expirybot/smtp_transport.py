@@ -0,0 +1,182 @@
+import contextlib
+import logging
+import queue
+import smtplib
+import threading
+import time
+
+from email.mime.text import MIMEText
+
+LOG = logging.getLogger(__name__)
+
+
+class SMTPConnectionPool():
+    """
+    Keep up to `size` authenticated SMTP connections open and hand them out
+    one at a time, so a run doesn't pay for connect / STARTTLS / AUTH on every
+    message.
+    """
+
+    # Connections idle for longer than this get a NOOP before being reused,
+    # in case the server has quietly dropped them.
+    CHECK_AFTER_IDLE_SECONDS = 30
+
+    def __init__(self, host, port, username=None, password=None,
+                 starttls=False, size=2, timeout=30, smtp_class=None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.smtp_class = smtp_class or smtplib.SMTP
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._all = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        with self._slots:
+            conn = self._get_idle_connection() or self._connect()
+
+            try:
+                yield conn
+
+            except BaseException:  # it may be mid-command, so don't reuse it
+                self._discard(conn)
+                raise
+
+            else:
+                self._idle.put((conn, time.monotonic()))
+
+    def close(self):
+        with self._lock:
+            connections, self._all = self._all, []
+
+        for conn in connections:
+            try:
+                conn.quit()
+            except smtplib.SMTPException:
+                pass
+
+    def _get_idle_connection(self):
+        while True:
+            try:
+                conn, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+
+            idle_seconds = time.monotonic() - last_used
+
+            if idle_seconds < self.CHECK_AFTER_IDLE_SECONDS or \
+                    self._is_alive(conn):
+                return conn
+
+            LOG.info('Dropping stale SMTP connection to {}:{}'.format(
+                self.host, self.port))
+            self._discard(conn)
+
+    def _connect(self):
+        LOG.info('Opening SMTP connection to {}:{}'.format(
+            self.host, self.port))
+
+        conn = self.smtp_class(self.host, self.port, timeout=self.timeout)
+
+        if self.starttls:
+            conn.starttls()
+
+        if self.username:
+            conn.login(self.username, self.password)
+
+        with self._lock:
+            self._all.append(conn)
+
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+
+        try:
+            conn.close()
+        except smtplib.SMTPException:
+            pass
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            code, _ = conn.noop()
+        except smtplib.SMTPException:
+            return False
+
+        return code == 250
+
+
+class SMTPTransport():
+    """
+    Send emails through an SMTP relay, reusing pooled connections for the
+    whole run. Like send_with_mailgun, a message the server permanently
+    refuses (5xx) returns False; anything else is raised.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def send(self, email):
+        message = make_mime_message(email)
+
+        try:
+            return self._send_message(message)
+
+        except smtplib.SMTPServerDisconnected:
+            LOG.warn('SMTP connection went away, retrying on a new one')
+            return self._send_message(message)
+
+    def close(self):
+        self.pool.close()
+
+    def _send_message(self, message):
+        with self.pool.connection() as conn:
+            try:
+                refused = conn.send_message(message)
+
+            except smtplib.SMTPRecipientsRefused as e:
+                LOG.error('All recipients refused: {}'.format(e.recipients))
+                return False
+
+            except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                if not is_permanent_error(e):
+                    raise
+
+                # smtplib has sent RSET, so the connection can be reused
+                LOG.error('Message refused: {} {}'.format(
+                    e.smtp_code, e.smtp_error))
+                return False
+
+        if refused:
+            LOG.warn('Some recipients refused: {}'.format(refused))
+
+        return True
+
+
+def is_permanent_error(e):
+    return 500 <= e.smtp_code < 600
+
+
+def make_mime_message(email):
+    message = MIMEText(email.body, 'plain', 'utf-8')
+
+    message['From'] = email.from_line
+    message['To'] = email.to
+    message['Subject'] = email.subject
+
+    if email.reply_to:
+        message['Reply-To'] = email.reply_to
+
+    if email.list_unsubscribe_header:
+        message['List-Unsubscribe'] = email.list_unsubscribe_header
+
+    return message
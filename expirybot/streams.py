@@ -0,0 +1,94 @@
+import gzip
+import io
+import os
+import stat
+import sys
+
+
+class ByteCountingReader(io.RawIOBase):
+    """
+    Wrap a binary file, counting the (possibly compressed) bytes read from
+    it so progress can be estimated without reading the file twice.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self._raw.readinto(buffer)
+        self.bytes_read += count or 0
+        return count
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+class InputStream():
+    """
+    A text stream of lines from a file, a FIFO or stdin ('-'), transparently
+    decompressing .gz and .zst files.
+
+    `total_bytes` is None when the size can't be known up front (pipes).
+    """
+
+    def __init__(self, filename):
+        if filename == '-':
+            raw = sys.stdin.buffer
+        else:
+            raw = io.open(filename, 'rb', buffering=0)
+
+        self.total_bytes = _regular_file_size(raw)
+        self._counter = ByteCountingReader(raw)
+        self._text = io.TextIOWrapper(
+            _decompress(filename, self._counter), encoding='utf-8'
+        )
+
+    @property
+    def bytes_read(self):
+        return self._counter.bytes_read
+
+    @property
+    def fraction_read(self):
+        if not self.total_bytes:
+            return None
+
+        return min(1.0, self.bytes_read / self.total_bytes)
+
+    def __iter__(self):
+        return iter(self._text)
+
+    def close(self):
+        self._text.close()
+
+
+def _decompress(filename, counter):
+    if filename.endswith('.gz'):
+        return gzip.GzipFile(fileobj=counter, mode='rb')
+
+    elif filename.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(
+                'Reading {} needs the `zstandard` package'.format(filename))
+
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(counter)
+        )
+
+    else:
+        return io.BufferedReader(counter)
+
+
+def _regular_file_size(raw):
+    try:
+        info = os.fstat(raw.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+    return info.st_size if stat.S_ISREG(info.st_mode) else None
@@ -0,0 +1,100 @@
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal, assert_true, assert_false
+import unittest
+
+from .crawl_index import CrawlIndex, ShortIdQueue, normalize_short_id
+from .pgp_key import PGPKey
+
+PAUL = PGPKey(fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517')
+OTHER = PGPKey(fingerprint='5DD5B8F28CBEFA024F9F472B638C78A5E281ACDB')
+
+PAUL_SUBKEY_SHORT_ID = '0x8E532C34'
+
+
+class TestCrawlIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = pjoin(self.temp_dir, 'crawl_index.db')
+        self.index = CrawlIndex(self.filename)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_first_sighting(self):
+        assert_true(self.index.first_sighting(PAUL))
+        assert_false(self.index.first_sighting(PAUL))
+        assert_true(self.index.first_sighting(OTHER))
+
+        assert_equal(1, self.index.duplicates)
+
+    def test_primary_short_id_is_not_subkey_only(self):
+        self.index.record_short_id('0xAD1B5517', [PAUL])
+
+        assert_false(self.index.is_subkey_only('0xAD1B5517'))
+
+    def test_subkey_short_id_is_remembered(self):
+        self.index.record_short_id(PAUL_SUBKEY_SHORT_ID, [PAUL])
+        self.index.close()
+
+        self.index = CrawlIndex(self.filename)
+
+        assert_true(self.index.is_subkey_only(PAUL_SUBKEY_SHORT_ID))
+
+    def test_commits_as_it_goes(self):
+        self.index.COMMIT_EVERY = 2
+        self.index.record_short_id(PAUL_SUBKEY_SHORT_ID, [PAUL])
+        self.index.record_short_id('0xE281ACDB', [OTHER])
+
+        other = CrawlIndex(self.filename)  # as if we'd crashed
+        assert_true(other.is_subkey_only(PAUL_SUBKEY_SHORT_ID))
+        other.close()
+
+    def test_can_skip_once_primary_fetched(self):
+        self.index.record_short_id(PAUL_SUBKEY_SHORT_ID, [PAUL])
+
+        assert_false(self.index.can_skip(PAUL_SUBKEY_SHORT_ID))
+
+        self.index.first_sighting(PAUL)
+
+        assert_true(self.index.can_skip(PAUL_SUBKEY_SHORT_ID))
+        assert_equal(1, self.index.skipped_short_ids)
+
+    def test_short_id_which_now_matches_a_primary_is_forgotten(self):
+        self.index.record_short_id(PAUL_SUBKEY_SHORT_ID, [PAUL])
+        self.index.record_short_id(PAUL_SUBKEY_SHORT_ID, [PAUL, OTHER])
+        assert_true(self.index.is_subkey_only(PAUL_SUBKEY_SHORT_ID))
+
+        self.index.record_short_id('0xE281ACDB', [OTHER])
+        self.index.record_short_id(PAUL_SUBKEY_SHORT_ID, [])
+        assert_false(self.index.is_subkey_only(PAUL_SUBKEY_SHORT_ID))
+
+
+def test_short_id_queue():
+    queue = ShortIdQueue()
+    queue.append('0x8e532c34')
+    queue.append('AD1B5517')
+
+    assert_equal(2, len(queue))
+    assert_equal(['0x8E532C34', '0xAD1B5517'], list(queue))
+
+
+def test_short_id_queue_keeps_key_counts():
+    queue = ShortIdQueue()
+    queue.append('0x8e532c34', '0x8e532c34 2')
+    queue.append('0xad1b5517', '0xad1b5517')
+
+    assert_equal(
+        [('0x8E532C34', '0x8E532C34 2'), ('0xAD1B5517', None)],
+        list(queue.items())
+    )
+
+
+def test_normalize_short_id():
+    assert_equal('309F635D', normalize_short_id('0x309f635d\n'))
+    assert_equal('AD1B5517', normalize_short_id('309F635DAD1B5517'))
@@ -0,0 +1,333 @@
+import datetime
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+from os.path import join as pjoin
+from unittest.mock import patch
+
+from nose.tools import assert_equal, assert_raises, assert_true, assert_false
+import unittest
+
+from .config import config
+from .daemon import (
+    DaemonState, PipelineDaemon, ShuttingDown, in_send_window,
+    next_crawl_time
+)
+from .exceptions import DailyCapReached
+from .pgp_key import PGPKey
+
+
+class TestDaemonState(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = pjoin(self.temp_dir, 'daemon_state.db')
+        self.state = DaemonState(self.filename)
+
+        self.key = PGPKey(
+            fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517',
+            algorithm_number='1',
+            size_bits='4096',
+            uids='Paul <paul@example.com>',
+            expiry_date='2018-01-04'
+        )
+
+    def tearDown(self):
+        self.state.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_pending_keys_survive_restart(self):
+        self.state.add(self.key)
+        self.state.close()
+
+        self.state = DaemonState(self.filename)
+        keys = list(self.state.pending_keys())
+
+        assert_equal(1, len(keys))
+        assert_equal(self.key.fingerprint, keys[0].fingerprint)
+        assert_equal(datetime.date(2018, 1, 4), keys[0].expiry_date)
+        assert_equal(['paul@example.com'], keys[0].emails)
+        assert_equal(4096, keys[0].size_bits)
+
+    def test_key_without_created_date(self):
+        key = PGPKey(fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517')
+        self.state.add(key)
+
+        assert_false(list(self.state.pending_keys())[0].created_date)
+
+    def test_remove(self):
+        self.state.add(self.key)
+        self.state.add(self.key)
+        assert_equal(1, len(self.state))
+
+        self.state.remove([self.key])
+        assert_equal(0, len(self.state))
+
+
+class TestPipelineDaemonQueues(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = PipelineDaemon(short_ids_file='short_ids.txt',
+                                     queue_size=1)
+
+    def test_put_and_get(self):
+        q = queue.Queue(1)
+        self.daemon._put(q, 'item')
+
+        assert_equal('item', self.daemon._get(q))
+
+    def test_full_queue_gives_way_to_shutdown(self):
+        q = queue.Queue(1)
+        self.daemon._put(q, 'item')
+        self.daemon.stop()
+
+        assert_raises(ShuttingDown, self.daemon._put, q, 'another')
+
+    def test_empty_queue_gives_way_to_shutdown(self):
+        self.daemon.stop()
+
+        assert_raises(ShuttingDown, self.daemon._get, queue.Queue(1))
+
+
+def test_next_crawl_time():
+    assert_equal(
+        datetime.datetime(2018, 1, 1, 0, 30),
+        next_crawl_time(datetime.datetime(2018, 1, 1, 0, 0))
+    )
+    assert_equal(
+        datetime.datetime(2018, 1, 2, 0, 30),
+        next_crawl_time(datetime.datetime(2018, 1, 1, 0, 30))
+    )
+
+
+def test_in_send_window():
+    assert_false(in_send_window(datetime.datetime(2018, 1, 1, 8, 59)))
+    assert_true(in_send_window(datetime.datetime(2018, 1, 1, 9, 0)))
+    assert_true(in_send_window(datetime.datetime(2018, 1, 1, 14, 59)))
+    assert_false(in_send_window(datetime.datetime(2018, 1, 1, 15, 0)))
+
+
+def make_key(name, expires_in, size_bits=4096):
+    return PGPKey(
+        fingerprint='{:040X}'.format(abs(hash(name))),
+        algorithm_number='1',
+        size_bits=str(size_bits),
+        uids='{0} <{0}@example.com>'.format(name),
+        expiry_date=datetime.date.today() + datetime.timedelta(
+            days=expires_in)
+    )
+
+
+class FakeClock():
+    def __init__(self, hour):
+        self.now = datetime.datetime.combine(
+            datetime.date.today(), datetime.time(hour))
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCrawl():
+    def __init__(self, keys):
+        self.keys = keys
+        self.finished = threading.Event()
+
+    def __call__(self, short_ids_file, keydump, workers, on_key):
+        for key in self.keys:
+            on_key(key)
+
+        self.finished.set()
+
+
+class FakeTransport():
+    def __init__(self):
+        self.sent = []
+
+    def send(self, email):
+        self.sent.append(email.email_address)
+        return True
+
+    def close(self):
+        pass
+
+
+class FakeRateLimiter():
+    def __init__(self, daily_cap=None):
+        self.daily_cap = daily_cap
+        self.sent = 0
+        self.refused = threading.Event()
+
+    def acquire(self):
+        if self.daily_cap is not None and self.sent >= self.daily_cap:
+            self.refused.set()
+            raise DailyCapReached('sent {} today'.format(self.sent))
+
+        self.sent += 1
+
+    def refund(self):
+        self.sent -= 1
+
+
+class FakeKeyLookup():
+    def lookup_many(self, fingerprints):
+        return {fingerprint: None for fingerprint in fingerprints}
+
+    def close(self):
+        pass
+
+
+def wait_for(condition, seconds=10):
+    deadline = time.monotonic() + seconds
+
+    while not condition():
+        assert_true(time.monotonic() < deadline, 'Timed out')
+        time.sleep(0.01)
+
+
+class TestPipelineDaemonStages(unittest.TestCase):
+    """
+    Run the whole daemon against a fake crawl, transport and clock.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.transport = FakeTransport()
+        self.rate_limiter = FakeRateLimiter()
+        self.crawl = FakeCrawl([])
+
+        self.patches = [
+            patch.object(type(config), 'data_dir', self.temp_dir),
+            patch.object(config, 'check_recipient_dns', False),
+            patch('expirybot.daemon.run_crawl', self.crawl),
+            patch('expirybot.daemon.make_transport', lambda: self.transport),
+            patch('expirybot.daemon.make_rate_limiter',
+                  lambda: self.rate_limiter),
+            patch('expirybot.daemon.CachedKeyLookup', FakeKeyLookup),
+            patch('expirybot.send_emails.make_unsubscribe_link',
+                  lambda email: 'https://example.com/unsubscribe'),
+            patch('expirybot.send_emails.sign_text', lambda text: text),
+        ]
+
+        for p in self.patches:
+            p.start()
+
+        self.daemon = None
+
+    def tearDown(self):
+        if self.daemon is not None:
+            self.daemon.stop()
+            self.thread.join(10)
+
+        for p in self.patches:
+            p.stop()
+
+        shutil.rmtree(self.temp_dir)
+
+    def _start(self, clock, crawl_now=False, queue_size=1000):
+        self.daemon = PipelineDaemon(
+            short_ids_file='short_ids.txt', queue_size=queue_size,
+            crawl_now=crawl_now, clock=clock
+        )
+        self.daemon.POLL_SECONDS = 0.01
+        self.daemon.PREPARE_INTERVAL_SECONDS = 0.05
+
+        self.thread = threading.Thread(target=self.daemon.run)
+        self.thread.start()
+
+    def _add_pending(self, keys):
+        state = DaemonState()
+
+        for key in keys:
+            state.add(key)
+
+        state.close()
+
+    def _pending_count(self):
+        state = DaemonState()
+
+        try:
+            return len(state)
+        finally:
+            state.close()
+
+    def test_crawled_keys_are_filtered_and_emailed(self):
+        self.crawl.keys = [
+            make_key('alice', 3),
+            make_key('weak', 3, size_bits=1024),
+            make_key('later', 30),
+        ]
+        self._start(FakeClock(10), crawl_now=True)
+
+        wait_for(lambda: self.transport.sent)
+        wait_for(lambda: self._pending_count() == 0)
+
+        assert_equal(['alice@example.com'], self.transport.sent)
+
+        data_dir = pjoin(self.temp_dir, datetime.date.today().isoformat())
+        wait_for(lambda: os.path.exists(pjoin(data_dir, 'keys_excluded.csv')))
+
+        with io.open(pjoin(data_dir, 'emails_sent.csv')) as f:
+            assert_true('alice@example.com' in f.read())
+
+    def test_crawl_is_not_held_up_by_the_sender(self):
+        self.crawl.keys = [make_key('key{}'.format(i), 3) for i in range(20)]
+        self._start(FakeClock(20), crawl_now=True, queue_size=1)
+
+        assert_true(self.crawl.finished.wait(10))
+        wait_for(lambda: self._pending_count() == 20)
+
+        assert_equal([], self.transport.sent)
+
+    def test_resumes_pending_keys_after_restart(self):
+        self._add_pending([make_key('carol', 2)])
+        self._start(FakeClock(10))
+
+        wait_for(lambda: self.transport.sent)
+        assert_equal(['carol@example.com'], self.transport.sent)
+
+    def test_waits_for_the_send_window(self):
+        clock = FakeClock(8)
+        self._add_pending([make_key('dave', 3)])
+        self._start(clock)
+
+        time.sleep(0.2)
+        assert_equal([], self.transport.sent)
+
+        clock.now = clock.now.replace(hour=9)
+        wait_for(lambda: self.transport.sent)
+
+    def test_daily_cap_waits_for_tomorrow(self):
+        clock = FakeClock(10)
+        self.rate_limiter.daily_cap = 1
+        self._add_pending([make_key('erin', 3), make_key('frank', 3)])
+        self._start(clock)
+
+        assert_true(self.rate_limiter.refused.wait(10))
+        time.sleep(0.1)
+        assert_equal(1, len(self.transport.sent))
+
+        self.rate_limiter.sent = 0
+        clock.now += datetime.timedelta(days=1)
+
+        wait_for(lambda: len(self.transport.sent) == 2)
+        assert_equal(['erin@example.com', 'frank@example.com'],
+                     sorted(self.transport.sent))
+
+    def test_most_urgent_first_and_only_while_due(self):
+        self._add_pending([
+            make_key('backlog', 3),
+            make_key('urgent', 1),
+            make_key('expired', -1),
+            make_key('not-yet', 10),
+        ])
+        self._start(FakeClock(10))
+
+        wait_for(lambda: self._pending_count() == 0)
+
+        assert_equal(['urgent@example.com', 'backlog@example.com'],
+                     self.transport.sent)
@@ -0,0 +1,170 @@
+import shutil
+import socket
+import tempfile
+import threading
+
+from os.path import join as pjoin
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+from nose.tools import assert_equal
+import unittest
+
+from .dns_check import (
+    DnsPythonResolver, DomainValidator, Resolution, LIVE, DEAD, UNKNOWN,
+    DEAD_SECONDS
+)
+
+DAY = 24 * 60 * 60
+
+# name -> {record type: rdata}; names not listed don't exist
+STUB_ZONE = {
+    'mx.example.': {'MX': '10 mail.mx.example.'},
+    'a-only.example.': {'A': '192.0.2.1'},
+    'no-address.example.': {'TXT': '"nothing to see"'},
+    'null-mx.example.': {'MX': '0 .'},
+}
+SERVFAIL_NAMES = ('broken.example.',)
+
+
+class StubDnsServer():
+    """
+    Answer queries from STUB_ZONE over UDP on localhost.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            question = query.question[0]
+            name = question.name.to_text().lower()
+            rdtype = dns.rdatatype.to_text(question.rdtype)
+
+            if name in SERVFAIL_NAMES:
+                response.set_rcode(dns.rcode.SERVFAIL)
+
+            elif name not in STUB_ZONE:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+
+            elif rdtype in STUB_ZONE[name]:
+                response.answer.append(dns.rrset.from_text(
+                    name, 300, 'IN', rdtype, STUB_ZONE[name][rdtype]
+                ))
+
+            self.sock.sendto(response.to_wire(), address)
+
+
+class TestDnsPythonResolver(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubDnsServer()
+        cls.resolver = DnsPythonResolver(
+            nameservers=['127.0.0.1'], port=cls.server.port, timeout=2
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def test_resolve(self):
+        for domain, expected in [
+            ('mx.example', Resolution(LIVE, 300)),
+            ('a-only.example', Resolution(LIVE, 300)),
+            ('no-address.example', Resolution(DEAD, None)),
+            ('null-mx.example', Resolution(DEAD, 300)),
+            ('nonexistent.example', Resolution(DEAD, None)),
+            ('broken.example', Resolution(UNKNOWN, None)),
+        ]:
+            assert_equal(expected, self.resolver.resolve(domain), domain)
+
+
+class FakeResolver():
+    def __init__(self, answers):
+        self.answers = answers
+        self.queries = []
+
+    def resolve(self, domain):
+        self.queries.append(domain)
+        return self.answers[domain]
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDomainValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.resolver = FakeResolver({
+            'live.example': Resolution(LIVE, 3 * DAY),
+            'dead.example': Resolution(DEAD, None),
+            'broken.example': Resolution(UNKNOWN, None),
+        })
+        self.validator = DomainValidator(
+            resolver=self.resolver,
+            cache_filename=pjoin(self.temp_dir, 'dns_cache.db'),
+            clock=self.clock
+        )
+
+    def tearDown(self):
+        self.validator.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_validate_many(self):
+        assert_equal(
+            {'live.example': LIVE, 'dead.example': DEAD,
+             'broken.example': UNKNOWN},
+            dict(self.validator.validate_many(
+                ['Live.example', 'dead.example', 'broken.example',
+                 'live.example']))
+        )
+        assert_equal(3, len(self.resolver.queries))
+
+    def test_answers_are_cached_but_failures_are_not(self):
+        domains = ['live.example', 'dead.example', 'broken.example']
+
+        self.validator.validate_many(domains)
+        self.validator.validate_many(domains)
+
+        assert_equal(
+            ['broken.example', 'broken.example', 'dead.example',
+             'live.example'],
+            sorted(self.resolver.queries)
+        )
+
+    def test_cache_expires(self):
+        self.validator.validate_many(['live.example', 'dead.example'])
+
+        self.clock.now += DEAD_SECONDS + 1
+        self.validator.validate_many(['live.example', 'dead.example'])
+        assert_equal(3, len(self.resolver.queries))  # only dead re-checked
+
+        self.clock.now += 2 * DAY  # live answers are kept for their TTL
+        self.validator.validate_many(['live.example'])
+        assert_equal(4, len(self.resolver.queries))
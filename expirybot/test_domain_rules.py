@@ -0,0 +1,59 @@
+from nose.tools import assert_equal, assert_true, assert_false
+
+from .domain_rules import DomainRules
+from .exclusions import is_blacklisted, blacklist_reason
+from .config import config
+
+RULES = DomainRules([
+    'example.com',
+    '*.wildcard.org',
+    '.both.net',
+    're:^mail\\d+\\.',
+])
+
+
+def test_match():
+    for domain, expected in [
+        ('example.com', 'example.com'),
+        ('EXAMPLE.com.', 'example.com'),
+        ('sub.example.com', None),
+
+        ('wildcard.org', None),
+        ('a.wildcard.org', '*.wildcard.org'),
+        ('a.b.wildcard.org', '*.wildcard.org'),
+        ('notwildcard.org', None),
+
+        ('both.net', '.both.net'),
+        ('deep.sub.both.net', '.both.net'),
+
+        ('mail42.something.com', 're:^mail\\d+\\.'),
+        ('gmail42.something.com', None),
+
+        ('unrelated.com', None),
+    ]:
+        yield assert_equal, expected, RULES.match(domain)
+
+
+def test_match_many():
+    assert_equal(
+        {'example.com': 'example.com', 'unrelated.com': None},
+        RULES.match_many(['example.com', 'unrelated.com', 'example.com'])
+    )
+
+
+def test_contains():
+    assert_true('a.wildcard.org' in RULES)
+    assert_false('wildcard.org' in RULES)
+
+
+def test_digest_changes_with_rules():
+    assert_equal(RULES.digest, DomainRules(list(RULES)).digest)
+    assert_false(RULES.digest == DomainRules(['example.com']).digest)
+
+
+def test_config_compiles_blacklist_on_assignment():
+    config.blacklisted_domains = ['.blacklisted.com']
+
+    assert_true(is_blacklisted('mail.blacklisted.com'))
+    assert_equal('.blacklisted.com', blacklist_reason('blacklisted.com'))
+    assert_equal(['.blacklisted.com'], list(config.blacklisted_domains))
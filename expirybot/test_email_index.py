@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal
+import unittest
+
+from .email_index import EmailIndex
+from .pgp_key import PGPKey
+
+FINGERPRINT_1 = '0xA999B7498D1A8DC473E53C92309F635DAD1B5517'
+FINGERPRINT_2 = '0x5DD5B8F28CBEFA024F9F472B638C78A5E281ACDB'
+
+
+class TestEmailIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = EmailIndex(pjoin(self.temp_dir, 'email_index.db'))
+
+        self._build([
+            PGPKey(fingerprint=FINGERPRINT_1,
+                   uids='Paul <Paul@Example.com>|Paul <paul@work.org>'),
+            PGPKey(fingerprint=FINGERPRINT_2,
+                   uids='Paul <paul@example.com>|No email'),
+        ])
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _build(self, keys):
+        self.index.start_build()
+
+        for key in keys:
+            self.index.update(key)
+
+        self.index.finish_build()
+
+    def test_fingerprints_for_email(self):
+        assert_equal(
+            [FINGERPRINT_2, FINGERPRINT_1],
+            self.index.fingerprints_for_email(' PAUL@example.com ')
+        )
+
+    def test_fingerprints_for_domain(self):
+        assert_equal(
+            [('paul@work.org', FINGERPRINT_1)],
+            self.index.fingerprints_for_domain('Work.org')
+        )
+
+    def test_changed_uids_are_reindexed(self):
+        self._build([
+            PGPKey(fingerprint=FINGERPRINT_1, uids='Paul <paul@new.org>'),
+            PGPKey(fingerprint=FINGERPRINT_2, uids='Paul <paul@example.com>'),
+        ])
+
+        assert_equal([], self.index.fingerprints_for_domain('work.org'))
+        assert_equal([FINGERPRINT_1],
+                     self.index.fingerprints_for_email('paul@new.org'))
+
+    def test_unseen_keys_are_dropped(self):
+        self._build([
+            PGPKey(fingerprint=FINGERPRINT_1, uids='Paul <paul@example.com>'),
+        ])
+
+        assert_equal([FINGERPRINT_1],
+                     self.index.fingerprints_for_email('paul@example.com'))
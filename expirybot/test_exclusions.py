@@ -1,6 +1,9 @@
 from nose.tools import assert_equal
 
-from .exclusions import all_blacklisted_domains, roughly_validate_email
+from .exclusions import (
+    all_blacklisted_domains, exclusion_reason, roughly_validate_email,
+    WEAK_KEY, ALL_BLACKLISTED_DOMAINS, NO_VALID_EMAILS
+)
 from .pgp_key import PGPKey
 from .config import config
 
@@ -22,3 +25,17 @@ def test_all_blacklisted_domains():
 
 def test_roughly_validate_email():
     assert_equal(False, roughly_validate_email('invalid'))
+
+
+def test_exclusion_reason():
+    config.blacklisted_domains = ['blacklisted.com']
+
+    for algorithm_number, size_bits, uids, expected in [
+        ('1', '1024', 'paul@example.com', WEAK_KEY),
+        ('1', '4096', 'paul@blacklisted.com', ALL_BLACKLISTED_DOMAINS),
+        ('1', '4096', 'Paul', NO_VALID_EMAILS),
+        ('1', '4096', 'paul@example.com', None),
+    ]:
+        key = PGPKey(algorithm_number=algorithm_number, size_bits=size_bits,
+                     uids=uids)
+        yield assert_equal, expected, exclusion_reason(key)
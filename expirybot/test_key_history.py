@@ -0,0 +1,136 @@
+import datetime
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal, assert_is_none, assert_true
+import unittest
+
+from .key_history import KeyHistory, PRESENT, REVOKED, MISSING
+from .pgp_key import PGPKey, Fingerprint
+
+FINGERPRINT_1 = '0xA999B7498D1A8DC473E53C92309F635DAD1B5517'
+FINGERPRINT_2 = '0x5DD5B8F28CBEFA024F9F472B638C78A5E281ACDB'
+
+DAY_1 = datetime.date(2018, 1, 1)
+DAY_2 = datetime.date(2018, 1, 2)
+DAY_3 = datetime.date(2018, 1, 3)
+
+
+def make_key(fingerprint, expiry_date, revoked=False):
+    key = PGPKey(
+        fingerprint=fingerprint,
+        uids='Paul <paul@example.com>',
+        expiry_date=expiry_date
+    )
+
+    if revoked:
+        key.set_revoked()
+
+    return key
+
+
+class TestKeyHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.history = KeyHistory(pjoin(self.temp_dir, 'key_history.db'))
+
+        self._snapshot(DAY_1, [
+            make_key(FINGERPRINT_1, datetime.date(2018, 1, 4)),
+            make_key(FINGERPRINT_2, datetime.date(2018, 1, 4)),
+        ])
+        self._snapshot(DAY_2, [
+            make_key(FINGERPRINT_1, datetime.date(2019, 1, 4)),
+            make_key(FINGERPRINT_2, datetime.date(2018, 1, 4)),
+        ])
+        self._snapshot(DAY_3, [
+            make_key(FINGERPRINT_1, datetime.date(2019, 1, 4)),
+        ])
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.temp_dir)
+
+    def _snapshot(self, day, keys):
+        self.history.start_snapshot(day)
+
+        for key in keys:
+            self.history.observe(key)
+
+        self.history.finish_snapshot()
+
+    def test_only_changes_are_stored(self):
+        count, = self.history._conn.execute(
+            'SELECT COUNT(*) FROM changes').fetchone()
+
+        assert_equal(4, count)  # 2 new keys, 1 renewal, 1 missing
+
+    def test_state_on(self):
+        state = self.history.state_on(FINGERPRINT_1, DAY_1)
+
+        assert_equal(PRESENT, state.status)
+        assert_equal(datetime.date(2018, 1, 4), state.expiry_date)
+        assert_equal(['Paul <paul@example.com>'], state.uids)
+
+    def test_state_on_after_change(self):
+        state = self.history.state_on(FINGERPRINT_1, DAY_3)
+
+        assert_equal(datetime.date(2019, 1, 4), state.expiry_date)
+        assert_equal(DAY_2, state.since)
+
+    def test_state_before_first_seen(self):
+        assert_is_none(self.history.state_on(
+            FINGERPRINT_1, datetime.date(2017, 1, 1)))
+
+    def test_missing_keys(self):
+        state = self.history.state_on(FINGERPRINT_2, DAY_3)
+
+        assert_equal(MISSING, state.status)
+
+    def test_revoked_keys(self):
+        self._snapshot(datetime.date(2018, 1, 4), [
+            make_key(FINGERPRINT_1, datetime.date(2019, 1, 4), revoked=True),
+        ])
+
+        state = self.history.state_on(FINGERPRINT_1, datetime.date(2018, 1, 4))
+        assert_equal(REVOKED, state.status)
+
+    def test_expiry_moved_between(self):
+        assert_equal([FINGERPRINT_1],
+                     self.history.expiry_moved_between(DAY_1, DAY_3))
+
+        assert_equal([], self.history.expiry_moved_between(DAY_2, DAY_3))
+
+    def test_renewal_days(self):
+        renewed = self.history.renewal_days(
+            [FINGERPRINT_1, FINGERPRINT_2], DAY_1, datetime.date(2018, 1, 4))
+
+        assert_equal({FINGERPRINT_1: DAY_2}, renewed)
+
+    def test_lookup_many(self):
+        results = self.history.lookup_many(
+            [FINGERPRINT_1, FINGERPRINT_2], day=DAY_3)
+
+        assert_equal(datetime.date(2019, 1, 4),
+                     results[Fingerprint(FINGERPRINT_1)].expiry_date)
+        assert_is_none(results[Fingerprint(FINGERPRINT_2)])
+
+    def test_lookup_many_revoked(self):
+        self._snapshot(datetime.date(2018, 1, 4), [
+            make_key(FINGERPRINT_1, datetime.date(2019, 1, 4), revoked=True),
+        ])
+
+        results = self.history.lookup_many(
+            [FINGERPRINT_1], day=datetime.date(2018, 1, 4))
+
+        assert_true(results[Fingerprint(FINGERPRINT_1)].is_revoked)
+
+    def test_mark_seen_keeps_key_present(self):
+        self.history.start_snapshot(datetime.date(2018, 1, 4))
+        self.history.mark_seen(FINGERPRINT_1)
+        self.history.finish_snapshot()
+
+        state = self.history.state_on(FINGERPRINT_1, datetime.date(2018, 1, 4))
+        assert_equal(PRESENT, state.status)
@@ -0,0 +1,90 @@
+from nose.tools import assert_equal, assert_is_none
+import unittest
+
+import requests
+
+from .key_lookup import CachedKeyLookup
+from .pgp_key import PGPKey
+
+FINGERPRINT = 'A999B7498D1A8DC473E53C92309F635DAD1B5517'
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeKeyserverClient():
+    calls = []
+
+    def get_key_for_fingerprint(self, fingerprint):
+        self.calls.append(fingerprint)
+
+        if fingerprint.hex_format.endswith('0000'):
+            raise RuntimeError('Expected 1 key')
+
+        return PGPKey(fingerprint=fingerprint.hex_format)
+
+
+class FlakyKeyserverClient(FakeKeyserverClient):
+    def get_key_for_fingerprint(self, fingerprint):
+        if not self.calls:
+            self.calls.append(fingerprint)
+            raise requests.exceptions.ConnectionError()
+
+        return super().get_key_for_fingerprint(fingerprint)
+
+
+class TestCachedKeyLookup(unittest.TestCase):
+
+    def setUp(self):
+        FakeKeyserverClient.calls = []
+        self.clock = FakeClock()
+
+        self.lookup = CachedKeyLookup(
+            max_workers=2, cache_seconds=60,
+            make_client=FakeKeyserverClient, clock=self.clock
+        )
+
+    def tearDown(self):
+        self.lookup.close()
+
+    def test_lookup_many(self):
+        results = self.lookup.lookup_many([FINGERPRINT])
+
+        assert_equal(FINGERPRINT, results[FINGERPRINT].fingerprint)
+
+    def test_failed_lookup_is_none(self):
+        results = self.lookup.lookup_many(['0x' + '0' * 40])
+
+        assert_is_none(results['0' * 40])
+
+    def test_results_are_cached(self):
+        self.lookup.lookup_many([FINGERPRINT])
+        self.lookup.lookup_many([FINGERPRINT])
+
+        assert_equal(1, len(FakeKeyserverClient.calls))
+
+    def test_prefetched_results_are_reused(self):
+        self.lookup.prefetch([FINGERPRINT])
+        self.lookup.lookup_many([FINGERPRINT])
+
+        assert_equal(1, len(FakeKeyserverClient.calls))
+
+    def test_cache_expires(self):
+        self.lookup.lookup_many([FINGERPRINT])
+        self.clock.now += 61
+        self.lookup.lookup_many([FINGERPRINT])
+
+        assert_equal(2, len(FakeKeyserverClient.calls))
+
+    def test_network_errors_are_retried(self):
+        lookup = CachedKeyLookup(make_client=FlakyKeyserverClient)
+        results = lookup.lookup_many([FINGERPRINT])
+        lookup.close()
+
+        assert_equal(FINGERPRINT, results[FINGERPRINT].fingerprint)
+        assert_equal(2, len(FakeKeyserverClient.calls))
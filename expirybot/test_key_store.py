@@ -0,0 +1,152 @@
+import datetime
+import os
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal, assert_false, assert_true
+import unittest
+
+from .key_store import KeyStore, KeyStoreWriter, NO_DATE
+from .pgp_key import PGPKey
+from .utils import make_atomic_key_store_writer
+
+TODAY = datetime.date(2017, 6, 1)
+
+ALICE = PGPKey(
+    fingerprint='A999 B749 8D1A 8DC4 73E5  3C92 309F 635D AD1B 5517',
+    algorithm_number=1,
+    size_bits=4096,
+    uids='Alice <alice@example.com>|Alice (work) <alice@work.example.com>',
+    created_date='2014-06-03',
+    expiry_date='2017-06-04'
+)
+
+BOB = PGPKey(
+    fingerprint='0x1111222233334444555566667777888899990000',
+    uids='Alice <alice@example.com>|Bøb <bob@example.com>',
+)
+
+
+class TestKeyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_dir = pjoin(self.temp_dir, 'keys.store')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write(self, keys):
+        writer = KeyStoreWriter(self.store_dir)
+
+        for key in keys:
+            writer.write(key)
+
+        writer.close()
+        return KeyStore(self.store_dir)
+
+    def test_round_trip(self):
+        store = self._write([ALICE, BOB])
+
+        assert_equal(2, len(store))
+
+        alice, bob = list(store)
+
+        assert_equal(ALICE.fingerprint, alice.fingerprint)
+        assert_equal(1, alice.algorithm_number)
+        assert_equal(4096, alice.size_bits)
+        assert_equal(datetime.date(2014, 6, 3), alice.created_date)
+        assert_equal(datetime.date(2017, 6, 4), alice.expiry_date)
+        assert_equal([str(uid) for uid in ALICE.uids],
+                     [str(uid) for uid in alice.uids])
+
+        assert_equal(BOB.fingerprint, bob.fingerprint)
+        assert_equal(None, bob.algorithm_number)
+        assert_equal(None, bob.size_bits)
+        assert_equal(None, bob.expiry_date)
+        assert_equal(['Alice <alice@example.com>', 'Bøb <bob@example.com>'],
+                     [str(uid) for uid in bob.uids])
+
+    def test_uids_are_stored_once(self):
+        store = self._write([ALICE, BOB])
+
+        assert_equal(3 + 1, len(store.column('uid_string_offsets')))
+        assert_equal([0, 1, 0, 2], list(store.column('uid_ids')))
+
+    def test_uid_strings_are_shared(self):
+        store = self._write([ALICE, BOB])
+        alice, bob = list(store)
+
+        assert_true(alice._uids[0] is bob._uids[0])
+
+    def test_expiring_in(self):
+        store = self._write([ALICE, BOB])
+
+        assert_equal([0], list(store.expiring_in(3, today=TODAY)))
+        assert_equal([], list(store.expiring_in(2, today=TODAY)))
+        assert_equal(NO_DATE, store.column('expiry_days')[1])
+
+    def test_expiring_in_slice(self):
+        store = self._write([ALICE, BOB, ALICE])
+
+        assert_equal([2], list(store.expiring_in(3, today=TODAY, start=1)))
+        assert_equal([0], list(store.expiring_in(3, today=TODAY, stop=2)))
+        assert_equal([], list(
+            store.expiring_in(3, today=TODAY, start=1, stop=2)))
+
+    def test_flushes_in_batches(self):
+        KeyStoreWriter.FLUSH_EVERY, old = 2, KeyStoreWriter.FLUSH_EVERY
+
+        try:
+            store = self._write([ALICE, BOB, ALICE])
+        finally:
+            KeyStoreWriter.FLUSH_EVERY = old
+
+        assert_equal(
+            [ALICE.fingerprint, BOB.fingerprint, ALICE.fingerprint],
+            [key.fingerprint for key in store]
+        )
+
+    def test_empty_store(self):
+        store = self._write([])
+
+        assert_equal(0, len(store))
+        assert_equal([], list(store))
+        assert_equal([], list(store.expiring_in(3)))
+
+
+class TestMakeAtomicKeyStoreWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store_dir = pjoin(self.temp_dir, 'keys.store')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_replaces_existing_store(self):
+        with make_atomic_key_store_writer(self.store_dir) as writer:
+            writer.write(ALICE)
+            assert_false(os.path.exists(self.store_dir))
+
+        with make_atomic_key_store_writer(self.store_dir) as writer:
+            writer.write(BOB)
+
+        assert_equal([BOB.fingerprint],
+                     [key.fingerprint for key in KeyStore(self.store_dir)])
+        assert_equal(['keys.store'], os.listdir(self.temp_dir))
+
+    def test_failed_write_leaves_old_store(self):
+        with make_atomic_key_store_writer(self.store_dir) as writer:
+            writer.write(ALICE)
+
+        with self.assertRaises(RuntimeError):
+            with make_atomic_key_store_writer(self.store_dir) as writer:
+                writer.write(BOB)
+                raise RuntimeError()
+
+        assert_true(os.path.isdir(self.store_dir))
+        assert_equal([ALICE.fingerprint],
+                     [key.fingerprint for key in KeyStore(self.store_dir)])
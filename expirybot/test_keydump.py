@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal
+import unittest
+
+from .keydump import find_keydump_files, read_keydump, read_keydumps
+from .openpgp_packets import dearmor
+from .test_utils import open_sample
+
+ALICE = '0x6B4AFEADD04A980C71388F1043AA7354FF6DC233'
+BOB = '0xE1C631D284334B2EEEBB37ED414CC6D801817E0E'
+
+
+class TestKeydump(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+        with open_sample('keyblock_alice_bob.asc') as f:
+            dump = dearmor(f.read().decode('ascii'))
+
+        for name in ('sks-dump-0000.pgp', 'sks-dump-0001.pgp'):
+            with open(pjoin(self.temp_dir, name), 'wb') as f:
+                f.write(dump)
+
+        open(pjoin(self.temp_dir, 'empty.pgp'), 'wb').close()
+
+        self.dump = dump
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_find_keydump_files(self):
+        assert_equal(
+            ['empty.pgp', 'sks-dump-0000.pgp', 'sks-dump-0001.pgp'],
+            [os.path.basename(fn)
+             for fn in find_keydump_files([self.temp_dir])]
+        )
+
+    def test_read_keydump(self):
+        keys = list(read_keydump(pjoin(self.temp_dir, 'sks-dump-0000.pgp')))
+
+        assert_equal([ALICE, BOB], [k.fingerprint.hex_format for k in keys])
+
+    def test_read_empty_keydump(self):
+        assert_equal([], list(read_keydump(pjoin(self.temp_dir, 'empty.pgp'))))
+
+    def test_read_keydumps_in_parallel(self):
+        filenames = find_keydump_files([self.temp_dir])
+
+        assert_equal(
+            [ALICE, BOB, ALICE, BOB],
+            [k.fingerprint.hex_format
+             for k in read_keydumps(filenames, workers=2)]
+        )
+
+    def test_read_keydumps_in_process(self):
+        filenames = find_keydump_files([self.temp_dir])
+
+        assert_equal(
+            [ALICE, BOB, ALICE, BOB],
+            [k.fingerprint.hex_format
+             for k in read_keydumps(filenames, workers=1)]
+        )
+
+    def _write_broken_dumps(self):
+        broken_dir = pjoin(self.temp_dir, 'broken')
+        os.mkdir(broken_dir)
+
+        for name, data in [
+                ('0000-garbage.pgp', self.dump + b'garbage'),
+                ('0001-truncated.pgp', self.dump[:-10]),
+                ('0002-good.pgp', self.dump)]:
+            with open(pjoin(broken_dir, name), 'wb') as f:
+                f.write(data)
+
+        return find_keydump_files([broken_dir])
+
+    def test_corrupt_files_keep_keys_before_the_damage(self):
+        for workers in (1, 2):
+            assert_equal(
+                # the key being read when the damage is found is dropped,
+                # as it could be missing e.g. a revocation
+                [ALICE,  # Bob's followed by garbage
+                 ALICE,  # Bob's cut short
+                 ALICE, BOB],
+                [k.fingerprint.hex_format for k in read_keydumps(
+                    self._write_broken_dumps(), workers=workers)]
+            )
+            shutil.rmtree(pjoin(self.temp_dir, 'broken'))
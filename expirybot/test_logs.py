@@ -0,0 +1,158 @@
+import logging
+import multiprocessing
+import threading
+
+from nose.tools import assert_equal, assert_true
+import unittest
+
+from .logs import (
+    AsyncLogHandler, SampledLogger, init_worker_sampling,
+    merge_sampled_counts, take_sampled_counts
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.threads = set()
+
+    def emit(self, record):
+        self.records.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.handlers = [handler]
+    return logger
+
+
+POOL_SAMPLED = SampledLogger(
+    make_logger('test_logs.pool', ListHandler()), first=4, every=1000
+)
+
+
+def _warn_in_worker(count):
+    for i in range(count):
+        POOL_SAMPLED.warning('weak-key', 'weak %d', i)
+
+    return take_sampled_counts()
+
+
+class TestAsyncLogHandler(unittest.TestCase):
+
+    def test_records_are_written_by_a_background_thread(self):
+        target = ListHandler()
+        handler = AsyncLogHandler(target)
+        logger = make_logger('test_logs.async', handler)
+
+        for i in range(100):
+            logger.info('message %d of %s', i, 'many')
+
+        handler.close()
+
+        assert_equal(100, len(target.records))
+        assert_equal('message 99 of many', target.records[-1])
+        assert_true(threading.current_thread().name not in target.threads)
+
+    def test_exceptions_keep_their_traceback(self):
+        target = ListHandler()
+        handler = AsyncLogHandler(target)
+        logger = make_logger('test_logs.async_exception', handler)
+
+        try:
+            raise ValueError('bad key')
+        except ValueError:
+            logger.exception('failed')
+
+        handler.close()
+
+        assert_true(target.records[0].startswith('failed\nTraceback'))
+        assert_true('ValueError: bad key' in target.records[0])
+
+
+class TestSampledLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.target = ListHandler()
+        self.sampled = SampledLogger(
+            make_logger('test_logs.sampled', self.target), first=3, every=10
+        )
+
+    def test_logs_first_few_then_samples(self):
+        for i in range(1, 26):
+            self.sampled.warning('weak-key', 'weak %d', i)
+
+        self.sampled.warning('no-valid-emails', 'no emails')
+
+        assert_equal(
+            ['weak 1', 'weak 2', 'weak 3', 'weak 10', 'weak 20', 'no emails'],
+            self.target.records
+        )
+
+    def test_summary(self):
+        for i in range(25):
+            self.sampled.warning('weak-key', 'weak')
+
+        self.sampled.warning('no-valid-emails', 'no emails')
+
+        assert_equal(
+            'no-valid-emails: 1 (0 not logged), '
+            'weak-key: 25 (20 not logged)',
+            self.sampled.summary()
+        )
+
+    def test_take_and_merge(self):
+        for i in range(5):
+            self.sampled.warning('weak-key', 'weak %d', i)
+
+        counts, logged = self.sampled.take()
+
+        assert_equal({'weak-key': 5}, counts)
+        assert_equal({'weak-key': 3}, logged)
+        assert_equal('', self.sampled.summary())
+
+        self.sampled.warning('weak-key', 'weak 6')  # still sampling after 5
+        self.sampled.merge(counts, logged)
+
+        assert_equal(['weak 0', 'weak 1', 'weak 2'], self.target.records)
+        assert_equal('weak-key: 6 (3 not logged)', self.sampled.summary())
+
+
+class TestWorkerSampling(unittest.TestCase):
+
+    def tearDown(self):
+        POOL_SAMPLED.reset()
+
+    def test_worker_counts_are_merged(self):
+        with multiprocessing.Pool(2, init_worker_sampling, (2,)) as pool:
+            for sampled_counts in pool.imap(_warn_in_worker, [5, 5, 5]):
+                merge_sampled_counts(sampled_counts)
+
+        assert_equal({'weak-key': 15}, POOL_SAMPLED.counts)
+        assert_true(POOL_SAMPLED.logged['weak-key'] <= 4)  # 2 per worker
+
+    def test_loggers_sharing_a_name_are_all_counted(self):
+        target = ListHandler()
+        first = SampledLogger(make_logger('test_logs.shared', target))
+        second = SampledLogger(make_logger('test_logs.shared', target))
+
+        first.warning('weak-key', 'weak')
+        second.warning('weak-key', 'weak')
+        second.warning('no-valid-emails', 'no emails')
+
+        taken = take_sampled_counts()
+
+        assert_equal(
+            ({'weak-key': 2, 'no-valid-emails': 1},
+             {'weak-key': 2, 'no-valid-emails': 1}),
+            taken['test_logs.shared']
+        )
+
+        merge_sampled_counts(taken)
+
+        assert_equal({'weak-key': 2, 'no-valid-emails': 1}, first.counts)
+        assert_equal({}, second.counts)
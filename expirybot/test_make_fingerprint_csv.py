@@ -0,0 +1,116 @@
+import datetime
+import io
+import os
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+from unittest.mock import patch
+
+from nose.tools import assert_equal
+import unittest
+
+from .config import config
+from .crawl_index import normalize_short_id
+from .make_fingerprint_csv import run_crawl_and_filter
+from .pgp_key import PGPKey
+from .utils import load_keys_from_csv
+
+TODAY = datetime.date.today()
+
+
+def make_key(fingerprint, size_bits=4096, expires_in=3):
+    return PGPKey(
+        fingerprint=fingerprint,
+        algorithm_number=1,
+        size_bits=size_bits,
+        uids='Key <key{}@example.com>'.format(fingerprint[-4:]),
+        expiry_date=TODAY + datetime.timedelta(days=expires_in)
+    )
+
+
+ALICE = make_key('A999B7498D1A8DC473E53C92309F635DAD1B5517')
+BOB = make_key('5DD5B8F28CBEFA024F9F472B638C78A5E281ACDB', expires_in=30)
+WEAK = make_key('0000000000000000000000000000000000000003', size_bits=1024)
+REVOKED = make_key('0000000000000000000000000000000000000004')
+REVOKED.set_revoked()
+
+# Bob's short ID collides with Alice's, so she comes back twice.
+KEYS_FOR_SHORT_ID = {
+    'AD1B5517': [ALICE],
+    'E281ACDB': [ALICE, BOB],
+    '00000003': [WEAK],
+    '00000004': [REVOKED],
+}
+
+
+class FakeKeyserverClient():
+    def __init__(self):
+        self.queries = []
+
+    def get_keys_for_short_id(self, short_id, include_revoked=False):
+        short_id = normalize_short_id(short_id)
+        self.queries.append(short_id)
+        return iter(KEYS_FOR_SHORT_ID[short_id])
+
+
+class TestRunCrawlAndFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.today_dir = pjoin(self.temp_dir, TODAY.isoformat())
+        os.mkdir(self.today_dir)
+
+        self.short_ids_file = pjoin(self.temp_dir, 'short_ids.txt')
+
+        with io.open(self.short_ids_file, 'w') as f:
+            for short_id in sorted(KEYS_FOR_SHORT_ID):
+                f.write('0x{} 1\n'.format(short_id.lower()))
+
+        self.patches = [
+            patch.object(type(config), 'data_dir', self.temp_dir),
+            patch.object(config, 'check_recipient_dns', False),
+        ]
+
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+        shutil.rmtree(self.temp_dir)
+
+    def _crawl(self, client):
+        return run_crawl_and_filter(
+            self.today_dir, self.short_ids_file, keyserver_client=client
+        )
+
+    def _fingerprints(self, filename):
+        return [key.fingerprint for key in load_keys_from_csv(filename)]
+
+    def test_writes_keys_and_filters_them(self):
+        stats = self._crawl(FakeKeyserverClient())
+
+        # Alice only once, and no revoked keys
+        assert_equal(
+            [WEAK.fingerprint, ALICE.fingerprint, BOB.fingerprint],
+            self._fingerprints(pjoin(self.temp_dir, 'keys.csv'))
+        )
+        assert_equal(
+            [ALICE.fingerprint],
+            self._fingerprints(pjoin(self.today_dir, 'keys_expiring.csv'))
+        )
+        assert_equal(
+            [WEAK.fingerprint],
+            self._fingerprints(pjoin(self.today_dir, 'keys_excluded.csv'))
+        )
+        assert_equal({'weak-key': 1}, stats.exclusion_reasons)
+
+    def test_negative_cache_skips_revoked_short_id_next_night(self):
+        self._crawl(FakeKeyserverClient())
+
+        client = FakeKeyserverClient()
+        self._crawl(client)
+
+        assert_equal(['00000003', 'AD1B5517', 'E281ACDB'], client.queries)
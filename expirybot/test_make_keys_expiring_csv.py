@@ -1 +1,74 @@
-from .make_keys_expiring_csv import should_exclude
+import datetime
+import io
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+from unittest.mock import patch
+
+from nose.tools import assert_equal
+import unittest
+
+from .config import config
+from .make_keys_expiring_csv import (
+    Stats, filter_in_parallel, handle_key, setup_output_csvs
+)
+from .partitions import csv_partitions
+from .pgp_key import PGPKey
+from .utils import load_keys_from_csv, make_atomic_csv_writer, write_key_to_csv
+
+
+def make_keys(count):
+    today = datetime.date.today()
+
+    return [
+        PGPKey(
+            fingerprint='{:040X}'.format(i + 1),
+            algorithm_number=1,
+            size_bits=1024 if i % 2 == 0 else 4096,  # weak keys are excluded
+            uids='Key {} <key{}@example.com>'.format(i, i),
+            expiry_date=today + datetime.timedelta(days=i % 5)
+        )
+        for i in range(count)
+    ]
+
+
+class TestFilterInParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_fn = pjoin(self.temp_dir, 'keys.csv')
+
+        with make_atomic_csv_writer(self.csv_fn, config.csv_header) as w:
+            for key in make_keys(60):
+                write_key_to_csv(key, w)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _filter(self, workers):
+        expiring_fn = pjoin(self.temp_dir, 'expiring_{}.csv'.format(workers))
+        excluded_fn = pjoin(self.temp_dir, 'excluded_{}.csv'.format(workers))
+        stats = Stats()
+
+        if workers == 1:
+            with setup_output_csvs(expiring_fn, excluded_fn) as \
+                    (expiring_csv, excluded_csv):
+                for key in load_keys_from_csv(self.csv_fn):
+                    handle_key(key, expiring_csv, excluded_csv, stats)
+        else:
+            with patch('expirybot.make_keys_expiring_csv.make_partitions',
+                       lambda count: csv_partitions(self.csv_fn, count)):
+                filter_in_parallel(expiring_fn, excluded_fn, stats, workers)
+
+        with io.open(expiring_fn, 'rb') as f, io.open(excluded_fn, 'rb') as g:
+            return f.read(), g.read(), vars(stats)
+
+    def test_same_output_as_serial_filter(self):
+        serial = self._filter(1)
+        parallel = self._filter(3)
+
+        assert_equal(serial, parallel)
+        assert_equal({'parsed_count': 60, 'expiring_count': 6,
+                      'excluded_count': 6,
+                      'exclusion_reasons': {'weak-key': 6}}, parallel[2])
@@ -0,0 +1,205 @@
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal, assert_true, assert_false
+import unittest
+
+from .crawl_index import CrawlIndex
+from .make_fingerprint_csv import (
+    get_keys_for_short_id, get_keys_for_short_ids
+)
+from .negative_cache import (
+    NegativeCache, NOT_FOUND, NO_USABLE_KEYS, REVOKED, SECONDS_PER_DAY
+)
+from .pgp_key import PGPKey
+
+FINGERPRINT = '0xA999B7498D1A8DC473E53C92309F635DAD1B5517'
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance_days(self, days):
+        self.now += days * SECONDS_PER_DAY
+
+
+class FakeKeyserverClient():
+    def __init__(self, keys):
+        self.keys = keys
+        self.queries = []
+
+    def get_keys_for_short_id(self, short_id, include_revoked=False):
+        self.queries.append(short_id)
+        return iter(self.keys)
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.cache = NegativeCache(
+            pjoin(self.temp_dir, 'negative_cache.db'),
+            backoff_days=7, max_backoff_days=20, max_unchecked_backoff_days=3,
+            clock=self.clock
+        )
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_unknown_short_id_is_not_skipped(self):
+        assert_false(self.cache.should_skip('0x309F635D'))
+
+    def test_skips_until_backoff_expires(self):
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS)
+
+        self.clock.advance_days(6)
+        assert_true(self.cache.should_skip('0x309F635D'))
+
+        self.clock.advance_days(1)
+        assert_false(self.cache.should_skip('0x309F635D'))
+
+    def test_backoff_grows_up_to_maximum(self):
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS)
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS)
+
+        self.clock.advance_days(13)
+        assert_true(self.cache.should_skip('0x309F635D'))  # 14 days
+
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS)
+
+        self.clock.advance_days(20)
+        assert_false(self.cache.should_skip('0x309F635D'))  # capped at 20
+
+    def test_hit_clears_entry(self):
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS)
+        self.cache.record_hit('0x309f635d')
+
+        assert_false(self.cache.should_skip('0x309F635D'))
+
+    def test_changed_dump_line_invalidates(self):
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS,
+                               line='0x309F635D aaaa')
+
+        assert_true(self.cache.should_skip('0x309F635D', '0x309F635D aaaa'))
+        assert_false(self.cache.should_skip('0x309F635D', '0x309F635D bbbb'))
+        assert_false(self.cache.should_skip('0x309F635D', '0x309F635D aaaa'))
+
+    def test_new_key_changes_dump_line(self):
+        self.cache.record_miss('0x309F635D', REVOKED, line='0x309f635d 1')
+
+        self.clock.advance_days(6)
+        assert_true(self.cache.should_skip('0x309F635D', '0x309f635d 1'))
+        assert_false(self.cache.should_skip('0x309F635D', '0x309f635d 2'))
+
+    def test_dump_line_short_id_case_is_ignored(self):
+        self.cache.record_miss('0x309F635D', REVOKED, line='0x309F635D 1')
+
+        assert_true(self.cache.should_skip('0x309F635D', '0x309f635d 1'))
+
+    def test_bare_short_id_matches_missing_line(self):
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS)
+
+        assert_true(self.cache.should_skip('0x309F635D', '0x309f635d'))
+
+    def test_bare_dump_line_caps_new_key_reasons(self):
+        for reason in (NOT_FOUND, REVOKED):
+            self.cache.record_miss('0x309F635D', reason, line='0x309f635d')
+
+            self.clock.advance_days(2)
+            assert_true(self.cache.should_skip('0x309F635D', '0x309f635d'))
+
+            self.clock.advance_days(1)
+            assert_false(self.cache.should_skip('0x309F635D', '0x309f635d'))
+
+            self.cache.record_hit('0x309F635D')
+
+    def test_bare_dump_line_keeps_backoff_for_unusable_keys(self):
+        self.cache.record_miss('0x309F635D', NO_USABLE_KEYS, line='0x309f635d')
+
+        self.clock.advance_days(6)
+        assert_true(self.cache.should_skip('0x309F635D', '0x309f635d'))
+
+    def test_report_and_skipped_fingerprints(self):
+        self.cache.record_miss('0x309F635D', REVOKED,
+                               fingerprints=[FINGERPRINT])
+        self.cache.record_miss('0xE281ACDB', NO_USABLE_KEYS)
+
+        self.cache.should_skip('0x309F635D')
+        self.cache.should_skip('0xE281ACDB')
+
+        assert_equal([FINGERPRINT], self.cache.skipped_fingerprints)
+        assert_equal(
+            'Negative cache: skipped 2 lookups (1 no-usable-keys, 1 revoked)',
+            self.cache.report()
+        )
+
+
+class TestGetKeysForShortId(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = NegativeCache(pjoin(self.temp_dir, 'negative_cache.db'))
+        self.crawl_index = CrawlIndex(pjoin(self.temp_dir, 'crawl_index.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        self.crawl_index.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_only_revoked_keys_is_a_miss(self):
+        key = PGPKey(fingerprint=FINGERPRINT)
+        key.set_revoked()
+
+        keys = list(get_keys_for_short_id(
+            FakeKeyserverClient([key]), self.crawl_index, self.cache,
+            '0xAD1B5517'
+        ))
+
+        assert_equal([key], keys)
+        assert_true(self.cache.should_skip('0xAD1B5517'))
+
+    def test_no_keys_is_a_miss(self):
+        list(get_keys_for_short_id(
+            FakeKeyserverClient([]), self.crawl_index, self.cache,
+            '0xAD1B5517'
+        ))
+
+        assert_true(self.cache.should_skip('0xAD1B5517'))
+
+    def test_valid_key_is_a_hit(self):
+        self.cache.record_miss('0xAD1B5517', NO_USABLE_KEYS)
+        self.cache._conn.execute('UPDATE misses SET retry_after = 0')
+
+        list(get_keys_for_short_id(
+            FakeKeyserverClient([PGPKey(fingerprint=FINGERPRINT)]),
+            self.crawl_index, self.cache, '0xAD1B5517'
+        ))
+
+        assert_false(self.cache.should_skip('0xAD1B5517'))
+
+    def test_deferred_short_id_keeps_its_dump_line(self):
+        key = PGPKey(fingerprint=FINGERPRINT)
+        key.set_revoked()
+        client = FakeKeyserverClient([key])
+
+        short_ids_file = pjoin(self.temp_dir, 'short_ids.txt')
+
+        with open(short_ids_file, 'w') as f:
+            f.write('0x8e532c34 1\n')
+
+        self.crawl_index.record_short_id('0x8E532C34', [key])  # a subkey
+
+        for night in range(2):
+            list(get_keys_for_short_ids(
+                short_ids_file, self.crawl_index, self.cache, client
+            ))
+
+        assert_equal(['0x8E532C34'], client.queries)
@@ -0,0 +1,143 @@
+import datetime
+
+from nose.tools import assert_equal, assert_raises, assert_true, assert_false
+import unittest
+
+from .openpgp_packets import (
+    OpenPGPPacketParser, dearmor, iter_packets, _parse_public_key
+)
+from .pgp_key import Fingerprint, OpenPGPVersion3FingerprintUnsupported
+from .test_utils import open_sample
+
+ALICE = '6B4AFEADD04A980C71388F1043AA7354FF6DC233'
+
+
+def load_colons(name):
+    """
+    Parse `gpg --with-colons --fixed-list-mode` output into
+    {fingerprint: {'pub': fields, 'uids': [fields], 'subs': [fields]}}
+    """
+    keys = {}
+    key = current = None
+
+    with open_sample(name) as f:
+        for line in f.read().decode('utf-8').splitlines():
+            fields = line.split(':')
+
+            if fields[0] == 'pub':
+                key = {'pub': fields, 'uids': [], 'subs': []}
+                current = key
+            elif fields[0] == 'sub':
+                current = {'sub': fields}
+                key['subs'].append(current)
+            elif fields[0] == 'uid':
+                key['uids'].append(fields)
+            elif fields[0] == 'fpr':
+                current['fingerprint'] = fields[9]
+
+                if 'pub' in current:
+                    keys[fields[9]] = key
+
+    return keys
+
+
+def timestamp_to_date(timestamp):
+    if not timestamp:
+        return None
+
+    return datetime.datetime.fromtimestamp(int(timestamp)).date()
+
+
+class TestOpenPGPPacketParser(unittest.TestCase):
+
+    def setUp(self):
+        with open_sample('keyblock_alice_bob.asc') as f:
+            self.keys = {
+                key.fingerprint.hex_format[2:]: key
+                for key in OpenPGPPacketParser(f.read()).keys()
+            }
+
+        self.expected = load_colons('keyblock_alice_bob.colons')
+
+    def test_parses_every_key(self):
+        assert_equal(set(self.expected.keys()), set(self.keys.keys()))
+
+    def test_matches_gpg(self):
+        for fingerprint, expected in self.expected.items():
+            key = self.keys[fingerprint]
+            pub = expected['pub']
+            key_revoked = pub[1] == 'r'
+
+            assert_equal(key_revoked, key.is_revoked)
+            assert_equal(int(pub[2]), key.size_bits)
+            assert_equal(int(pub[3]), key.algorithm_number)
+            assert_equal(timestamp_to_date(pub[5]), key.created_date)
+            assert_equal(timestamp_to_date(pub[6]), key.expiry_date)
+
+            # gpg marks every UID of a revoked key as revoked, too
+            assert_equal(
+                [uid[9] for uid in expected['uids']
+                 if uid[1] != 'r' or key_revoked],
+                [str(uid) for uid in key.uids]
+            )
+
+            assert_equal(len(expected['subs']), len(key.subkeys))
+
+            for sub, subkey in zip(expected['subs'], key.subkeys):
+                assert_equal(Fingerprint(sub['fingerprint']),
+                             subkey.fingerprint)
+                assert_equal(int(sub['sub'][2]), subkey.size_bits)
+                assert_equal(int(sub['sub'][3]), subkey.algorithm_number)
+                assert_equal(timestamp_to_date(sub['sub'][6]),
+                             subkey.expiry_date)
+                assert_equal(sub['sub'][1] == 'r',
+                             subkey.revoked or key_revoked)
+
+    def test_revoked_uid_is_dropped(self):
+        emails = self.keys[ALICE].emails
+
+        assert_true('alice@example.com' in emails)
+        assert_false('alice@old.example.net' in emails)
+
+    def test_accepts_bytes_or_text(self):
+        with open_sample('keyblock_alice_bob.asc') as f:
+            armored = f.read()
+
+        from_bytes = list(OpenPGPPacketParser(armored).keys())
+        from_text = list(OpenPGPPacketParser(armored.decode('ascii')).keys())
+        from_binary = list(OpenPGPPacketParser(
+            dearmor(armored.decode('ascii'))).keys())
+
+        assert_equal(
+            [k.fingerprint for k in from_bytes],
+            [k.fingerprint for k in from_text]
+        )
+        assert_equal(
+            [k.fingerprint for k in from_bytes],
+            [k.fingerprint for k in from_binary]
+        )
+
+
+def test_iter_packets_old_and_new_format():
+    packets = list(iter_packets(
+        bytes([0xB4, 0x03]) + b'abc' +  # old format, user ID, 1-byte length
+        bytes([0xCD, 0x02]) + b'de'     # new format, user ID
+    ))
+
+    assert_equal([(13, b'abc'), (13, b'de')], packets)
+
+
+def test_iter_packets_partial_body_lengths():
+    packets = list(iter_packets(
+        bytes([0xCD, 0xE1]) + b'ab' +  # partial: 2 bytes follow
+        bytes([0x01]) + b'c'           # final chunk
+    ))
+
+    assert_equal([(13, b'abc')], packets)
+
+
+def test_version_3_keys_unsupported():
+    assert_raises(
+        OpenPGPVersion3FingerprintUnsupported,
+        _parse_public_key, bytes([3, 0, 0, 0, 0, 0, 0, 1])
+    )
@@ -0,0 +1,100 @@
+import datetime
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal
+import unittest
+
+from .config import config
+from .partitions import (
+    csv_partitions, read_partition, store_partitions
+)
+from .pgp_key import PGPKey
+from .utils import (
+    make_atomic_csv_writer, make_atomic_key_store_writer, write_key_to_csv
+)
+
+
+def make_keys(count):
+    today = datetime.date.today()
+
+    return [
+        PGPKey(
+            fingerprint='{:040X}'.format(i + 1),
+            algorithm_number=1,
+            size_bits=4096,
+            uids='Key {} <key{}@example.com>'.format(i, i),
+            expiry_date=today + datetime.timedelta(days=i % 5)
+        )
+        for i in range(count)
+    ]
+
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.keys = make_keys(50)
+
+        # a UID with a newline in it, which mustn't be mistaken for a row
+        self.keys[7].add_uid(
+            'odd\n"0000 0000 0000 0000 0000  0000 0000 0000 0000 0001",'
+        )
+
+        self.csv_fn = pjoin(self.temp_dir, 'keys.csv')
+        self.store_dir = pjoin(self.temp_dir, 'keys.store')
+
+        with make_atomic_csv_writer(self.csv_fn, config.csv_header) as w, \
+                make_atomic_key_store_writer(self.store_dir) as store:
+            for key in self.keys:
+                write_key_to_csv(key, w)
+                store.write(key)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _read_all(self, partitions, **kwargs):
+        return [
+            [str(uid) for uid in key.uids]
+            for partition in partitions
+            for key in read_partition(partition, **kwargs)
+        ]
+
+    def test_csv_partitions_cover_every_row_once(self):
+        expected = [[str(uid) for uid in key.uids] for key in self.keys]
+
+        for count in (1, 2, 3, 7, 50, 200):
+            assert_equal(
+                expected, self._read_all(csv_partitions(self.csv_fn, count)),
+                '{} partitions'.format(count)
+            )
+
+    def test_store_partitions_cover_every_key_once(self):
+        expected = [[str(uid) for uid in key.uids] for key in self.keys]
+
+        for count in (1, 3, 200):
+            assert_equal(
+                expected,
+                self._read_all(store_partitions(self.store_dir, count))
+            )
+
+    def test_store_partitions_only_read_expiring_keys(self):
+        expected = [
+            [str(uid) for uid in key.uids] for key in self.keys
+            if key.expires_in(3)
+        ]
+
+        assert_equal(
+            expected,
+            self._read_all(store_partitions(self.store_dir, 4), expiring_in=3)
+        )
+
+    def test_empty_csv(self):
+        empty_fn = pjoin(self.temp_dir, 'empty.csv')
+
+        with make_atomic_csv_writer(empty_fn, config.csv_header):
+            pass
+
+        assert_equal([], self._read_all(csv_partitions(empty_fn, 3)))
@@ -1,4 +1,5 @@
-from .pgp_key import PGPKey, UID
+from .config import config
+from .pgp_key import PGPKey, UID, DERIVED_COLUMNS_VERSION, derived_version
 from nose.tools import assert_equal
 
 
@@ -26,3 +27,77 @@ def test_parse_email_line():
 def test_uid_class():
     uid = UID('hello')
     assert_equal('hello', str(uid))
+
+
+def make_strong_key(uids):
+    return PGPKey(
+        fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517',
+        algorithm_number='1',
+        size_bits='4096',
+        uids=uids
+    )
+
+
+def test_derived_columns():
+    key = make_strong_key('Paul <paul@example.com>|Paul <paul@Example.org>')
+
+    assert_equal({
+        'derived_version': derived_version(),
+        'recipient_email_line': 'Paul <paul@Example.org>',
+        'is_strong': 1,
+        'exclusion_reason': '',
+        'domains': 'example.com|example.org',
+    }, key.derived_columns())
+
+
+def test_stored_derived_columns_are_used():
+    row = {k: str(v) for k, v in
+           make_strong_key('Paul <paul@example.com>').derived_columns().items()}
+    row.update({
+        'recipient_email_line': 'Someone Else <else@example.com>',
+        'exclusion_reason': 'weak-key',
+    })
+
+    key = PGPKey(uids='Paul <paul@example.com>', **row)
+
+    assert_equal('else@example.com', key.most_likely_uid().email)
+    assert_equal('weak-key', key.exclusion_reason)
+    assert_equal(['example.com'], key.domains)
+
+
+def test_stored_derived_columns_from_other_version_are_ignored():
+    row = {k: str(v) for k, v in
+           make_strong_key('Paul <paul@example.com>').derived_columns().items()}
+    row['derived_version'] = '{}-{}'.format(
+        DERIVED_COLUMNS_VERSION - 1, config.domain_rules.digest)
+    row['recipient_email_line'] = 'Someone Else <else@example.com>'
+
+    key = PGPKey(uids='Paul <paul@example.com>', **row)
+
+    assert_equal('paul@example.com', key.most_likely_uid().email)
+
+
+def test_stored_derived_columns_from_other_blacklist_are_ignored():
+    old_rules = list(config.blacklisted_domains)
+    row = {k: str(v) for k, v in
+           make_strong_key('Paul <paul@example.com>').derived_columns().items()}
+
+    try:
+        config.blacklisted_domains = ['example.com']
+        key = PGPKey(algorithm_number='1', size_bits='4096',
+                     uids='Paul <paul@example.com>', **row)
+
+        assert_equal(None, key.most_likely_uid())
+        assert_equal('all-blacklisted-domains', key.exclusion_reason)
+    finally:
+        config.blacklisted_domains = old_rules
+
+
+def test_adding_uid_invalidates_stored_columns():
+    row = {k: str(v) for k, v in
+           make_strong_key('Paul <paul@example.com>').derived_columns().items()}
+
+    key = PGPKey(uids='Paul <paul@example.com>', **row)
+    key.add_uid('Paul <paul@example.net>')
+
+    assert_equal('paul@example.net', key.most_likely_uid().email)
@@ -0,0 +1,95 @@
+import datetime
+import shutil
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal, assert_raises
+import unittest
+
+from .exceptions import DailyCapReached
+from .rate_limiter import PersistentTokenBucket
+
+
+class FakeClock():
+    def __init__(self, start):
+        self.now = start
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestPersistentTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.state_filename = pjoin(self.temp_dir, 'rate_limit.json')
+        self.clock = FakeClock(
+            datetime.datetime(2018, 1, 1, 9, 0).timestamp()
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _make_bucket(self, **kwargs):
+        return PersistentTokenBucket(
+            self.state_filename, per_hour=60,
+            clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_first_acquire_does_not_wait(self):
+        self._make_bucket().acquire()
+
+        assert_equal([], self.clock.sleeps)
+
+    def test_sends_are_spaced_evenly(self):
+        bucket = self._make_bucket()
+
+        for _ in range(3):
+            bucket.acquire()
+
+        assert_equal([60, 60], self.clock.sleeps)
+
+    def test_state_is_shared_between_instances(self):
+        self._make_bucket().acquire()
+        self._make_bucket().acquire()
+
+        assert_equal([60], self.clock.sleeps)
+
+    def test_daily_cap(self):
+        bucket = self._make_bucket(daily_cap=2)
+
+        bucket.acquire()
+        bucket.acquire()
+
+        assert_raises(DailyCapReached, bucket.acquire)
+
+    def test_daily_cap_resets_next_day(self):
+        bucket = self._make_bucket(daily_cap=1)
+        bucket.acquire()
+
+        self.clock.now += 24 * 60 * 60
+
+        bucket.acquire()
+        assert_equal(1, bucket.sent_today())
+
+    def test_refund_gives_back_daily_cap(self):
+        bucket = self._make_bucket(daily_cap=1)
+
+        bucket.acquire()
+        bucket.refund()
+
+        assert_equal(0, bucket.sent_today())
+        bucket.acquire()  # doesn't raise DailyCapReached
+
+    def test_acquire_not_counting_towards_daily_cap(self):
+        bucket = self._make_bucket(daily_cap=1)
+
+        bucket.acquire(counts_towards_daily_cap=False)
+        bucket.acquire()
+
+        assert_equal(1, bucket.sent_today())
@@ -0,0 +1,57 @@
+import datetime
+
+from nose.tools import assert_equal
+import unittest
+
+from .renewal_report import (
+    CohortColumns, cohort_renewal_rates, domain_renewal_rates, to_day_number,
+    NOT_RENEWED
+)
+
+TODAY = datetime.date(2018, 1, 10)
+DAY_1 = to_day_number(datetime.date(2018, 1, 1))
+DAY_8 = to_day_number(datetime.date(2018, 1, 8))
+
+
+class TestRenewalReport(unittest.TestCase):
+
+    def setUp(self):
+        self.columns = CohortColumns(
+            cohort_day=[DAY_1, DAY_1, DAY_1, DAY_1, DAY_8],
+            emailed=[True, True, False, False, True],
+            domain=[0, 1, 0, 1, 0],
+            renewal_lag=[1, 5, NOT_RENEWED, 2, 1],
+            domains=['example.com', 'gmail.com']
+        )
+
+    def test_cohort_renewal_rates(self):
+        rows = cohort_renewal_rates(self.columns, [1, 3, 7], TODAY)
+
+        assert_equal(3, len(rows))
+
+        assert_equal(
+            ('2018-01-01', False, 2, 0.0, 50.0, 50.0),
+            tuple(rows[0].values())
+        )
+        assert_equal(
+            ('2018-01-01', True, 2, 50.0, 50.0, 100.0),
+            tuple(rows[1].values())
+        )
+
+    def test_lags_not_yet_elapsed_are_none(self):
+        rows = cohort_renewal_rates(self.columns, [1, 3, 7], TODAY)
+
+        assert_equal(
+            ('2018-01-08', True, 1, 100.0, None, None),
+            tuple(rows[2].values())
+        )
+
+    def test_domain_renewal_rates(self):
+        rates = domain_renewal_rates(self.columns, 3, TODAY, min_keys=1)
+
+        assert_equal({'example.com': 1.0, 'gmail.com': 0.0}, dict(rates))
+
+    def test_domain_renewal_rates_minimum_keys(self):
+        rates = domain_renewal_rates(self.columns, 1, TODAY, min_keys=2)
+
+        assert_equal({'example.com': 1.0}, dict(rates))
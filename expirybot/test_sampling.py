@@ -0,0 +1,55 @@
+import random
+
+from nose.tools import assert_equal, assert_almost_equal
+from collections import Counter
+
+from . import sampling
+from .sampling import (
+    sample_size_for_interval, stratified_sample, wilson_interval
+)
+
+
+def test_sample_size_for_large_population():
+    assert_equal(385, sample_size_for_interval(10 ** 9, 0.1))
+
+
+def test_sample_size_applies_finite_population_correction():
+    assert_equal(278, sample_size_for_interval(1000, 0.1))
+
+
+def test_sample_size_never_exceeds_population():
+    assert_equal(20, sample_size_for_interval(20, 0.01))
+
+
+def test_stratified_sample_is_proportional():
+    items = ['a'] * 600 + ['b'] * 300 + ['c'] * 100
+
+    sample = stratified_sample(items, 100, lambda x: x, random.Random(1))
+
+    assert_equal({'a': 60, 'b': 30, 'c': 10}, dict(Counter(sample)))
+
+
+def test_stratified_sample_hands_out_remainders():
+    items = ['a'] * 5 + ['b'] * 5 + ['c'] * 5
+
+    sample = stratified_sample(items, 7, lambda x: x, random.Random(1))
+
+    assert_equal(7, len(sample))
+
+
+def test_wilson_interval():
+    low, high = wilson_interval(50, 100)
+
+    assert_almost_equal(0.4038, low, places=4)
+    assert_almost_equal(0.5962, high, places=4)
+
+
+def test_wilson_interval_for_empty_sample():
+    assert_equal((0.0, 1.0), wilson_interval(0, 0))
+
+
+def test_two_proportion_z_test():
+    z, p_value = sampling.two_proportion_z_test(60, 100, 40, 100)
+
+    assert_almost_equal(2.8284, z, places=4)
+    assert_almost_equal(0.00468, p_value, places=5)
@@ -1,12 +1,21 @@
 import datetime
+import io
+import os
+import shutil
 import tempfile
 
-from nose.tools import assert_equal
+from nose.tools import assert_equal, assert_raises
 import unittest
+from unittest.mock import patch
 
 import freezegun
 
-from .send_emails import ExpiryEmail
+from .rate_limiter import PersistentTokenBucket
+from .send_emails import (
+    ExpiryEmail, group_keys_by_recipient, drop_stale_keys, send_email,
+    setup_output_csvs
+)
+from .utils import write_key_to_csv
 from .pgp_key import PGPKey
 from .test_utils import open_sample, sample_filename
 from .config import config
@@ -76,3 +85,174 @@ class TestExpiryEmailClass(unittest.TestCase):
             'reply-to@example.com',
             self.expiry_email.reply_to
         )
+
+
+class TestExpiryEmailForMultipleKeys(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        keys = [
+            PGPKey(
+                fingerprint=fingerprint,
+                algorithm_number=1,
+                size_bits=4096,
+                uids='Paul <paul@example.com>',
+                expiry_date=expiry_date
+            ) for fingerprint, expiry_date in [
+                ('A999B7498D1A8DC473E53C92309F635DAD1B5517',
+                 datetime.date(2017, 12, 5)),
+                ('5DD5B8F28CBEFA024F9F472B638C78A5E281ACDB',
+                 datetime.date(2017, 12, 4)),
+            ]
+        ]
+
+        with freezegun.freeze_time(datetime.date(2017, 12, 1)), \
+                patch('expirybot.send_emails.make_unsubscribe_link',
+                      return_value='https://example.com/unsubscribe'):
+            cls.expiry_email = ExpiryEmail(*keys)
+
+    def test_subject(self):
+        assert_equal(
+            '2 PGP keys expire in 3 days (they can be extended)',
+            self.expiry_email.subject
+        )
+
+    def test_covers_all_keys(self):
+        assert_equal(2, len(self.expiry_email.keys))
+
+
+def test_group_keys_by_recipient():
+    keys = [
+        PGPKey(fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517',
+               uids='Paul <paul@example.com>'),
+        PGPKey(fingerprint='5DD5B8F28CBEFA024F9F472B638C78A5E281ACDB',
+               uids='Someone <someone@example.com>'),
+        PGPKey(fingerprint='E62A8D9AA0E67A6716AB7B40B64CF4B719A4FECC',
+               uids='Paul <PAUL@example.com>'),
+        PGPKey(fingerprint='0000000000000000000000000000000000000000',
+               uids='No email'),
+    ]
+
+    groups = group_keys_by_recipient(keys)
+
+    assert_equal(['paul@example.com', 'someone@example.com'],
+                 list(groups.keys()))
+    assert_equal([keys[0], keys[2]], groups['paul@example.com'])
+
+
+@freezegun.freeze_time('2017-12-01')
+def test_drop_stale_keys():
+    def make_key(fingerprint, expiry_date):
+        return PGPKey(fingerprint=fingerprint,
+                      expiry_date=expiry_date)
+
+    unchanged = make_key('A999B7498D1A8DC473E53C92309F635DAD1B5517',
+                         datetime.date(2017, 12, 4))
+    renewed = make_key('5DD5B8F28CBEFA024F9F472B638C78A5E281ACDB',
+                       datetime.date(2017, 12, 4))
+    revoked = make_key('E62A8D9AA0E67A6716AB7B40B64CF4B719A4FECC',
+                       datetime.date(2017, 12, 4))
+    unknown = make_key('0000000000000000000000000000000000000000',
+                       datetime.date(2017, 12, 4))
+    expired = make_key('1111111111111111111111111111111111111111',
+                       datetime.date(2017, 11, 30))
+    too_early = make_key('2222222222222222222222222222222222222222',
+                         datetime.date(2017, 12, 10))
+
+    current_renewed = make_key(str(renewed.fingerprint),
+                               datetime.date(2018, 12, 4))
+    current_revoked = make_key(str(revoked.fingerprint),
+                               datetime.date(2017, 12, 4))
+    current_revoked.set_revoked()
+
+    class FakeKeyLookup():
+        def lookup_many(self, fingerprints):
+            return {
+                unchanged.fingerprint: unchanged,
+                renewed.fingerprint: current_renewed,
+                revoked.fingerprint: current_revoked,
+                unknown.fingerprint: None,
+            }
+
+    batch = [
+        ('a@example.com', [unchanged, renewed]),
+        ('b@example.com', [revoked]),
+        ('c@example.com', [unknown]),
+        ('d@example.com', [expired, too_early]),
+    ]
+
+    assert_equal(
+        [[unchanged], [unknown]],
+        list(drop_stale_keys(batch, FakeKeyLookup()))
+    )
+
+
+def test_append_to_emails_sent_with_old_header():
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+        f.write('"fingerprint","uids"\n')
+
+    try:
+        with setup_output_csvs(f.name) as emails_sent_csv:
+            write_key_to_csv(
+                PGPKey(fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517',
+                       uids='Paul <paul@example.com>'),
+                emails_sent_csv
+            )
+
+        with io.open(f.name) as f2:
+            assert_equal([
+                '"fingerprint","uids"',
+                '"A999 B749 8D1A 8DC4 73E5  3C92 309F 635D AD1B 5517",'
+                '"Paul <paul@example.com>"',
+            ], f2.read().splitlines())
+    finally:
+        os.unlink(f.name)
+
+
+class FakeTransport():
+    def __init__(self, result):
+        self.result = result
+
+    def send(self, email):
+        if isinstance(self.result, Exception):
+            raise self.result
+
+        return self.result
+
+
+class FakeEmailToSend():
+    ok_to_send = True
+    key = 'key'
+    to = 'paul@example.com'
+    subject = 'subject'
+    body = 'body'
+
+
+def test_failed_send_leaves_daily_cap_unchanged():
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        rate_limiter = PersistentTokenBucket(
+            os.path.join(temp_dir, 'rate_limit.json'), per_hour=3600000,
+            daily_cap=1
+        )
+
+        assert_equal(
+            False,
+            send_email(FakeEmailToSend(), FakeTransport(False), rate_limiter)
+        )
+        assert_equal(0, rate_limiter.sent_today())
+
+        assert_raises(
+            ConnectionError, send_email, FakeEmailToSend(),
+            FakeTransport(ConnectionError()), rate_limiter
+        )
+        assert_equal(0, rate_limiter.sent_today())
+
+        assert_equal(
+            True,
+            send_email(FakeEmailToSend(), FakeTransport(True), rate_limiter)
+        )
+        assert_equal(1, rate_limiter.sent_today())
+
+    finally:
+        shutil.rmtree(temp_dir)
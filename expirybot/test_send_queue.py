@@ -0,0 +1,102 @@
+import datetime
+
+from nose.tools import assert_equal
+import unittest
+
+import freezegun
+
+from .pgp_key import PGPKey
+from .send_queue import SendQueue
+
+
+def make_key(days_until_expiry, size_bits=4096):
+    return PGPKey(
+        fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517',
+        algorithm_number=1,
+        size_bits=size_bits,
+        expiry_date=datetime.date(2018, 1, 1) + datetime.timedelta(
+            days=days_until_expiry)
+    )
+
+
+class FakeLedger():
+    def __init__(self, addresses):
+        self.addresses = addresses
+
+    def has_emailed_address(self, email):
+        return email in self.addresses
+
+
+@freezegun.freeze_time(datetime.date(2018, 1, 1))
+class TestSendQueue(unittest.TestCase):
+
+    def _drain(self, queue):
+        addresses = []
+
+        while queue:
+            email_address, _ = queue.pop()
+            addresses.append(email_address)
+
+        return addresses
+
+    def test_most_urgent_first(self):
+        queue = SendQueue()
+        queue.push('later@example.com', [make_key(3)])
+        queue.push('sooner@example.com', [make_key(1)])
+
+        assert_equal(['sooner@example.com', 'later@example.com'],
+                     self._drain(queue))
+
+    def test_equal_scores_keep_insertion_order(self):
+        queue = SendQueue()
+        queue.push('a@example.com', [make_key(3)])
+        queue.push('b@example.com', [make_key(3)])
+
+        assert_equal(['a@example.com', 'b@example.com'], self._drain(queue))
+
+    def test_more_keys_first(self):
+        queue = SendQueue()
+        queue.push('one@example.com', [make_key(3)])
+        queue.push('two@example.com', [make_key(3), make_key(3)])
+
+        assert_equal(['two@example.com', 'one@example.com'],
+                     self._drain(queue))
+
+    def test_previously_emailed_address_last(self):
+        queue = SendQueue(ledger=FakeLedger(['old@example.com']))
+        queue.push('old@example.com', [make_key(3)])
+        queue.push('new@example.com', [make_key(3)])
+
+        assert_equal(['new@example.com', 'old@example.com'],
+                     self._drain(queue))
+
+    def test_weaker_key_last(self):
+        queue = SendQueue()
+        queue.push('weak@example.com', [make_key(3, size_bits=2048)])
+        queue.push('strong@example.com', [make_key(3, size_bits=4096)])
+
+        assert_equal(['strong@example.com', 'weak@example.com'],
+                     self._drain(queue))
+
+    def test_domain_renewal_rate(self):
+        queue = SendQueue(domain_renewal_rates={
+            'renews.com': 0.4, 'ignores.com': 0.1
+        })
+        queue.push('a@ignores.com', [make_key(3)])
+        queue.push('b@unknown.com', [make_key(3)])
+        queue.push('c@renews.com', [make_key(3)])
+
+        assert_equal(['c@renews.com', 'b@unknown.com', 'a@ignores.com'],
+                     self._drain(queue))
+
+    def test_push_while_draining(self):
+        queue = SendQueue()
+        queue.push('later@example.com', [make_key(3)])
+        queue.push('later2@example.com', [make_key(3)])
+
+        first, _ = queue.pop()
+        queue.push('sooner@example.com', [make_key(1)])
+
+        assert_equal('later@example.com', first)
+        assert_equal(['sooner@example.com', 'later2@example.com'],
+                     self._drain(queue))
@@ -0,0 +1,130 @@
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal, assert_true, assert_false
+import unittest
+
+from .config import config
+from .pgp_key import PGPKey
+from .sent_ledger import SentLedger, import_emails_sent_csv
+from .utils import make_atomic_csv_writer, write_key_to_csv
+
+
+KEY = PGPKey(
+    fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517',
+    algorithm_number=1,
+    size_bits=4096,
+    uids='Paul <paul@example.com>',
+    expiry_date='2018-01-04'
+)
+
+RENEWED_KEY = PGPKey(
+    fingerprint='A999B7498D1A8DC473E53C92309F635DAD1B5517',
+    algorithm_number=1,
+    size_bits=4096,
+    uids='Paul <paul@example.com>',
+    expiry_date='2019-01-04'
+)
+
+
+class TestSentLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = pjoin(self.temp_dir, 'sent_ledger.db')
+        self.ledger = SentLedger(self.filename)
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_unknown_key_not_emailed(self):
+        assert_false(self.ledger.has_emailed_key(KEY))
+
+    def test_claimed_key_is_emailed(self):
+        assert_true(self.ledger.claim(KEY, 'paul@example.com'))
+
+        assert_true(self.ledger.has_emailed_key(KEY))
+
+    def test_key_can_only_be_claimed_once(self):
+        other = SentLedger(self.filename)
+
+        assert_true(self.ledger.claim(KEY, 'paul@example.com'))
+        assert_false(other.claim(KEY, 'paul@example.com'))
+        other.close()
+
+    def test_renewed_key_is_emailed_again(self):
+        self.ledger.claim(KEY, 'paul@example.com')
+
+        assert_false(self.ledger.has_emailed_key(RENEWED_KEY))
+        assert_true(self.ledger.claim(RENEWED_KEY, 'paul@example.com'))
+
+    def test_released_claim_can_be_claimed_again(self):
+        self.ledger.release(self.ledger.claim(KEY, 'paul@example.com'))
+
+        assert_false(self.ledger.has_emailed_key(KEY))
+        assert_true(self.ledger.claim(KEY, 'paul@example.com'))
+
+    def test_release_keeps_earlier_rows_for_key_without_expiry(self):
+        key = PGPKey(fingerprint=KEY.fingerprint.hex_format)
+
+        self.ledger.claim(key, 'paul@example.com',
+                          sent_at=datetime.datetime(2018, 1, 1))
+        claim = self.ledger.claim(key, 'paul@example.com',
+                                  sent_at=datetime.datetime(2019, 1, 1))
+        self.ledger.release(claim)
+
+        assert_true(self.ledger.has_emailed_key(
+            key, now=datetime.datetime(2018, 1, 2)))
+
+    def test_upgrades_ledger_without_expiry_dates(self):
+        self.ledger.close()
+        os.remove(self.filename)
+
+        conn = sqlite3.connect(self.filename)
+        conn.execute('CREATE TABLE sent (long_id TEXT NOT NULL, '
+                     'fingerprint TEXT NOT NULL, email TEXT NOT NULL, '
+                     'sent_at TEXT NOT NULL)')
+        conn.execute('INSERT INTO sent VALUES (?, ?, ?, ?)', (
+            KEY.long_id, KEY.fingerprint.hex_format, 'paul@example.com',
+            '2018-01-01T09:00:00'))
+        conn.commit()
+        conn.close()
+
+        self.ledger = SentLedger(self.filename)
+
+        # old rows without an expiry date only count for a while
+        assert_true(self.ledger.has_emailed_key(
+            KEY, now=datetime.datetime(2018, 1, 2)))
+        assert_false(self.ledger.has_emailed_key(
+            KEY, now=datetime.datetime(2019, 1, 2)))
+
+    def test_address_lookup_ignores_case(self):
+        self.ledger.claim(KEY, 'Paul@Example.com')
+
+        assert_true(self.ledger.has_emailed_address('paul@EXAMPLE.com'))
+
+    def test_ledger_persists_between_instances(self):
+        self.ledger.claim(KEY, 'paul@example.com')
+
+        other = SentLedger(self.filename)
+        assert_true(other.has_emailed_key(KEY))
+        other.close()
+
+    def test_import_emails_sent_csv(self):
+        day_dir = pjoin(self.temp_dir, '2018-01-01')
+        os.mkdir(day_dir)
+        emails_sent_csv = pjoin(day_dir, 'emails_sent.csv')
+
+        with make_atomic_csv_writer(emails_sent_csv, config.csv_header) as w:
+            write_key_to_csv(KEY, w)
+
+        assert_equal(1, import_emails_sent_csv(self.ledger, emails_sent_csv))
+        assert_equal(0, import_emails_sent_csv(self.ledger, emails_sent_csv))
+
+        assert_true(self.ledger.has_emailed_address('paul@example.com'))
@@ -0,0 +1,176 @@
+import smtplib
+import socket
+
+from aiosmtpd.controller import Controller
+from nose.tools import assert_equal, assert_true, assert_false
+import unittest
+from unittest.mock import MagicMock
+
+from .smtp_transport import SMTPConnectionPool, SMTPTransport
+
+
+class FakeEmail():
+    to = 'Paul <paul@example.com>'
+    from_line = 'from-line@example.com'
+    reply_to = ''
+    list_unsubscribe_header = '<https://example.com/unsubscribe>'
+    subject = 'PGP key expires in 3 days'
+    body = 'Hello'
+
+
+class TestSMTPTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+
+        def make_connection(host, port, timeout):
+            conn = MagicMock()
+            conn.send_message.return_value = {}
+            conn.noop.return_value = (250, b'OK')
+            self.connections.append(conn)
+            return conn
+
+        self.smtp_class = MagicMock(side_effect=make_connection)
+
+        self.transport = SMTPTransport(SMTPConnectionPool(
+            'localhost', 8025, username='user', password='pass',
+            smtp_class=self.smtp_class
+        ))
+
+    def test_connection_reused_across_messages(self):
+        assert_true(self.transport.send(FakeEmail()))
+        assert_true(self.transport.send(FakeEmail()))
+
+        assert_equal(1, self.smtp_class.call_count)
+        assert_equal(2, self.connections[0].send_message.call_count)
+
+    def test_login_once_per_connection(self):
+        self.transport.send(FakeEmail())
+        self.transport.send(FakeEmail())
+
+        self.connections[0].login.assert_called_once_with('user', 'pass')
+
+    def test_all_recipients_refused_returns_false(self):
+        self.transport.send(FakeEmail())
+        self.connections[0].send_message.side_effect = \
+            smtplib.SMTPRecipientsRefused({'paul@example.com': (550, b'')})
+
+        assert_false(self.transport.send(FakeEmail()))
+
+    def test_permanent_refusal_returns_false(self):
+        self.transport.send(FakeEmail())
+        self.connections[0].send_message.side_effect = \
+            smtplib.SMTPDataError(554, b'Message rejected')
+
+        assert_false(self.transport.send(FakeEmail()))
+
+        self.connections[0].send_message.side_effect = None
+        assert_true(self.transport.send(FakeEmail()))
+        assert_equal(1, self.smtp_class.call_count)
+
+    def test_temporary_refusal_raises_and_drops_connection(self):
+        self.transport.send(FakeEmail())
+        self.connections[0].send_message.side_effect = \
+            smtplib.SMTPSenderRefused(451, b'Try again later', 'from')
+
+        with self.assertRaises(smtplib.SMTPSenderRefused):
+            self.transport.send(FakeEmail())
+
+        assert_true(self.transport.send(FakeEmail()))
+        assert_equal(2, self.smtp_class.call_count)
+        self.connections[0].close.assert_called_once_with()
+
+    def test_timeout_drops_connection(self):
+        self.transport.send(FakeEmail())
+        self.connections[0].send_message.side_effect = socket.timeout()
+
+        with self.assertRaises(socket.timeout):
+            self.transport.send(FakeEmail())
+
+        assert_true(self.transport.send(FakeEmail()))
+        assert_equal(2, self.smtp_class.call_count)
+
+    def test_reconnects_when_server_disconnects(self):
+        self.transport.send(FakeEmail())
+        self.connections[0].send_message.side_effect = \
+            smtplib.SMTPServerDisconnected()
+
+        assert_true(self.transport.send(FakeEmail()))
+        assert_equal(2, self.smtp_class.call_count)
+
+    def test_close_quits_connections(self):
+        self.transport.send(FakeEmail())
+        self.transport.close()
+
+        self.connections[0].quit.assert_called_once_with()
+
+    def test_message_headers(self):
+        self.transport.send(FakeEmail())
+
+        message = self.connections[0].send_message.call_args[0][0]
+
+        assert_equal('Paul <paul@example.com>', message['To'])
+        assert_equal('from-line@example.com', message['From'])
+        assert_equal(None, message['Reply-To'])
+        assert_equal('<https://example.com/unsubscribe>',
+                     message['List-Unsubscribe'])
+
+
+class RecordingHandler():
+    """
+    aiosmtpd handler which keeps every message, and the session (that is,
+    the connection) it arrived on.
+    """
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session, envelope))
+        return '250 OK'
+
+
+def free_port():
+    # aiosmtpd's Controller can't listen on port 0 itself
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestSMTPTransportWithLocalServer(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = RecordingHandler()
+        self.controller = Controller(
+            self.handler, hostname='127.0.0.1', port=free_port()
+        )
+        self.controller.start()
+
+        self.transport = SMTPTransport(SMTPConnectionPool(
+            '127.0.0.1', self.controller.port, size=2, timeout=5
+        ))
+
+    def tearDown(self):
+        self.transport.close()
+        self.controller.stop()
+
+    def test_messages_arrive(self):
+        assert_true(self.transport.send(FakeEmail()))
+
+        assert_equal(1, len(self.handler.messages))
+        _, envelope = self.handler.messages[0]
+
+        assert_equal('from-line@example.com', envelope.mail_from)
+        assert_equal(['paul@example.com'], envelope.rcpt_tos)
+        assert_true(b'Subject: PGP key expires in 3 days' in envelope.content)
+        assert_true(b'List-Unsubscribe: <https://example.com/unsubscribe>'
+                    in envelope.content)
+
+    def test_connection_reused_across_messages(self):
+        for _ in range(5):
+            assert_true(self.transport.send(FakeEmail()))
+
+        sessions = set(id(session) for session, _ in self.handler.messages)
+
+        assert_equal(5, len(self.handler.messages))
+        assert_equal(1, len(sessions))
@@ -0,0 +1,84 @@
+import datetime
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import threading
+
+from os.path import join as pjoin
+
+from nose.tools import assert_equal, assert_is_none
+import unittest
+
+from .streams import InputStream
+from .make_fingerprint_csv import read_short_ids, format_progress
+
+SHORT_IDS = '0x309F635D\n0xAD1B5517\n\n0xE281ACDB\n'
+
+
+class TestInputStream(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_plain_file(self):
+        filename = pjoin(self.temp_dir, 'short_ids.txt')
+
+        with io.open(filename, 'w') as f:
+            f.write(SHORT_IDS)
+
+        stream = InputStream(filename)
+        assert_equal(len(SHORT_IDS), stream.total_bytes)
+
+        lines = list(stream)
+        stream.close()
+
+        assert_equal(SHORT_IDS.splitlines(True), lines)
+        assert_equal(1.0, stream.fraction_read)
+
+    def test_gzip_file(self):
+        filename = pjoin(self.temp_dir, 'short_ids.txt.gz')
+
+        with gzip.open(filename, 'wt') as f:
+            f.write(SHORT_IDS)
+
+        assert_equal(
+            ['0x309F635D', '0xAD1B5517', '0xE281ACDB'],
+            list(read_short_ids(filename))
+        )
+
+    def test_fifo_has_no_total(self):
+        filename = pjoin(self.temp_dir, 'short_ids.fifo')
+        os.mkfifo(filename)
+
+        def write():
+            with io.open(filename, 'w') as f:
+                f.write(SHORT_IDS)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+
+        stream = InputStream(filename)
+        lines = list(stream)
+        stream.close()
+        writer.join()
+
+        assert_equal(4, len(lines))
+        assert_is_none(stream.total_bytes)
+        assert_is_none(stream.fraction_read)
+
+
+def test_format_progress():
+    assert_equal(
+        '10 short ids in 0:00:10 (11 days, 13:46:40 per million), '
+        '25.0% of input, eta 0:00:30',
+        format_progress(10, 0.25, datetime.timedelta(seconds=10))
+    )
+    assert_equal(
+        '10 short ids in 0:00:10 (11 days, 13:46:40 per million)',
+        format_progress(10, None, datetime.timedelta(seconds=10))
+    )
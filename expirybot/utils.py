@@ -1,15 +1,19 @@
+import atexit
 import csv
 import io
 import logging
+import shutil
 import sys
 import os
 
 from os.path import join as pjoin
-from contextlib import contextmanager
+from contextlib import closing, contextmanager
 from .config import config
 
 import rollbar
 
+from .key_store import KeyStore, KeyStoreWriter
+from .logs import AsyncLogHandler, log_sampled_counts
 from .pgp_key import PGPKey
 
 
@@ -28,12 +32,38 @@ def make_atomic_csv_writer(output_filename, header):
         )
 
 
-def setup_logging(log_filename):
+@contextmanager
+def make_atomic_key_store_writer(output_dirname):
+    temp_dirname = atomic_filename(output_dirname)
+
+    if os.path.isdir(temp_dirname):
+        shutil.rmtree(temp_dirname)  # left over from a failed run
+
+    with closing(KeyStoreWriter(temp_dirname)) as writer:
+        yield writer
+
+    replace_directory(temp_dirname, output_dirname)
+
+
+def setup_logging(log_filename, asynchronous=True):
+    """
+    Log to a file. By default records are written by a background thread,
+    so logging in the crawl and filter loops doesn't wait on the disk.
+    """
     sys.excepthook = _handle_exception
 
-    logging.basicConfig(level=logging.INFO,
-                        filename=log_filename,
-                        format='%(asctime)s %(levelname)s %(message)s')
+    handler = logging.FileHandler(log_filename)
+    handler.setFormatter(
+        logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    )
+
+    if asynchronous:
+        handler = AsyncLogHandler(handler)
+
+    logging.basicConfig(level=logging.INFO, handlers=[handler])
+
+    atexit.register(handler.close)
+    atexit.register(log_sampled_counts)  # runs first
 
 
 def atomic_filename(filename):
@@ -41,6 +71,23 @@ def atomic_filename(filename):
     return pjoin(path, '.{}'.format(name))
 
 
+def replace_directory(source, destination):
+    """
+    Move `source` to `destination`, replacing any existing directory there.
+    """
+    if os.path.isdir(destination):
+        old = atomic_filename(destination) + '.old'
+        os.rename(destination, old)
+        os.rename(source, destination)
+        shutil.rmtree(old)
+    else:
+        os.rename(source, destination)
+
+
+def open_key_store(dirname):
+    return KeyStore(pjoin(config.data_dir, dirname))
+
+
 def load_keys_from_csv(csv_file):
     csv.field_size_limit(500 * 1024 * 1024)
 
@@ -50,7 +97,11 @@ def load_keys_from_csv(csv_file):
 
 
 def write_key_to_csv(key, csv_writer):
-    csv_writer.writerow({
+    csv_writer.writerow(key_to_csv_row(key))
+
+
+def key_to_csv_row(key):
+    row = {
         'fingerprint': key.fingerprint,
         'algorithm_number': key.algorithm_number,
         'size_bits': key.size_bits,
@@ -61,7 +112,9 @@ def write_key_to_csv(key, csv_writer):
         'expiry_date': (
             key.expiry_date.isoformat() if key.expiry_date else ''
         )
-    })
+    }
+    row.update(key.derived_columns())
+    return row
 
 
 def make_today_data_dir(today):